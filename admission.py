@@ -0,0 +1,98 @@
+"""Admission control for upstream model calls.
+
+Each worker process allows at most LLM_MAX_IN_FLIGHT model calls at once.
+A request that cannot get a slot within LLM_ADMISSION_WAIT seconds is
+turned away with 429 and a Retry-After header instead of queueing behind
+slow completions. Background jobs and batches call set_blocking() and wait
+for a slot instead.
+"""
+import contextvars
+import math
+import threading
+import time
+
+import metrics
+import settings
+
+# Retry-After when no slot has been released yet to estimate from
+DEFAULT_RETRY_AFTER = 5
+
+_cond = threading.Condition()
+_in_flight = 0
+_hold_seconds = None  # moving average of how long a slot is held
+_blocking = contextvars.ContextVar("admission_blocking", default=False)
+
+
+class Overloaded(Exception):
+    """Every model call slot in this worker is taken."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM admission limit reached; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def set_blocking(blocking=True):
+    """Make the current thread (or task) wait for a slot instead of raising Overloaded."""
+    _blocking.set(blocking)
+
+
+def in_flight():
+    return _in_flight
+
+
+def retry_after():
+    """Seconds until a slot is likely to free up: the average hold time spread over the slots."""
+    if _hold_seconds is None:
+        return DEFAULT_RETRY_AFTER
+    return max(1, math.ceil(_hold_seconds / settings.LLM_MAX_IN_FLIGHT))
+
+
+class Slot:
+    """Held model call capacity; release() it, or use it as a context manager."""
+
+    def __init__(self, units):
+        self.units = units
+        self._acquired = time.monotonic()
+        self._released = False
+
+    def release(self):
+        global _in_flight, _hold_seconds
+        with _cond:
+            if self._released:
+                return
+            self._released = True
+            _in_flight -= self.units
+            held = time.monotonic() - self._acquired
+            _hold_seconds = held if _hold_seconds is None else 0.8 * _hold_seconds + 0.2 * held
+            _cond.notify_all()
+        metrics.gauge_add("llm_in_flight", -self.units)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def acquire(units=1):
+    """Take units model call slots (a parallel-mode plan makes several calls at once).
+
+    Raises Overloaded when they are not free within LLM_ADMISSION_WAIT
+    seconds, unless set_blocking() was called for this thread.
+    """
+    global _in_flight
+    units = max(1, min(units, settings.LLM_MAX_IN_FLIGHT))
+    deadline = time.monotonic() + settings.LLM_ADMISSION_WAIT
+    with _cond:
+        while _in_flight + units > settings.LLM_MAX_IN_FLIGHT:
+            if _blocking.get():
+                _cond.wait()
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.inc("admission_rejected_total")
+                raise Overloaded(retry_after())
+            _cond.wait(remaining)
+        _in_flight += units
+    metrics.gauge_add("llm_in_flight", units)
+    return Slot(units)
@@ -1,570 +1,569 @@
+# Imported first so that it can time the import of everything below
+import warmup
+
 import os
-import requests
+import json
 import logging
+import time
+import uuid
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
-from openai import OpenAI
-from dotenv import load_dotenv
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from fpdf import FPDF, XPos, YPos
-
-load_dotenv()
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, send_from_directory, url_for
+
+import admission
+import artifacts
+import batch
+import idempotency
+import jobs
+import logging_setup
+import metrics
+import outbox
+import pipeline
+import plan_cache
+import resilience
+from settings import (
+    OPENAI_API_KEY, OPENWEATHER_API_KEY, SMTP_HOST, SMTP_PORT, FLASK_PORT,
+    FLASK_DEBUG, PLAN_GENERATION_MODE, BATCH_MAX_RECORDS, BATCH_OUTPUT_DIR,
+    WORKER_THREADS, LLM_MAX_IN_FLIGHT, ARTIFACT_MAX_AGE, REQUEST_BUDGET_SECONDS, OPENAI_MODEL,
+    HEALTH_WINDOW_SECONDS, HEALTH_MAX_ERROR_RATIO, HEALTH_MAX_OUTBOX_PENDING,
+)
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 
-# Configure logging
-log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging: records are queued and written by a listener thread (see logging_setup.py)
+logging_setup.configure()
 logger = logging.getLogger(__name__)
 
-# API Keys from .env
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
-SMTP_HOST = os.environ.get("SMTP_HOST")
-SMTP_PORT = int(os.environ.get("SMTP_PORT", 465))
-SMTP_USERNAME = os.environ.get("SMTP_USERNAME")
-SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
-EMAIL_FROM = os.environ.get("EMAIL_FROM")
-FLASK_PORT = int(os.environ.get("FLASK_PORT", 3000))
-FLASK_DEBUG = os.environ.get("FLASK_DEBUG", "False").lower() == "true"
-
-PROMPT_TEMPLATE = """
-**User Parameters:**
-1.  **Age:** {age}
-2.  **Gender:** {gender}
-3.  **Height:** {height} cm
-4.  **Weight:** {weight} kg
-5.  **Dosha:** {dosha}
-6.  **Location:** {location}
-7.  **Weather:** {weather}
-8.  **Primary Disease/Health Condition:** {disease}
-9.  **Physiological Data:**
-    * Daily Water Intake: {water}L
-    * BMI: {bmi}  
-    * Sleep Quality: {sleep}
-10. **Secondary Condition:** {secondary_condition}
-11. **Appetite:** {appetite}
-12. **Current Day:** {current_day}
-"""
-
-SYSTEM_INSTRUCTION = """
-You are an expert clinical nutritionist and Ayurvedic specialist. Your task is to generate a highly personalized 7-day Ayurvedic diet plan.
-
-**CRITICAL INSTRUCTIONS:**
-1.  **Analyze the User's Full Profile:** Pay close attention to the user's age, gender, height, weight, and BMI. Use this data to estimate their daily caloric needs.
-2.  **Adjust Portion Sizes:** The portion sizes you recommend must be appropriate for the user's estimated caloric needs. A 25-year-old active male will have different needs than a 50-year-old sedentary female.
-3.  **Personalize for Age and Gender:** Recommendations should be suitable for the user's specific demographic. For example, a plan for a younger person might focus on energy, while a plan for an older person might focus on joint health and digestion.
-4.  **Standard Requirements:**
-    - Generate a 7-day plan starting from the provided Current Day.
-    - Prioritize locally available and seasonal foods for the user's Location and Weather.
-    - For each day, include sections: "General Recommendations", "Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", and "Bedtime".
-    - Provide portion sizes for every food item in grams (g) or milliliters (ml).
-    - Briefly explain why each meal is suitable for the user's complete profile (Dosha, Disease, BMI, Age, etc.).
-    - Output using Markdown headings.
-"""
-
-# PDF Generation Function
-class PDF(FPDF):
-    def header(self):
-        try:
-            self.set_font('DejaVu', 'B', 14)
-        except RuntimeError:
-            self.set_font('Arial', 'B', 14)
-        # Corrected call to avoid deprecation warnings
-        self.cell(0, 10, 'Your Personalized Ayurvedic Diet Plan', align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-        self.ln(10)
-
-    def footer(self):
-        self.set_y(-15)
-        try:
-            
-            self.set_font('DejaVu', 'I', 8)
-        except RuntimeError:
-            self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Page {self.page_no()}', align='C')
-
-def create_pdf(plan_text):
-    pdf = PDF()
-    
-    
-    try:
-        # Adding all three styles: Regular, Bold, and Italic (Oblique)
-        pdf.add_font('DejaVu', '', 'DejaVuSans.ttf')
-        pdf.add_font('DejaVu', 'B', 'DejaVuSans-Bold.ttf')
-        pdf.add_font('DejaVu', 'I', 'DejaVuSans-Oblique.ttf')
-        pdf.set_font('DejaVu', '', 12)
-    except RuntimeError as e:
-        print(f"Font error: {e}. You may be missing font files. Falling back to Arial.")
-        pdf.set_font('Arial', '', 12)
+@app.route("/")
+def index():
+    return render_template("index.html")
 
-    pdf.add_page()
 
-    
-    for line in plan_text.split('\n'):
-        line = line.strip()
-        if not line:
-            pdf.ln(5)
-            continue
-            
-        if line.startswith('### '):
-            pdf.set_font('DejaVu', 'B', 16)
-            pdf.multi_cell(0, 10, line.replace('### ', '').strip())
-            pdf.ln(4)
-        elif line.startswith('#### '):
-            pdf.set_font('DejaVu', 'B', 13)
-            pdf.multi_cell(0, 8, line.replace('#### ', '').strip())
-            pdf.ln(2)
-        elif line.startswith('- '):
-            pdf.set_font('DejaVu', '', 11)
-            clean_line = line.replace('**', '').replace('- ', '', 1).strip()
-            pdf.cell(5) 
-            pdf.multi_cell(0, 7, f'\u2022 {clean_line}')
-            pdf.ln(1)
-        else:
-            pdf.set_font('DejaVu', '', 11)
-            pdf.multi_cell(0, 7, line)
-            pdf.ln(2)
-    
-    
-    return pdf.output()
-
-
-# Email Sending Function 
-def send_email_with_attachment(to_email, subject, body, pdf_content, filename="Ayurvedic_Diet_Plan.pdf"):
-    if not all([SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, EMAIL_FROM]):
-        logger.warning("SMTP settings are not fully configured. Skipping email.")
-        return False
-        
-    msg = MIMEMultipart()
-    msg['From'] = EMAIL_FROM
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    part = MIMEApplication(pdf_content, Name=filename)
-    part['Content-Disposition'] = f'attachment; filename="{filename}"'
-    msg.attach(part)
-
-    context = ssl.create_default_context()
-    
-    # Add retry logic with exponential backoff
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Attempting to send email to {to_email} (attempt {attempt + 1}/{max_retries})")
-            
-            # Create connection with timeout
-            with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context, timeout=30) as server:
-                server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                server.sendmail(EMAIL_FROM, to_email, msg.as_string())
-            
-            logger.info(f"Email sent successfully to {to_email}")
-            return True
-            
-        except smtplib.SMTPConnectError as e:
-            logger.error(f"SMTP connection error (attempt {attempt + 1}): {e}")
-            if attempt == max_retries - 1:
-                logger.error(f"Failed to connect to SMTP server after {max_retries} attempts")
-                return False
-        except smtplib.SMTPAuthenticationError as e:
-            logger.error(f"SMTP authentication error: {e}")
-            return False
-        except smtplib.SMTPException as e:
-            logger.error(f"SMTP error (attempt {attempt + 1}): {e}")
-            if attempt == max_retries - 1:
-                logger.error(f"SMTP failed after {max_retries} attempts")
-                return False
-        except Exception as e:
-            logger.error(f"Unexpected error sending email (attempt {attempt + 1}): {e}")
-            if attempt == max_retries - 1:
-                logger.error(f"Email sending failed after {max_retries} attempts")
-                return False
-        
-        # Wait before retry (exponential backoff)
-        if attempt < max_retries - 1:
-            wait_time = 2 ** attempt
-            logger.info(f"Waiting {wait_time} seconds before retry...")
-            import time
-            time.sleep(wait_time)
-    
-    return False
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # Reuse an upstream id (e.g. from the Node service or a proxy) so logs can be joined
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    logging_setup.set_request_id(g.request_id)
+    metrics.gauge_add("http_requests_in_flight", 1)
 
 
-@app.route("/")
-def index():
-    return render_template("index.html")
+@app.after_request
+def record_request_metrics(response):
+    response.headers["X-Request-ID"] = g.request_id
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.request_started
+    metrics.observe("http_request_seconds", elapsed, route=route)
+    warmup.request_finished(route, elapsed)
+    metrics.inc("http_requests_total", route=route, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if "request_started" in g:
+        metrics.gauge_add("http_requests_in_flight", -1)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics summed over all gunicorn workers"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+_health_window = metrics.Window(HEALTH_WINDOW_SECONDS)
+
+
+def readiness():
+    """Readiness from live metrics: (status, checks). Status is healthy, degraded or unhealthy."""
+    snapshot = metrics.collect()
+    recent = _health_window.deltas(snapshot)
+    checks = {}
+
+    in_flight = metrics.total(snapshot["gauges"], "http_requests_in_flight")
+    capacity = WORKER_THREADS * max(snapshot["processes"], 1)
+    checks["capacity"] = {"ok": in_flight < capacity, "in_flight": in_flight, "capacity": capacity}
+
+    # Every model call slot taken means new generations are being turned away with 429
+    llm_in_flight = metrics.total(snapshot["gauges"], "llm_in_flight")
+    llm_limit = LLM_MAX_IN_FLIGHT * max(snapshot["processes"], 1)
+    checks["admission"] = {"ok": llm_in_flight < llm_limit, "in_flight": llm_in_flight, "limit": llm_limit,
+                           "rejected": metrics.total(recent, "admission_rejected_total")}
+
+    for stage in ("openai", "openweather", "smtp"):
+        errors = metrics.total(recent, "stage_total", stage=stage, outcome="error")
+        calls = metrics.total(recent, "stage_total", stage=stage)
+        ratio = errors / calls if calls else None
+        checks[stage] = {"ok": ratio is None or ratio <= HEALTH_MAX_ERROR_RATIO,
+                         "calls": calls, "error_ratio": round(ratio, 3) if ratio is not None else None}
+
+    # Workers with an open breaker, per dependency, are failing those calls fast
+    open_circuits = {dependency: metrics.total(snapshot["gauges"], "circuit_open", dependency=dependency)
+                     for dependency in resilience.dependencies()}
+    checks["circuits"] = {"ok": not any(open_circuits.values()), "open": open_circuits}
+
+    pending = outbox.stats()[outbox.PENDING]
+    checks["outbox"] = {"ok": pending <= HEALTH_MAX_OUTBOX_PENDING, "pending": pending}
+
+    if not OPENAI_API_KEY or not checks["capacity"]["ok"]:
+        status = "unhealthy"
+    elif all(check["ok"] for check in checks.values()):
+        status = "healthy"
+    else:
+        status = "degraded"
+    return status, checks
 
 
 @app.route("/health")
 def health_check():
-    """Health check endpoint with SMTP configuration status"""
-    smtp_configured = all([SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, EMAIL_FROM])
-    
+    """Readiness derived from live metrics, plus configuration status; 503 when not ready"""
+    smtp_configured = outbox.smtp_configured()
+    status, checks = readiness()
+
     health_status = {
-        "status": "healthy",
+        "status": status,
+        "checks": checks,
+        "window_seconds": HEALTH_WINDOW_SECONDS,
         "timestamp": datetime.now().isoformat(),
         "smtp_configured": smtp_configured,
         "smtp_host": SMTP_HOST if SMTP_HOST else "Not configured",
         "smtp_port": SMTP_PORT if SMTP_PORT else "Not configured",
         "openai_configured": bool(OPENAI_API_KEY),
-        "openweather_configured": bool(OPENWEATHER_API_KEY)
+        "openweather_configured": bool(OPENWEATHER_API_KEY),
+        "plan_cache": plan_cache.stats(),
+        "outbox": outbox.stats(),
+        "artifacts": artifacts.stats(),
+        "startup": warmup.report(),
     }
     
-    return jsonify(health_status)
+    return jsonify(health_status), 503 if status == "unhealthy" else 200
+
+
+def wants_async():
+    """Clients opt into job mode with ?mode=async or an RFC 7240 'Prefer: respond-async' header."""
+    return (request.args.get("mode") == "async"
+            or "respond-async" in request.headers.get("Prefer", ""))
+
+
+def accepted_job(job_id):
+    status_url = url_for("job_status", job_id=job_id)
+    response = jsonify({
+        "job_id": job_id,
+        "status": jobs.QUEUED,
+        "status_url": status_url,
+        "result_url": url_for("job_result", job_id=job_id),
+    })
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+
+@app.errorhandler(admission.Overloaded)
+def overloaded(e):
+    response = jsonify({"error": "Too many plans are being generated right now. Please try again shortly.",
+                        "retry_after": e.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@app.errorhandler(resilience.CircuitOpen)
+def dependency_unavailable(e):
+    response = jsonify({"error": "The plan generator is temporarily unavailable. Please try again shortly.",
+                        "retry_after": e.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@app.errorhandler(resilience.DeadlineExceeded)
+def deadline_exceeded(e):
+    return jsonify({"error": "The plan took too long to generate. Please try again."}), 504
+
+
+@app.errorhandler(idempotency.Conflict)
+def idempotency_conflict(e):
+    return jsonify({"error": "Idempotency-Key was already used for a different request."}), 422
+
+
+def idempotent(scope, payload, execute):
+    """Run execute() -> (result, status_code) once per idempotency key and build the response.
+
+    Duplicates (same Idempotency-Key header, or same route and payload) get
+    the first request's result, marked with an Idempotent-Replayed header.
+    """
+    key, fingerprint = idempotency.make_key(scope, payload, request.headers.get("Idempotency-Key"))
+    result, status_code, replayed = idempotency.run(key, fingerprint, execute)
+    if status_code == 202 and "job_id" in result:
+        response = accepted_job(result["job_id"])
+    else:
+        response = jsonify(result)
+        response.status_code = status_code
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def enqueue_job(kind, payload):
+    return {"job_id": jobs.enqueue(kind, payload)}, 202
 
 
 @app.route("/generate", methods=["POST"])
 def generate_plan():
+    form = request.form.to_dict()
+    if wants_async():
+        return idempotent("generate:async", form, lambda: enqueue_job("generate", form))
+
+    def execute():
+        with resilience.deadline(REQUEST_BUDGET_SECONDS):
+            return run_generate_plan(form)
+
+    return idempotent("generate", form, execute)
+
+
+def plan_json(ctx):
+    """The structured plan for output_format "json" requests, else None."""
+    plan = ctx.get("plan")
+    return plan.to_dict() if plan is not None else None
+
+
+def run_generate_plan(form):
     try:
         # Log request start
         logger.info("=== DIET GENERATION REQUEST STARTED ===")
-        logger.info(f"Request time: {datetime.now()}")
-        
-        email_to = request.form.get("email")
-        age = request.form.get("age", "30")
-        gender = request.form.get("gender", "Female")
-        height = request.form.get("height", "165")
-        weight = request.form.get("weight", "60")
-        dosha = request.form.get("dosha", "mixed")
-        disease = request.form.get("disease", "None")
-        water = request.form.get("water", "2")
-        bmi = request.form.get("bmi", "22")
-        sleep = request.form.get("sleep", "Good")
-        secondary_condition = request.form.get("secondary_condition", "None")
-        appetite = request.form.get("appetite", "Normal")
-        fallback_location = request.form.get("location", "Unknown")
-        latitude = request.form.get("latitude")
-        longitude = request.form.get("longitude")
-
-        # Log user inputs
-        logger.info(f"User Inputs - Age: {age}, Gender: {gender}, Height: {height}cm, Weight: {weight}kg")
-        logger.info(f"User Inputs - Dosha: {dosha}, Disease: {disease}, BMI: {bmi}, Water: {water}L")
-        logger.info(f"User Inputs - Sleep: {sleep}, Appetite: {appetite}, Secondary: {secondary_condition}")
-        logger.info(f"Location: {fallback_location}, Lat: {latitude}, Lon: {longitude}")
-        logger.info(f"Email: {email_to}")
-
-        location_name = fallback_location
-        weather_desc = "Not available"
-
-        # Weather API call
-        if latitude and longitude and OPENWEATHER_API_KEY:
-            try:
-                weather_url = (
-                    f"https://api.openweathermap.org/data/2.5/weather?"
-                    f"lat={latitude}&lon={longitude}&appid={OPENWEATHER_API_KEY}&units=metric"
-                )
-                resp = requests.get(weather_url, timeout=10)
-                resp.raise_for_status()
-                w_data = resp.json()
-
-                city = w_data.get("name", "")
-                country = w_data.get("sys", {}).get("country", "")
-                if city and country:
-                    location_name = f"{city}, {country}"
-
-                weather_main = w_data.get("weather", [{}])[0].get("description", "clear sky")
-                temp = w_data.get("main", {}).get("temp")
-                if temp is not None:
-                    weather_desc = f"{weather_main.title()}, Temp: {temp}°C"
-                else:
-                    weather_desc = weather_main.title()
-                    
-                logger.info(f"Weather API Success - Location: {location_name}, Weather: {weather_desc}")
-            except requests.exceptions.RequestException as ex:
-                logger.warning(f"Weather API failed: {ex}")
-
-        current_day = datetime.now().strftime("%A")
-        logger.info(f"Current day: {current_day}")
-
-        prompt_data = {
-            "age": age, "gender": gender, "height": height, "weight": weight,
-            "dosha": dosha, "location": location_name, "weather": weather_desc,
-            "disease": disease, "water": water, "bmi": bmi, "sleep": sleep,
-            "secondary_condition": secondary_condition, "appetite": appetite,
-            "current_day": current_day,
-        }
-        user_prompt = PROMPT_TEMPLATE.format(**prompt_data)
-
-        # Log prompt being sent
-        logger.info(f"Prompt sent to OpenAI (first 200 chars): {user_prompt[:200]}...")
+        logger.debug(f"Request time: {datetime.now()}")
 
         if not OPENAI_API_KEY:
             logger.error("OpenAI API key not configured")
-            return jsonify({"error": "API key for OpenAI is not configured."}), 500
-
-        # Log API call
-        logger.info("Calling OpenAI API...")
-        
-        client = OpenAI(api_key=OPENAI_API_KEY, timeout=300.0)
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SYSTEM_INSTRUCTION},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=3500,
-            temperature=0.3,
-        )
-        plan_text = completion.choices[0].message.content
-        
+            return {"error": "API key for OpenAI is not configured."}, 500
+
+        ctx = pipeline.FORM_PIPELINE.run(pipeline.new_context(form))
+        plan_text = pipeline.plan_text(ctx)
+
         # Log successful response
         logger.info("=== DIET PLAN GENERATED SUCCESSFULLY ===")
         logger.info(f"Plan length: {len(plan_text)} characters")
-        logger.info(f"Plan preview: {plan_text[:300]}...")
-        logger.info("=== END DIET GENERATION ===")
+        logger.debug(f"Plan preview: {plan_text[:300]}...")
+        logger.debug("=== END DIET GENERATION ===")
 
-        # Generate PDF and Send Email 
-        email_sent = False
-        if plan_text and email_to:
-            try:
-                logger.info(f"Generating PDF and sending email to: {email_to}")
-                pdf_content = create_pdf(plan_text)
-                email_subject = "Your Personalized Ayurvedic Diet Plan"
-                email_body = "Hello,\n\nPlease find your personalized 7-day Ayurvedic diet plan attached.\n\nBest regards,\nSamsara Wellness"
-                
-                email_sent = send_email_with_attachment(email_to, email_subject, email_body, pdf_content)
-                if email_sent:
-                    logger.info(f"Email sent successfully to {email_to}")
-                else:
-                    logger.warning(f"Failed to send email to {email_to}")
-            except Exception as email_error:
-                logger.error(f"Email sending failed with exception: {email_error}")
-                email_sent = False
-        else:
-            logger.info("No email provided or plan text empty - skipping email")
-
-        return jsonify({
+        return {
             "plan": plan_text,
-            "used_location": location_name,
-            "used_weather": weather_desc,
-            "current_day": current_day,
-        })
-
+            "used_location": ctx["location_name"],
+            "used_weather": ctx["weather_desc"],
+            "current_day": ctx["current_day"],
+            "plan_pdf_url": ctx["plan_pdf_url"],
+            "plan_json": plan_json(ctx),
+        }, 200
+
+    except (admission.Overloaded, resilience.CircuitOpen, resilience.DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error(f"=== DIET GENERATION ERROR ===")
         logger.error(f"Error: {str(e)}")
         logger.error(f"Error type: {type(e).__name__}")
         logger.error("=== END ERROR ===")
+        return {"error": "Internal server error"}, 500
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/generate-stream", methods=["POST"])
+def generate_plan_stream():
+    """Streaming variant of /generate: the plan is sent as Server-Sent Events while it is written"""
+    form = request.form.to_dict()
+    logger.info("=== STREAMING DIET GENERATION REQUEST STARTED ===")
+
+    if not OPENAI_API_KEY:
+        logger.error("OpenAI API key not configured")
+        return jsonify({"error": "API key for OpenAI is not configured."}), 500
+
+    # A double submit waits for the first stream and gets its finished plan replayed
+    key, fingerprint = idempotency.make_key("generate-stream", form, request.headers.get("Idempotency-Key"))
+    owner, stored = idempotency.begin(key, fingerprint)
+    if stored is not None:
+        return replayed_stream(*stored)
+    try:
+        response = app.make_response(start_plan_stream(form, key, owner))
+    except BaseException:
+        idempotency.release(key, owner)
+        raise
+    if response.status_code != 200:
+        idempotency.release(key, owner)
+    return response
+
+
+def replayed_stream(result, status_code):
+    """The stored result of an earlier /generate-stream request, as the same events."""
+    if status_code != 200:
+        response = jsonify(result)
+        response.status_code = status_code
+    else:
+        events = (sse_event("meta", {field: result[field] for field in ("used_location", "used_weather", "current_day")})
+                  + sse_event("delta", {"text": result["plan"]})
+                  + sse_event("done", {"email_job_id": result["email_job_id"], "plan_pdf_url": result["plan_pdf_url"]}))
+        response = Response(events, mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def start_plan_stream(form, key, owner):
+    # Streams are written as markdown, and cached under the markdown namespace, whatever output_format asks for
+    ctx = pipeline.new_context(dict(form, output_format="markdown"))
+    generate = pipeline.FORM_PIPELINE.stage("generate")
+    try:
+        with resilience.deadline(REQUEST_BUDGET_SECONDS):
+            pipeline.FORM_PIPELINE.run(ctx, stop="generate")
+        cached = generate.lookup(ctx)
+    except (resilience.CircuitOpen, resilience.DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Failed to prepare streaming request: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+    # Admit before the stream starts: a 429 or 503 cannot be sent once it has
+    if not cached:
+        resilience.available_model(OPENAI_MODEL)
+    slot = None if cached else admission.acquire()
+    settled = []
+
+    def settle(result=None):
+        # Store the finished plan for duplicates, or let a retry run again; once per request
+        if not settled:
+            settled.append(True)
+            if result is None:
+                idempotency.release(key, owner)
+            else:
+                idempotency.finish(key, owner, result, 200)
+
+    def stream():
+        try:
+            yield sse_event("meta", {
+                "used_location": ctx["location_name"],
+                "used_weather": ctx["weather_desc"],
+                "current_day": ctx["current_day"],
+            })
+            try:
+                if cached:
+                    yield sse_event("delta", {"text": ctx["plan_text"]})
+                else:
+                    for text in generate.stream(ctx):
+                        yield sse_event("delta", {"text": text})
+                    slot.release()
+                    generate.store(ctx)
+                pipeline.FORM_PIPELINE.run(ctx, start="render", stop="deliver")
+            except Exception as e:
+                logger.error(f"Streaming generation failed: {type(e).__name__}: {e}")
+                yield sse_event("error", {"error": "Internal server error"})
+                return
+
+            plan_text = ctx["plan_text"]
+            logger.info(f"=== STREAMED DIET PLAN COMPLETE ({len(plan_text)} characters) ===")
+
+            # The email is queued from the accumulated text, off this connection
+            email_job_id = None
+            if plan_text and ctx["email_to"]:
+                email_job_id = jobs.enqueue("deliver-plan", {"email": ctx["email_to"], "plan": plan_text})
+            settle({"used_location": ctx["location_name"], "used_weather": ctx["weather_desc"],
+                    "current_day": ctx["current_day"], "plan": plan_text,
+                    "plan_pdf_url": ctx["plan_pdf_url"], "email_job_id": email_job_id})
+            yield sse_event("done", {"email_job_id": email_job_id, "plan_pdf_url": ctx["plan_pdf_url"]})
+        finally:
+            settle()
+
+    response = Response(stream(), mimetype="text/event-stream")
+    # Also covers a client that disconnects before the stream starts
+    if slot is not None:
+        response.call_on_close(slot.release)
+    response.call_on_close(settle)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 
 @app.route("/generate-diet-from-node-data", methods=["POST"])
 def generate_diet_from_node_data():
+    # Get data from JSON body
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("No JSON data provided")
+        return jsonify({"error": "No JSON data provided"}), 400
+
+    if wants_async():
+        return idempotent("generate-diet-from-node-data:async", data,
+                          lambda: enqueue_job("generate-diet-from-node-data", data))
+
+    def execute():
+        with resilience.deadline(REQUEST_BUDGET_SECONDS):
+            return run_generate_diet_from_node_data(data)
+
+    return idempotent("generate-diet-from-node-data", data, execute)
+
+
+def run_generate_diet_from_node_data(data, deliver=True):
     try:
         # Log request start
         logger.info("=== DIET GENERATION FROM NODE DATA REQUEST STARTED ===")
-        logger.info(f"Request time: {datetime.now()}")
-        
-        # Get data from JSON body
-        data = request.get_json()
-        if not data:
-            logger.error("No JSON data provided")
-            return jsonify({"error": "No JSON data provided"}), 400
-        
-        email_to = data.get("email")
-        metadata = data.get("metadata", {})
-        
-        # Log received data
-        logger.info(f"Email: {email_to}")
-        logger.info(f"Metadata received: {metadata}")
-        
-        # Extract location data for weather API (if available)
-        location_name = "Unknown"
-        weather_desc = "Not available"
-        latitude = None
-        longitude = None
-        
-        # Try to extract location from metadata (check various possible locations)
-        if "basicInfo" in metadata and "location" in metadata["basicInfo"]:
-            location_name = metadata["basicInfo"]["location"]
-        elif "location" in metadata:
-            location_name = metadata["location"]
-        
-        # Try to extract coordinates from metadata
-        if "basicInfo" in metadata:
-            if "latitude" in metadata["basicInfo"]:
-                latitude = metadata["basicInfo"]["latitude"]
-            if "longitude" in metadata["basicInfo"]:
-                longitude = metadata["basicInfo"]["longitude"]
-        elif "latitude" in metadata:
-            latitude = metadata["latitude"]
-        elif "longitude" in metadata:
-            longitude = metadata["longitude"]
-
-        # Weather API call
-        if latitude and longitude and OPENWEATHER_API_KEY:
-            try:
-                weather_url = (
-                    f"https://api.openweathermap.org/data/2.5/weather?"
-                    f"lat={latitude}&lon={longitude}&appid={OPENWEATHER_API_KEY}&units=metric"
-                )
-                resp = requests.get(weather_url, timeout=10)
-                resp.raise_for_status()
-                w_data = resp.json()
-
-                city = w_data.get("name", "")
-                country = w_data.get("sys", {}).get("country", "")
-                if city and country:
-                    location_name = f"{city}, {country}"
-
-                weather_main = w_data.get("weather", [{}])[0].get("description", "clear sky")
-                temp = w_data.get("main", {}).get("temp")
-                if temp is not None:
-                    weather_desc = f"{weather_main.title()}, Temp: {temp}°C"
-                else:
-                    weather_desc = weather_main.title()
-                    
-                logger.info(f"Weather API Success - Location: {location_name}, Weather: {weather_desc}")
-            except requests.exceptions.RequestException as ex:
-                logger.warning(f"Weather API failed: {ex}")
-
-        current_day = datetime.now().strftime("%A")
-        logger.info(f"Current day: {current_day}")
-        logger.info(f"Location: {location_name}, Weather: {weather_desc}")
-
-        # Add current day and weather info to metadata
-        enhanced_metadata = metadata.copy()
-        enhanced_metadata["current_day"] = current_day
-        enhanced_metadata["location_info"] = {
-            "location_name": location_name,
-            "weather": weather_desc,
-            "latitude": latitude,
-            "longitude": longitude
-        }
-        
-        # Create user prompt with entire metadata
-        user_prompt = f"""
-**Complete User Data:**
-{enhanced_metadata}
-
-**Instructions:**
-Based on the complete user data provided above, generate a personalized 7-day Ayurvedic diet plan starting from {current_day}.
-
-**Requirements:**
-- Analyze all the user data including basic info, health data, diet preferences, and tracking information
-- Consider the user's location ({location_name}) and weather ({weather_desc}) for seasonal recommendations
-- Generate a 7-day plan with sections: "General Recommendations", "Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", and "Bedtime"
-- Provide portion sizes for every food item in grams (g) or milliliters (ml)
-- Explain why each meal is suitable based on the user's complete profile
-- Use markdown formatting with headings like "### Day 1 ({current_day})"
-- Prioritize locally available and seasonal foods for the user's location
-"""
-
-        # Log prompt being sent
-        logger.info(f"Prompt sent to OpenAI (first 200 chars): {user_prompt[:200]}...")
+        logger.debug(f"Request time: {datetime.now()}")
 
         if not OPENAI_API_KEY:
             logger.error("OpenAI API key not configured")
-            return jsonify({"error": "API key for OpenAI is not configured."}), 500
-
-        # Create system instruction for metadata-based generation
-        system_instruction = """
-You are an expert clinical nutritionist and Ayurvedic specialist. Your task is to generate a highly personalized 7-day Ayurvedic diet plan based on complete user data.
-
-**CRITICAL INSTRUCTIONS:**
-1. **Analyze Complete User Data:** Carefully examine all provided user data including:
-   - Basic information (age, gender, height, weight, body shape, goals, focus areas)
-   - Health data (dosha assessments, water tracking, sleep tracking, weight tracking, health issues)
-   - Diet preferences and notes
-   - Location and weather information
-
-2. **Extract Key Information:**
-   - Calculate BMI from height and weight if not provided
-   - Determine dominant dosha from assessments
-   - Consider water intake targets and sleep patterns
-   - Factor in health issues and goals
-   - Use location and weather for seasonal recommendations
-
-3. **Generate Personalized Plan:**
-   - Create a 7-day plan starting from the specified current day
-   - Adjust portion sizes based on user's age, gender, weight, and goals
-   - Consider body shape (Ectomorph, Mesomorph, Endomorph) for meal timing and composition
-   - Factor in focus areas and goals (strength, flexibility, weight management, etc.)
-   - Address any health issues mentioned
-
-4. **Format Requirements:**
-   - Use markdown headings for each day
-   - Include all meal sections: General Recommendations, Early Morning, Breakfast, Mid-Morning Snack, Lunch, Evening Snack, Dinner, Bedtime
-   - Provide portion sizes in grams (g) or milliliters (ml)
-   - Explain the reasoning for each recommendation
-   - Prioritize locally available and seasonal foods
-
-5. **Personalization:**
-   - Tailor recommendations to the user's specific demographic and health profile
-   - Consider their tracking data and progress
-   - Address their specific goals and focus areas
-   - Factor in any health conditions or medications
-"""
-
-        # Log API call
-        logger.info("Calling OpenAI API...")
-        
-        client = OpenAI(api_key=OPENAI_API_KEY, timeout=300.0)
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=4000,
-            temperature=0.3,
-        )
-        plan_text = completion.choices[0].message.content
-        
+            return {"error": "API key for OpenAI is not configured."}, 500
+
+        ctx = pipeline.NODE_PIPELINE.run(pipeline.new_context(data, deliver=deliver))
+        plan_text = pipeline.plan_text(ctx)
+
         # Log successful response
         logger.info("=== DIET PLAN GENERATED SUCCESSFULLY FROM NODE DATA ===")
         logger.info(f"Plan length: {len(plan_text)} characters")
-        logger.info(f"Plan preview: {plan_text[:300]}...")
-        logger.info("=== END DIET GENERATION FROM NODE DATA ===")
+        logger.debug(f"Plan preview: {plan_text[:300]}...")
+        logger.debug("=== END DIET GENERATION FROM NODE DATA ===")
 
-        # Generate PDF and Send Email 
-        email_sent = False
-        if plan_text and email_to:
-            try:
-                logger.info(f"Generating PDF and sending email to: {email_to}")
-                pdf_content = create_pdf(plan_text)
-                email_subject = "Your Personalized Ayurvedic Diet Plan"
-                email_body = "Hello,\n\nPlease find your personalized 7-day Ayurvedic diet plan attached.\n\nBest regards,\nSamsara Wellness"
-                
-                email_sent = send_email_with_attachment(email_to, email_subject, email_body, pdf_content)
-                if email_sent:
-                    logger.info(f"Email sent successfully to {email_to}")
-                else:
-                    logger.warning(f"Failed to send email to {email_to}")
-            except Exception as email_error:
-                logger.error(f"Email sending failed with exception: {email_error}")
-                email_sent = False
-        else:
-            logger.info("No email provided or plan text empty - skipping email")
-
-        return jsonify({
+        return {
             "success": True,
             "message": "Diet plan generated successfully",
             "plan": plan_text,
-            "used_location": location_name,
-            "used_weather": weather_desc,
-            "current_day": current_day,
-            "email_sent": email_to is not None and plan_text is not None
-        })
-
+            "used_location": ctx["location_name"],
+            "used_weather": ctx["weather_desc"],
+            "current_day": ctx["current_day"],
+            "regenerated": ctx["regenerated"],
+            "plan_pdf_url": ctx["plan_pdf_url"],
+            "plan_json": plan_json(ctx),
+            "email_sent": deliver and ctx["email_to"] is not None and plan_text is not None
+        }, 200
+
+    except (admission.Overloaded, resilience.CircuitOpen, resilience.DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error(f"=== DIET GENERATION FROM NODE DATA ERROR ===")
         logger.error(f"Error: {str(e)}")
         logger.error(f"Error type: {type(e).__name__}")
         logger.error("=== END ERROR ===")
-        return jsonify({"error": "Internal server error"}), 500
+        return {"error": "Internal server error"}, 500
+
+
+@app.route("/generate-batch", methods=["POST"])
+def generate_batch():
+    """Plans for many Node records in one call, streamed back as NDJSON while they complete.
+
+    Body: {"records": [{"id": ..., "email": ..., "metadata": {...}}, ...],
+    "generation_mode": optional}. With ?mode=async the batch runs as a job
+    and writes its NDJSON to a file served from /batches/<batch_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    records = data.get("records")
+    if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+        return jsonify({"error": "records must be a non-empty list of objects"}), 400
+    if len(records) > BATCH_MAX_RECORDS:
+        return jsonify({"error": f"At most {BATCH_MAX_RECORDS} records per batch"}), 413
+
+    generation_mode = data.get("generation_mode", PLAN_GENERATION_MODE)
+    if wants_async():
+        payload = {"batch_id": uuid.uuid4().hex, "records": records, "generation_mode": generation_mode}
+        return accepted_job(jobs.enqueue("generate-batch", payload))
+
+    def stream():
+        summary = {"done": True, "records": 0, "failed": 0}
+        for line in run_batch(records, generation_mode):
+            summary["records"] += 1
+            summary["failed"] += line["status_code"] >= 400
+            yield json.dumps(line) + "\n"
+        yield json.dumps(summary) + "\n"
+
+    response = Response(stream(), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def run_batch(records, generation_mode):
+    def generate(record):
+        record = dict(record)
+        record.setdefault("generation_mode", generation_mode)
+        return run_generate_diet_from_node_data(record, deliver=False)
+
+    return batch.run(records, generate, pipeline.deliver_plan, generation_mode)
+
+
+def run_generate_batch(payload):
+    batch_id = payload["batch_id"]
+    path = os.path.join(BATCH_OUTPUT_DIR, f"{batch_id}.ndjson")
+    summary = batch.write_ndjson(path, run_batch(payload["records"], payload["generation_mode"]))
+    logger.info(f"Batch {batch_id} written to {path}: {summary}")
+    return dict(summary, batch_id=batch_id, output_url=f"/batches/{batch_id}"), 200
+
+
+@app.route("/batches/<batch_id>")
+def batch_output(batch_id):
+    """NDJSON written by an offline (?mode=async) batch"""
+    return send_from_directory(BATCH_OUTPUT_DIR, f"{batch_id}.ndjson", mimetype="application/x-ndjson")
+
+
+@app.route("/plans/<artifact_id>.pdf")
+def plan_pdf(artifact_id):
+    """A plan's PDF. The id is a hash of the plan, so the file never changes: clients
+    may cache it, and a conditional GET with its ETag is answered without any work."""
+    if not artifacts.valid_id(artifact_id):
+        return jsonify({"error": "Plan not found"}), 404
+    if artifact_id in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(artifact_id)
+        return response
+
+    path = artifacts.path(artifact_id)
+    if path is None:
+        return jsonify({"error": "Plan not found"}), 404
+    # Served through wsgi.file_wrapper, which gunicorn sends with sendfile(2)
+    response = send_file(path, mimetype="application/pdf", conditional=True, etag=artifact_id,
+                         max_age=ARTIFACT_MAX_AGE, download_name="Ayurvedic_Diet_Plan.pdf")
+    response.cache_control.immutable = True
+    return response
+
+
+jobs.register("generate", run_generate_plan)
+jobs.register("generate-diet-from-node-data", run_generate_diet_from_node_data)
+jobs.register("generate-batch", run_generate_batch)
+jobs.register("deliver-plan", lambda payload: ({"email_queued": pipeline.deliver_plan(payload["email"], payload["plan"])}, 200))
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Status of a queued generation job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    jobs.start_workers()
+    job.pop("result")
+    job.pop("status_code")
+    job["result_url"] = url_for("job_result", job_id=job_id)
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Result of a finished job; 202 while it is still queued or running"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job["status"] in (jobs.QUEUED, jobs.RUNNING):
+        jobs.start_workers()
+        response = jsonify({"job_id": job_id, "status": job["status"]})
+        response.status_code = 202
+        response.headers["Retry-After"] = "5"
+        return response
+
+    if job["result"] is None:
+        return jsonify({"error": job["error"] or "Job failed"}), 500
+    return jsonify(job["result"]), job["status_code"]
+
+
+# Fonts, template and SDK loaded before gunicorn forks the workers (see warmup.py)
+warmup.preload(app)
 
 
 if __name__ == "__main__":
+    warmup.worker_init()
     app.run(host="0.0.0.0", port=FLASK_PORT, debug=FLASK_DEBUG)
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""Rendered plan PDFs on disk, addressed by a hash of the plan text.
+
+register() records the plan text, or a structured plan_model.Plan as
+JSON, under its id without rendering; path()
+renders the PDF the first time it is needed and afterwards returns the
+file, so a plan that is downloaded and emailed several times is rendered
+once. Files live in ARTIFACT_DIR and are indexed, with their source text,
+in ARTIFACT_DB_PATH. When the files add up to more than ARTIFACT_MAX_BYTES
+the least recently used ones are deleted; their index rows stay, so an
+evicted PDF is rendered again on its next use. Rows unused for
+ARTIFACT_TTL seconds are dropped with their files. Structured plans are
+laid out from Plan.blocks(), so their text is never parsed as markdown.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import metrics
+import plan_model
+import settings
+import storage
+from pdf_renderer import create_pdf
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    format TEXT NOT NULL DEFAULT 'markdown',
+    size INTEGER,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed_at);
+"""
+
+# Part of every id: bump it when the PDF layout changes so old files are not served
+RENDER_VERSION = 1
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_migrated = set()
+
+
+def _db():
+    conn = storage.connect(settings.ARTIFACT_DB_PATH, _SCHEMA)
+    if settings.ARTIFACT_DB_PATH not in _migrated:
+        # Indexes created before structured plans held markdown only
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(artifacts)")}
+        if "format" not in columns:
+            try:
+                conn.execute("ALTER TABLE artifacts ADD COLUMN format TEXT NOT NULL DEFAULT 'markdown'")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        _migrated.add(settings.ARTIFACT_DB_PATH)
+    return conn
+
+
+def artifact_id(plan_text):
+    return hashlib.sha256(f"{RENDER_VERSION}\n{plan_text}".encode("utf-8")).hexdigest()
+
+
+def valid_id(value):
+    return bool(_ID_RE.match(value or ""))
+
+
+def _file(artifact_id):
+    return os.path.join(settings.ARTIFACT_DIR, f"{artifact_id}.pdf")
+
+
+def register(plan):
+    """Id of the PDF for plan, markdown or a plan_model.Plan; cheap, nothing is rendered until path() asks for it."""
+    if isinstance(plan, plan_model.Plan):
+        source, source_format = plan.dumps(), "json"
+    else:
+        source, source_format = plan, "markdown"
+    key = artifact_id(source)
+    now = time.time()
+    _db().execute(
+        "INSERT INTO artifacts (id, source, format, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET accessed_at = excluded.accessed_at",
+        (key, source, source_format, now, now),
+    )
+    return key
+
+
+def _render(source, source_format):
+    if source_format != "json":
+        return create_pdf(source)
+    data = json.loads(source)
+    # Day names were fixed when the plan was made; start the week from its first day again
+    plan = plan_model.from_json(data, data["days"][0].get("day_name"))
+    return create_pdf(plan.markdown(), plan.blocks())
+
+
+def path(artifact_id):
+    """Path of the rendered PDF, rendering it on a miss. None for an unknown id."""
+    now = time.time()
+    conn = _db()
+    row = conn.execute("SELECT source, format, size FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE artifacts SET accessed_at = ? WHERE id = ?", (now, artifact_id))
+
+    file_path = _file(artifact_id)
+    if row["size"] is not None and os.path.exists(file_path):
+        metrics.inc("cache_requests_total", cache="pdf", result="hit")
+        return file_path
+
+    metrics.inc("cache_requests_total", cache="pdf", result="miss")
+    with metrics.timer("pdf"):
+        content = bytes(_render(row["source"], row["format"]))
+    # Write under a private name and rename, so readers in other workers never see half a file
+    os.makedirs(settings.ARTIFACT_DIR, exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+    conn.execute("UPDATE artifacts SET size = ? WHERE id = ?", (len(content), artifact_id))
+    _evict(conn, keep=artifact_id)
+    return file_path
+
+
+def read(artifact_id):
+    """The PDF bytes, or None for an unknown id."""
+    file_path = path(artifact_id)
+    if file_path is None:
+        return None
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def _remove(artifact_id):
+    try:
+        os.remove(_file(artifact_id))
+    except FileNotFoundError:
+        pass
+
+
+def _evict(conn, keep=None):
+    """Drop expired rows, then delete the least recently used files over ARTIFACT_MAX_BYTES."""
+    now = time.time()
+    with storage.transaction(conn):
+        expired = [row["id"] for row in conn.execute(
+            "SELECT id FROM artifacts WHERE accessed_at < ?", (now - settings.ARTIFACT_TTL,))]
+        conn.execute("DELETE FROM artifacts WHERE accessed_at < ?", (now - settings.ARTIFACT_TTL,))
+        excess = (conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+                  - settings.ARTIFACT_MAX_BYTES)
+        evicted = []
+        if excess > 0:
+            for row in conn.execute(
+                "SELECT id, size FROM artifacts WHERE size IS NOT NULL AND id != ? ORDER BY accessed_at",
+                (keep or "",),
+            ):
+                if excess <= 0:
+                    break
+                evicted.append(row["id"])
+                excess -= row["size"]
+            conn.executemany("UPDATE artifacts SET size = NULL WHERE id = ?", [(key,) for key in evicted])
+    # A file being sent stays readable after the unlink
+    for key in expired + evicted:
+        _remove(key)
+    if evicted:
+        metrics.inc("artifact_evictions_total", len(evicted))
+        logger.info(f"Evicted {len(evicted)} PDF artifacts over ARTIFACT_MAX_BYTES")
+
+
+def stats():
+    conn = _db()
+    row = conn.execute(
+        "SELECT COUNT(*) AS entries, COUNT(size) AS files, COALESCE(SUM(size), 0) AS bytes FROM artifacts"
+    ).fetchone()
+    return dict(row, max_bytes=settings.ARTIFACT_MAX_BYTES)
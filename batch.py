@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import admission
+import parallel_plan
+import plan_store
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket: refills ``rate`` tokens per second up to ``burst``. A rate of 0 disables it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.burst)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+# Shared by all batches in this process, so two overnight refreshes running
+# at once still stay inside the configured model call budget.
+_limiter = RateLimiter(settings.BATCH_RATE_PER_MINUTE / 60, burst=max(settings.BATCH_MAX_CONCURRENCY, len(parallel_plan.DAYS) + 1))
+_slots = threading.BoundedSemaphore(settings.BATCH_MAX_CONCURRENCY)
+
+
+def profile_key(record, default_mode):
+    """Hash of everything that shapes the plan, and of the user whose stored plan it refreshes.
+
+    The record id is left out. The user (plan_store.user_key) is left out only
+    when the plan store is off: with it on, each user's generation reads and
+    saves that user's own stored plan, so users with identical profiles are
+    not merged.
+    """
+    profile = {
+        "metadata": record.get("metadata") or {},
+        "generation_mode": record.get("generation_mode", default_mode),
+        "user": plan_store.user_key(record) if settings.PLAN_STORE_ENABLED else None,
+    }
+    encoded = json.dumps(profile, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _model_calls(record, default_mode):
+    if record.get("generation_mode", default_mode) == "parallel":
+        return len(parallel_plan.DAYS) + 1
+    return 1
+
+
+def _generate_limited(generate, record, calls):
+    admission.set_blocking()
+    with _slots:
+        _limiter.acquire(calls)
+        return generate(record)
+
+
+def run(records, generate, deliver, default_mode=None):
+    """Generate plans for records, yielding one result dict per record as work completes.
+
+    Records with identical profiles share a single generate(record) call;
+    the plan is then delivered to every record's email with
+    deliver(email, plan). generate must not email the plan itself and
+    returns (result_dict, status_code) like the job handlers.
+    """
+    default_mode = default_mode or settings.PLAN_GENERATION_MODE
+    groups = {}
+    for index, record in enumerate(records):
+        groups.setdefault(profile_key(record, default_mode), []).append(index)
+    logger.info(f"Batch of {len(records)} records has {len(groups)} unique profiles")
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(groups), settings.BATCH_MAX_CONCURRENCY)),
+                              thread_name_prefix="batch")
+    try:
+        pending = {}
+        for indices in groups.values():
+            record = records[indices[0]]
+            future = pool.submit(_generate_limited, generate, record, _model_calls(record, default_mode))
+            pending[future] = indices
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                indices = pending.pop(future)
+                try:
+                    result, status_code = future.result()
+                except Exception as e:
+                    logger.error(f"Batch generation failed: {e}")
+                    result, status_code = {"error": "Internal server error"}, 500
+                for position, index in enumerate(indices):
+                    yield _record_result(records[index], index, result, status_code, deliver, position > 0)
+    finally:
+        # Stop scheduling new model calls if the client went away mid-stream
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _record_result(record, index, result, status_code, deliver, deduplicated):
+    line = {"index": index, "id": record.get("id"), "status_code": status_code, "deduplicated": deduplicated}
+    line.update(result)
+    plan_text = result.get("plan") if status_code < 400 else None
+    line["email_sent"] = bool(plan_text) and deliver(record.get("email"), plan_text)
+    return line
+
+
+def write_ndjson(path, results):
+    """Write results one JSON object per line; the file only appears once the batch is complete."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    summary = {"records": 0, "failed": 0}
+    partial = f"{path}.part"
+    with open(partial, "w", encoding="utf-8") as f:
+        for line in results:
+            f.write(json.dumps(line) + "\n")
+            f.flush()
+            summary["records"] += 1
+            summary["failed"] += line["status_code"] >= 400
+    os.replace(partial, path)
+    return summary
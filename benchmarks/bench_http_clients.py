@@ -0,0 +1,110 @@
+"""Compare per-request HTTP clients with the pooled per-process clients.
+
+Starts a local keep-alive HTTP server that mimics the OpenWeather and
+OpenAI chat-completions endpoints, then times N sequential calls each way
+and counts how many TCP connections the server had to accept.
+
+    python benchmarks/bench_http_clients.py --requests 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WEATHER_BODY = json.dumps({
+    "name": "Delhi", "sys": {"country": "IN"},
+    "weather": [{"description": "haze"}], "main": {"temp": 31.2},
+}).encode()
+
+COMPLETION_BODY = json.dumps({
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "### Day 1\n- Oats 50g"}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(WEATHER_BODY)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply(COMPLETION_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run(label, call, count):
+    _Handler.connections = 0
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} mean {statistics.mean(timings):7.2f} ms   p95 {p95:7.2f} ms   "
+          f"connections {_Handler.connections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = f"{base}/v1"
+
+    import openai
+    import requests
+
+    import clients
+
+    messages = [{"role": "user", "content": "plan"}]
+
+    _run("weather: requests.get", lambda: requests.get(f"{base}/weather", timeout=10).json(), args.requests)
+    _run("weather: pooled session",
+         lambda: clients.http_session().get(f"{base}/weather", timeout=(3, 10)).json(), args.requests)
+
+    def fresh_openai():
+        client = openai.OpenAI(api_key="bench", timeout=300.0)
+        client.chat.completions.create(model="gpt-4o", messages=messages)
+        client.close()
+
+    _run("openai: client per request", fresh_openai, args.requests)
+    _run("openai: pooled client",
+         lambda: clients.openai_client().chat.completions.create(model="gpt-4o", messages=messages),
+         args.requests)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Markdown-to-PDF layout: golden-output check and legacy-vs-block renderer timing.
+
+    python benchmarks/bench_markdown_pdf.py --copies 10 --runs 5
+    python benchmarks/bench_markdown_pdf.py --update-golden
+
+The golden check compares markdown_blocks.parse() and the renderer's line
+layout (page, x, y, text of every cell) for markdown_sample.md against the
+files in benchmarks/golden/, and exits non-zero on any difference. The
+timing compares the old per-line startswith() loop with the block renderer
+on a large document made of several concatenated plans.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MARKDOWN_SAMPLE = os.path.join(HERE, "markdown_sample.md")
+SAMPLE_PLAN = os.path.join(HERE, "sample_plan.md")
+GOLDEN_BLOCKS = os.path.join(HERE, "golden", "markdown_sample.blocks.json")
+GOLDEN_LAYOUT = os.path.join(HERE, "golden", "markdown_sample.layout.json")
+
+sys.path.insert(0, ROOT)
+logging.disable(logging.CRITICAL)
+
+import markdown_blocks  # noqa: E402
+import pdf_renderer  # noqa: E402
+
+
+def legacy_create_pdf(plan_text):
+    """The renderer as it was before markdown_blocks, kept here for comparison."""
+    pdf = pdf_renderer.PDF()
+    pdf_renderer._add_fonts(pdf, plan_text)
+    pdf.set_font('DejaVu', '', 12)
+    pdf.add_page()
+
+    for line in plan_text.split('\n'):
+        line = line.strip()
+        if not line:
+            pdf.ln(5)
+            continue
+
+        if line.startswith('### '):
+            pdf.set_font('DejaVu', 'B', 16)
+            pdf.multi_cell(0, 10, line.replace('### ', '').strip())
+            pdf.ln(4)
+        elif line.startswith('#### '):
+            pdf.set_font('DejaVu', 'B', 13)
+            pdf.multi_cell(0, 8, line.replace('#### ', '').strip())
+            pdf.ln(2)
+        elif line.startswith('- '):
+            pdf.set_font('DejaVu', '', 11)
+            clean_line = line.replace('**', '').replace('- ', '', 1).strip()
+            pdf.cell(5)
+            pdf.multi_cell(0, 7, f'• {clean_line}')
+            pdf.ln(1)
+        else:
+            pdf.set_font('DejaVu', '', 11)
+            pdf.multi_cell(0, 7, line)
+            pdf.ln(2)
+
+    return pdf.output()
+
+
+class _RecordingPDF(pdf_renderer.PDF):
+    """Records every cell the renderer draws in the page body."""
+
+    last = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.layout = []
+        self.in_body = False
+        _RecordingPDF.last = self
+
+    def cell(self, w=None, h=None, text="", *args, **kwargs):
+        if self.in_body and text:
+            self.layout.append([self.page_no(), round(self.get_x(), 2), round(self.get_y(), 2), text])
+        return super().cell(w, h, text, *args, **kwargs)
+
+    def add_page(self, *args, **kwargs):
+        self.in_body = False
+        super().add_page(*args, **kwargs)
+        self.in_body = True
+
+    def footer(self):
+        self.in_body = False
+        super().footer()
+
+
+def _blocks(text):
+    # JSON round trip so namedtuples and tuples compare equal to the stored lists
+    return json.loads(json.dumps(markdown_blocks.parse(text)))
+
+
+def _layout(text):
+    original = pdf_renderer.PDF
+    pdf_renderer.PDF = _RecordingPDF
+    try:
+        pdf_renderer.create_pdf(text)
+    finally:
+        pdf_renderer.PDF = original
+    return _RecordingPDF.last.layout
+
+
+def check_golden(update):
+    with open(MARKDOWN_SAMPLE, encoding="utf-8") as f:
+        text = f.read()
+    failed = False
+    for label, path, actual in (("blocks", GOLDEN_BLOCKS, _blocks(text)), ("layout", GOLDEN_LAYOUT, _layout(text))):
+        if update:
+            with open(path, "w", encoding="utf-8") as f:
+                # One entry per line keeps golden diffs readable
+                f.write("[\n" + ",\n".join(json.dumps(entry, ensure_ascii=False) for entry in actual) + "\n]\n")
+            print(f"golden {label:<6} updated ({len(actual)} entries)")
+            continue
+        with open(path, encoding="utf-8") as f:
+            expected = json.load(f)
+        if actual == expected:
+            print(f"golden {label:<6} ok ({len(actual)} entries)")
+            continue
+        failed = True
+        for i, (want, got) in enumerate(zip(expected, actual)):
+            if want != got:
+                print(f"golden {label:<6} FAILED at entry {i}:\n  expected {want}\n  actual   {got}")
+                break
+        else:
+            print(f"golden {label:<6} FAILED: expected {len(expected)} entries, got {len(actual)}")
+    return not failed
+
+
+def _time(render, text, runs):
+    render(text)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render(text)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=10, help="plans concatenated into the timed document")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--update-golden", action="store_true")
+    args = parser.parse_args()
+
+    if not check_golden(args.update_golden):
+        sys.exit(1)
+    if args.update_golden:
+        return
+
+    with open(SAMPLE_PLAN, encoding="utf-8") as f:
+        text = "\n\n".join([f.read()] * args.copies)
+    print(f"document: {args.copies} plans, {len(text.splitlines())} lines")
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        markdown_blocks.parse(text)
+    print(f"parse     {(time.perf_counter() - start) * 1000 / args.runs:8.1f} ms")
+
+    legacy = _time(legacy_create_pdf, text, args.runs)
+    blocks = _time(pdf_renderer.create_pdf, text, args.runs)
+    print(f"legacy    {legacy:8.1f} ms (median)")
+    print(f"blocks    {blocks:8.1f} ms (median)   {legacy / blocks:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
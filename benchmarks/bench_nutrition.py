@@ -0,0 +1,66 @@
+"""Time the food index and the nutrition prompt section, and measure its prompt cost.
+
+    python benchmarks/bench_nutrition.py [--calls 10000]
+
+Reports how long compiling foods.csv and mapping the compiled index take,
+the cost per request of targets + candidate foods (prompt_section), and the
+/generate prompt size with and without the section. The section adds input
+tokens, but saves the model from estimating calories in its answer.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nutrition  # noqa: E402
+import prompt_compaction  # noqa: E402
+import settings  # noqa: E402
+from prompts import PROMPT_TEMPLATE  # noqa: E402
+
+FORM = {
+    "age": "34", "gender": "Female", "height": "162", "weight": "71", "dosha": "Pitta-Kapha",
+    "disease": "PCOS (Polycystic Ovary Syndrome)", "water": "2", "bmi": "27.1", "sleep": "Moderate",
+    "secondary_condition": "Acidity / Heartburn", "appetite": "Variable",
+    "location": "Pune, IN", "weather": "Clear, 29°C", "current_day": "Monday",
+}
+
+
+def _timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=10000, help="prompt_section calls to average over")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-nutrition-") as data_dir:
+        settings.FOODS_INDEX_PATH = os.path.join(data_dir, "foods.bin")
+        count = nutrition.compile_index(settings.FOODS_CSV_PATH, settings.FOODS_INDEX_PATH)
+        compile_seconds = _timed(lambda: nutrition.compile_index(settings.FOODS_CSV_PATH, settings.FOODS_INDEX_PATH), 20)
+        map_seconds = _timed(lambda: nutrition.FoodIndex(settings.FOODS_INDEX_PATH), 200)
+        print(f"{count} foods, {os.path.getsize(settings.FOODS_INDEX_PATH)} bytes compiled "
+              f"(foods.csv {os.path.getsize(settings.FOODS_CSV_PATH)} bytes)")
+        print(f"compile:        {compile_seconds * 1e3:8.3f} ms")
+        print(f"map index:      {map_seconds * 1e3:8.3f} ms")
+
+        section = lambda: nutrition.prompt_section(FORM["age"], FORM["gender"], FORM["height"], FORM["weight"],  # noqa: E731
+                                                   FORM["dosha"], (FORM["disease"], FORM["secondary_condition"]))
+        first = _timed(section)
+        per_call = _timed(section, args.calls)
+        print(f"first section:  {first * 1e6:8.1f} us (candidates not cached yet)")
+        print(f"prompt_section: {per_call * 1e6:8.1f} us per call")
+
+        without = prompt_compaction.count_tokens(PROMPT_TEMPLATE.format(**FORM, nutrition=""))
+        with_section = prompt_compaction.count_tokens(PROMPT_TEMPLATE.format(**FORM, nutrition=section()))
+        print(f"prompt tokens:  {without} without, {with_section} with targets and foods")
+
+
+if __name__ == "__main__":
+    main()
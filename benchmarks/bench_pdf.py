@@ -0,0 +1,73 @@
+"""Per-PDF render time and peak RSS for a typical 7-day plan.
+
+Runs each variant in its own subprocess so peak RSS is not shared:
+
+    python benchmarks/bench_pdf.py --runs 20
+
+"uncached" calls add_font for every document (PDF_FONT_CACHE=False),
+"cached" reuses the fonts parsed once per process.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_plan.md")
+
+
+def _measure(runs, plan_path):
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+    import pdf_renderer
+
+    with open(plan_path, encoding="utf-8") as f:
+        plan_text = f.read()
+
+    start = time.perf_counter()
+    pdf_renderer.create_pdf(plan_text)
+    first_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pdf_renderer.create_pdf(plan_text)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({
+        "first_ms": first_ms,
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--plan", default=SAMPLE_PLAN)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _measure(args.runs, args.plan)
+        return
+
+    for label, cache in (("uncached", "False"), ("cached", "True")):
+        env = dict(os.environ, PDF_FONT_CACHE=cache)
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--runs", str(args.runs), "--plan", args.plan],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{label:<9} first {result['first_ms']:7.1f} ms   mean {result['mean_ms']:7.1f} ms   "
+              f"median {result['median_ms']:7.1f} ms   peak RSS {result['max_rss_mb']:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Startup benchmark and regression guard: import time and first-request latency.
+
+    python benchmarks/bench_startup.py [--runs 5] [--compare] [--top 10] [--check]
+
+1. Imports the app --runs times, each in a fresh interpreter, and reports
+   the median import time and preload steps from warmup.report(). --top
+   lists the slowest modules (python -X importtime, self time).
+2. Starts gunicorn.conf.py with one single-threaded worker against
+   benchmarks/mocks.py (plan cache off) and times the following:
+   - cold start: from launching gunicorn until /health answers;
+   - first request: the first POST /generate, and its overhead over the
+     median of the next --requests;
+   - after a recycle: the same again, once the worker has been killed and
+     the master has forked a new one, as after max_requests.
+   --compare repeats this with WARMUP_ENABLED=False.
+3. --check compares the warm numbers with benchmarks/startup_budget.json
+   and exits with status 1 when any of them is over budget. Raise a budget
+   in that file only together with the change that makes startup slower.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BUDGET_PATH = os.path.join(HERE, "startup_budget.json")
+
+sys.path.insert(0, HERE)
+
+from load_test import Gunicorn  # noqa: E402
+from mocks import MockServers  # noqa: E402
+
+
+def _env(data_dir, **extra):
+    return dict(os.environ, DATA_DIR=data_dir, LOG_FILE=os.path.join(data_dir, "app.log"),
+                OPENAI_API_KEY="mock", LOG_LEVEL="WARNING", **extra)
+
+
+def measure_import(runs):
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as data_dir:
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", "import json, app, warmup; print(json.dumps(warmup.report()))"],
+                cwd=ROOT, env=_env(data_dir), capture_output=True, text=True, check=True,
+            ).stdout
+            reports.append(json.loads(output.strip().splitlines()[-1]))
+    steps = {name: statistics.median(r["preload"][name] for r in reports) for name in reports[0]["preload"]}
+    return {"import_seconds": statistics.median(r["import_seconds"] for r in reports), "preload": steps}
+
+
+def slowest_modules(top):
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as data_dir:
+        stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                                cwd=ROOT, env=_env(data_dir), capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "self" not in line:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            modules.append((int(own) / 1e6, int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def _generate(base, n):
+    started = time.perf_counter()
+    response = requests.post(f"{base}/generate", data={"age": str(20 + n % 60), "weight": str(50 + n)}, timeout=60)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def _first_and_rest(base, counter, count):
+    first = _generate(base, next(counter))
+    rest = statistics.median(_generate(base, next(counter)) for _ in range(count))
+    return {"first": round(first, 4), "median": round(rest, 4), "overhead": round(first - rest, 4)}
+
+
+def _worker_pid(base):
+    return requests.get(f"{base}/health", timeout=5).json()["startup"]["pid"]
+
+
+def _recycle(base, timeout=60):
+    """Kill the worker and wait until its replacement answers."""
+    old = _worker_pid(base)
+    os.kill(old, signal.SIGTERM)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if _worker_pid(base) != old:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"no replacement worker within {timeout}s")
+
+
+def measure_server(warmup, count):
+    mocks = MockServers(openai_latency=0.05, tokens_per_second=0, weather_latency=0).start()
+    counter = iter(range(10 ** 6))
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as data_dir:
+        server = Gunicorn(1, "gthread", 1, dict(mocks.env(), WARMUP_ENABLED=str(warmup), LOG_LEVEL="WARNING"), data_dir)
+        started = time.perf_counter()
+        server.start()
+        try:
+            result = {"cold_start_seconds": round(time.perf_counter() - started, 3),
+                      "first_request": _first_and_rest(server.base, counter, count)}
+            _recycle(server.base)
+            result["recycled_first_request"] = _first_and_rest(server.base, counter, count)
+        finally:
+            server.stop()
+            mocks.stop()
+    return result
+
+
+def check(result):
+    with open(BUDGET_PATH) as f:
+        budget = json.load(f)
+    measured = {
+        "import_seconds": result["import"]["import_seconds"],
+        "first_request_overhead_seconds": result["warm"]["first_request"]["overhead"],
+        "recycled_first_request_overhead_seconds": result["warm"]["recycled_first_request"]["overhead"],
+    }
+    failures = [f"{name}: {measured[name]:.3f}s > {limit:.3f}s" for name, limit in budget.items()
+                if measured[name] > limit]
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    if not failures:
+        print(f"Within {os.path.relpath(BUDGET_PATH, ROOT)}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh-interpreter imports to take the median of")
+    parser.add_argument("--requests", type=int, default=5, help="requests after the first one, for the median")
+    parser.add_argument("--compare", action="store_true", help="also run the server with WARMUP_ENABLED=False")
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest modules to import")
+    parser.add_argument("--check", action="store_true", help=f"fail when over {os.path.basename(BUDGET_PATH)}")
+    args = parser.parse_args()
+
+    result = {"import": measure_import(args.runs), "warm": measure_server(True, args.requests)}
+    if args.compare:
+        result["cold"] = measure_server(False, args.requests)
+    print(json.dumps(result, indent=2))
+    if args.top:
+        print("Slowest modules (self seconds, cumulative seconds):")
+        for own, cumulative, name in slowest_modules(args.top):
+            print(f"  {own:7.3f} {cumulative:7.3f}  {name}")
+    if args.check and not check(result):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
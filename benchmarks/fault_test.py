@@ -0,0 +1,169 @@
+"""Fault injection: how /generate behaves when OpenAI or OpenWeather misbehave.
+
+    python benchmarks/fault_test.py [--requests 8] [--budget 8] [--scenario weather-down ...]
+
+Runs the app in-process (Flask test client) against benchmarks/mocks.py in
+a temporary DATA_DIR, with short timeouts so a run takes about a minute,
+and sends --requests sequential /generate requests per scenario:
+
+- weather-down: every weather request hangs. The first BREAKER_FAILURE_THRESHOLD
+  requests wait out WEATHER_TIMEOUT; after that the breaker is open and the
+  plan is made at once with "Not available" weather.
+- openai-errors: every completion fails with 503, which the app answers
+  with 500. After the threshold the breaker answers 503 + Retry-After
+  without calling OpenAI.
+- recovery: the faults are gone; once BREAKER_RECOVERY_SECONDS have passed
+  a trial call closes the breaker again.
+- slow-primary: gpt-4o takes 3 s and gpt-4o-mini is healthy; with
+  OPENAI_FALLBACK_MODEL and OPENAI_HEDGE_AFTER=1 each request is answered
+  by the fallback about a second after it starts. The late gpt-4o answers
+  still arrive well within OPENAI_READ_TIMEOUT, so they are no failures.
+- deadline: gpt-4o hangs and there is no fallback. Requests end with 504
+  when the --budget seconds are spent. That is most of OPENAI_READ_TIMEOUT
+  (10 s here), so the timeouts count as failures, and after the threshold
+  the breaker answers 503 at once.
+
+Each request is printed with its status, seconds and the weather used,
+then each scenario's mock request counts and breaker states. These are
+checked against what the scenario should produce (expected()); the test
+exits with status 1 when any of them differ.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+from mocks import MockServers  # noqa: E402
+
+SCENARIOS = ("weather-down", "openai-errors", "recovery", "slow-primary", "deadline")
+
+
+def _form(n):
+    # Coordinates and age vary so neither the plan cache nor idempotency answers
+    return {"age": str(20 + n), "location": "Delhi", "latitude": str(28.0 + n), "longitude": "77.2",
+            "generation_mode": "single"}
+
+
+def expected(name, n, threshold):
+    """The statuses, mock call counts and breaker states scenario name should end with after n requests."""
+    failing = min(n, threshold)
+    tripped = "open" if n >= threshold else "closed"
+    if name == "weather-down":
+        return ([200] * n, {"weather_requests": failing, "weather_stalls": failing, "openai_requests_gpt-4o": n},
+                {"openweather": tripped, "openai:gpt-4o": "closed"})
+    if name == "openai-errors":
+        return ([500] * failing + [503] * (n - failing),
+                {"weather_requests": n, "openai_requests_gpt-4o": failing, "openai_faults": failing},
+                {"openweather": "closed", "openai:gpt-4o": tripped})
+    if name == "recovery":
+        return ([200] * n, {"weather_requests": n, "openai_requests_gpt-4o": n},
+                {"openweather": "closed", "openai:gpt-4o": "closed"})
+    if name == "slow-primary":
+        return ([200] * n, {"openai_requests_gpt-4o": n, "openai_stalls": n, "openai_requests_gpt-4o-mini": n},
+                {"openai:gpt-4o": "closed", "openai:gpt-4o-mini": "closed"})
+    return ([504] * failing + [503] * (n - failing),
+            {"weather_requests": n, "openai_requests_gpt-4o": failing, "openai_stalls": failing,
+             "openai_requests_gpt-4o-mini": 0},
+            {"openai:gpt-4o": tripped})
+
+
+def run_scenario(name, client, mocks, args, counter):
+    """Run one scenario; returns a list of mismatches with expected()."""
+    import resilience
+    import settings
+
+    resilience.reset()
+    mocks.set_faults("openai")
+    mocks.set_faults("weather")
+    settings.OPENAI_FALLBACK_MODEL = ""
+    settings.OPENAI_HEDGE_AFTER = ""
+    if name == "weather-down":
+        mocks.set_faults("weather", stall_rate=1.0, stall_seconds=60)
+    elif name == "openai-errors":
+        mocks.set_faults("openai", error_rate=1.0, error_status=503)
+    elif name == "recovery":
+        mocks.set_faults("openai", error_rate=1.0, error_status=503)
+        for _ in range(settings.BREAKER_FAILURE_THRESHOLD):
+            counter[0] += 1
+            client.post("/generate", data=_form(counter[0]))
+        mocks.set_faults("openai")
+        print(f"  breaker {resilience.states()}; waiting {settings.BREAKER_RECOVERY_SECONDS:.0f}s to recover")
+        time.sleep(settings.BREAKER_RECOVERY_SECONDS)
+    elif name == "slow-primary":
+        mocks.set_faults("openai", stall_rate=1.0, stall_seconds=3, models=["gpt-4o"])
+        settings.OPENAI_FALLBACK_MODEL = "gpt-4o-mini"
+        settings.OPENAI_HEDGE_AFTER = "1"
+    elif name == "deadline":
+        mocks.set_faults("openai", stall_rate=1.0, stall_seconds=60)
+
+    before = mocks.stats()
+    statuses = []
+    print(f"\n{name}")
+    for _ in range(args.requests):
+        counter[0] += 1
+        started = time.perf_counter()
+        response = client.post("/generate", data=_form(counter[0]))
+        elapsed = time.perf_counter() - started
+        body = response.get_json(silent=True) or {}
+        detail = body.get("used_weather") or body.get("error", "")
+        retry_after = response.headers.get("Retry-After")
+        statuses.append(response.status_code)
+        print(f"  {response.status_code}  {elapsed:6.2f}s  {detail}" + (f"  (Retry-After {retry_after})" if retry_after else ""))
+    after = mocks.stats()
+    calls = {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+    breakers = resilience.states()
+    print(f"  mock calls: {calls}; breakers: {breakers}")
+
+    want_statuses, want_calls, want_breakers = expected(name, args.requests, settings.BREAKER_FAILURE_THRESHOLD)
+    failures = []
+    if statuses != want_statuses:
+        failures.append(f"{name}: statuses {statuses}, expected {want_statuses}")
+    failures += [f"{name}: {calls.get(key, 0)} {key}, expected {count}"
+                 for key, count in want_calls.items() if calls.get(key, 0) != count]
+    failures += [f"{name}: breaker {dependency} {breakers.get(dependency, 'closed')}, expected {state}"
+                 for dependency, state in want_breakers.items() if breakers.get(dependency, "closed") != state]
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=8, help="requests per scenario")
+    parser.add_argument("--budget", type=float, default=8, help="REQUEST_BUDGET_SECONDS")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="default: all, in order")
+    args = parser.parse_args()
+
+    mocks = MockServers(openai_latency=0.2, tokens_per_second=0).start()
+    data_dir = tempfile.mkdtemp(prefix="fault-test-")
+    os.environ.update(mocks.env(), DATA_DIR=data_dir, LOG_FILE=os.path.join(data_dir, "app.log"),
+                      PLAN_CACHE_ENABLED="false", WEATHER_TIMEOUT="2", WEATHER_CONNECT_TIMEOUT="1", OPENAI_READ_TIMEOUT="10",
+                      BREAKER_FAILURE_THRESHOLD="3", BREAKER_RECOVERY_SECONDS="5",
+                      REQUEST_BUDGET_SECONDS=str(args.budget), LLM_ADMISSION_WAIT="5", LOG_LEVEL="WARNING")
+    try:
+        from app import app
+        client = app.test_client()
+        counter = [0]
+        failures = []
+        for name in args.scenario or SCENARIOS:
+            failures += run_scenario(name, client, mocks, args, counter)
+    finally:
+        mocks.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    scenarios = len(args.scenario or SCENARIOS)
+    print(f"{'FAILED' if failures else 'OK'}: {scenarios} scenarios, {len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""Load test: the app under gunicorn.conf.py against the local mocks.
+
+    python benchmarks/load_test.py --workers 2,4 --worker-class gthread --threads 8,16 \
+        --concurrency 16 --duration 60
+
+Every combination of --workers, --worker-class and --threads gets a fresh
+gunicorn (the real gunicorn.conf.py, with bind and pidfile overridden) in a
+temporary DATA_DIR, pointed at benchmarks/mocks.py. --concurrency closed-loop
+clients then alternate between POST /generate and POST
+/generate-diet-from-node-data for --duration seconds, after --warmup
+seconds whose requests are not counted. Coordinates and profiles vary per
+request and the plan cache is off, so every request reaches the model mock.
+
+Reported per run and endpoint: requests started in the measured window,
+429 rejections (admission control), other errors, successful requests per
+second completed inside the window and their p50/p95/p99 latency.
+Per run: in-flight requests sampled from /metrics against the worker
+capacity (workers x threads), and the RSS of the gunicorn master plus
+workers (Linux only).
+--json appends one result object per run to a file for later comparison.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.insert(0, HERE)
+
+from mocks import MockServers  # noqa: E402
+
+ENDPOINTS = {
+    "generate": "/generate",
+    "node": "/generate-diet-from-node-data",
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def _coordinates(rng):
+    # Spread over India so the weather cache sees a realistic mix of cells
+    return round(rng.uniform(8, 32), 4), round(rng.uniform(68, 90), 4)
+
+
+def _form(rng, n, email):
+    latitude, longitude = _coordinates(rng)
+    return {
+        "email": f"load-{n}@example.com" if email else "",
+        "age": str(rng.randint(18, 75)), "gender": rng.choice(["Female", "Male"]),
+        "height": str(rng.randint(150, 190)), "weight": str(rng.randint(45, 110)),
+        "dosha": rng.choice(["vata", "pitta", "kapha", "mixed"]),
+        "disease": rng.choice(["None", "Diabetes", "PCOS", "Hypertension"]),
+        "water": str(rng.choice([1.5, 2, 2.5, 3])), "bmi": str(round(rng.uniform(18, 32), 1)),
+        "sleep": rng.choice(["Good", "Poor"]), "secondary_condition": "None", "appetite": "Normal",
+        "latitude": str(latitude), "longitude": str(longitude), "location": "Unknown",
+    }
+
+
+def _node_body(rng, n, email):
+    latitude, longitude = _coordinates(rng)
+    days = 30
+    return {
+        "email": f"load-{n}@example.com" if email else "",
+        "metadata": {
+            "basicInfo": {"age": rng.randint(18, 75), "gender": rng.choice(["female", "male"]),
+                          "height": rng.randint(150, 190), "weight": rng.randint(45, 110),
+                          "latitude": latitude, "longitude": longitude, "location": "Unknown"},
+            "dosha": rng.choice(["vata", "pitta", "kapha"]),
+            "healthConditions": [rng.choice(["none", "diabetes", "pcos", "hypertension"])],
+            "waterIntake": [{"date": f"2026-01-{d + 1:02d}", "liters": round(rng.uniform(1, 3.5), 1)} for d in range(days)],
+            "sleep": [{"date": f"2026-01-{d + 1:02d}", "hours": round(rng.uniform(5, 9), 1)} for d in range(days)],
+        },
+    }
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid is the second field after the parenthesized command name
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def process_rss(pid):
+    """(master RSS, [worker RSS, ...]) in MB, or None where /proc is not available."""
+    if not os.path.isdir("/proc"):
+        return None
+    return _rss_kb(pid) / 1024, [_rss_kb(child) / 1024 for child in _children(pid)]
+
+
+def _in_flight(base):
+    """Requests being served by all workers, from the aggregated /metrics gauge."""
+    try:
+        text = requests.get(f"{base}/metrics", timeout=5).text
+    except requests.RequestException:
+        return None
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith("diet_http_requests_in_flight"):
+            total += float(line.rsplit(" ", 1)[1])
+    # The scrape itself is one of them
+    return max(total - 1, 0)
+
+
+class Gunicorn:
+    def __init__(self, workers, worker_class, threads, env, data_dir):
+        self.port = _free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.workers, self.worker_class, self.threads = workers, worker_class, threads
+        self.log_path = os.path.join(data_dir, "gunicorn.log")
+        self.env = dict(os.environ, **env,
+                        DATA_DIR=data_dir,
+                        LOG_FILE=os.path.join(data_dir, "app.log"),
+                        METRICS_FLUSH_INTERVAL="0.5",
+                        PLAN_CACHE_ENABLED="False",
+                        GUNICORN_WORKERS=str(workers),
+                        GUNICORN_WORKER_CLASS=worker_class,
+                        GUNICORN_THREADS=str(threads))
+        self.process = None
+
+    @property
+    def capacity(self):
+        # gunicorn runs "sync" with more than one thread as gthread
+        if self.worker_class in ("gthread", "sync"):
+            return self.workers * self.threads
+        return None  # gevent/eventlet: bounded by worker_connections, not threads
+
+    def start(self, timeout=60):
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                   "--bind", f"127.0.0.1:{self.port}",
+                   "--pid", os.path.join(self.env["DATA_DIR"], "gunicorn.pid"),
+                   "app:app"]
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(command, cwd=ROOT, env=self.env, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}; see {self.log_path}")
+            try:
+                requests.get(f"{self.base}/health", timeout=2)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError(f"gunicorn did not answer within {timeout}s; see {self.log_path}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+def _post(session, base, name, rng, n, email):
+    if name == "generate":
+        return session.post(base + ENDPOINTS[name], data=_form(rng, n, email), timeout=600)
+    return session.post(base + ENDPOINTS[name], json=_node_body(rng, n, email), timeout=600)
+
+
+def _client(base, endpoints, email, seed, stop_at, results):
+    rng = random.Random(seed)
+    session = requests.Session()
+    for n in itertools.count():
+        if time.time() >= stop_at:
+            return
+        name = endpoints[n % len(endpoints)]
+        started = time.time()
+        try:
+            try:
+                response = _post(session, base, name, rng, n, email)
+            except requests.ConnectionError:
+                # gunicorn may close an idle keep-alive connection just as it is reused;
+                # a browser retries that once on a new connection, so do the same
+                response = _post(session, base, name, rng, n, email)
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        results.append((name, started, time.time() - started, status))
+
+
+def _sample(server, stop, samples):
+    while not stop.is_set():
+        samples.append({"in_flight": _in_flight(server.base), "rss": process_rss(server.process.pid)})
+        stop.wait(0.5)
+
+
+def run(server, args, mocks):
+    results, samples = [], []
+    started = time.time()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    clients = [threading.Thread(target=_client, args=(server.base, args.endpoints, not args.no_email,
+                                                      args.seed + i, stop_at, results))
+               for i in range(args.concurrency)]
+    stop_sampling = threading.Event()
+    sampler = threading.Thread(target=_sample, args=(server, stop_sampling, samples))
+    mocks_before = mocks.stats()
+    for thread in clients + [sampler]:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    stop_sampling.set()
+    sampler.join()
+
+    report = {"workers": server.workers, "worker_class": server.worker_class, "threads": server.threads,
+              "concurrency": args.concurrency, "duration": args.duration, "endpoints": {}}
+    measured = [r for r in results if measure_from <= r[1] < stop_at]
+    for name in args.endpoints:
+        rows = [r for r in measured if r[0] == name]
+        ok = [r for r in rows if r[3] is not None and r[3] < 400]
+        latencies = sorted(r[2] for r in ok)
+        # Throughput counts what finished inside the window, not the requests drained after it
+        finished = sum(1 for r in ok if r[1] + r[2] <= stop_at)
+        report["endpoints"][name] = {
+            "requests": len(rows),
+            "rejected": sum(1 for r in rows if r[3] == 429),
+            "errors": sum(1 for r in rows if r[3] is None or (r[3] >= 400 and r[3] != 429)),
+            "rps": round(finished / args.duration, 2),
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+        }
+
+    in_flight = [s["in_flight"] for s in samples if s["in_flight"] is not None]
+    if in_flight:
+        report["in_flight_mean"] = round(sum(in_flight) / len(in_flight), 2)
+        report["in_flight_peak"] = max(in_flight)
+        if server.capacity:
+            report["capacity"] = server.capacity
+            report["saturation_mean"] = round(report["in_flight_mean"] / server.capacity, 3)
+            report["saturation_peak"] = round(report["in_flight_peak"] / server.capacity, 3)
+    rss = [s["rss"] for s in samples if s["rss"]]
+    if rss:
+        report["rss_total_peak_mb"] = round(max(master + sum(workers) for master, workers in rss), 1)
+        report["rss_worker_peak_mb"] = round(max((max(workers) for _, workers in rss if workers), default=0), 1)
+        report["rss_master_mb"] = round(rss[-1][0], 1)
+    mocks_after = mocks.stats()
+    # Per-model counters only exist once that model was called
+    report["mocks"] = {k: mocks_after[k] - mocks_before.get(k, 0) for k in mocks_after}
+    return report
+
+
+def _seconds(value):
+    return f"{value * 1000:8.0f}" if value is not None else "       -"
+
+
+def print_report(report):
+    print(f"\nworkers={report['workers']} worker_class={report['worker_class']} threads={report['threads']} "
+          f"concurrency={report['concurrency']} measured {report['duration']}s")
+    print(f"  {'endpoint':<10}{'requests':>9}{'429':>6}{'errors':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, row in report["endpoints"].items():
+        print(f"  {name:<10}{row['requests']:>9}{row['rejected']:>6}{row['errors']:>8}{row['rps']:>8.2f}"
+              f"{_seconds(row['p50']):>9}{_seconds(row['p95']):>9}{_seconds(row['p99']):>9}")
+    if "in_flight_mean" in report:
+        line = f"  in flight mean {report['in_flight_mean']}, peak {report['in_flight_peak']:g}"
+        if "capacity" in report:
+            line += (f" of {report['capacity']} (saturation mean {report['saturation_mean']:.0%}, "
+                     f"peak {report['saturation_peak']:.0%})")
+        print(line)
+    if "rss_total_peak_mb" in report:
+        print(f"  RSS peak {report['rss_total_peak_mb']} MB total, {report['rss_worker_peak_mb']} MB largest worker, "
+              f"{report['rss_master_mb']} MB master")
+    print(f"  mocks: {report['mocks']}")
+
+
+def _ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=_ints, default=[2], help="comma-separated, one run each")
+    parser.add_argument("--worker-class", type=lambda v: v.split(","), default=["gthread"])
+    parser.add_argument("--threads", type=_ints, default=[8])
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--endpoints", type=lambda v: v.split(","), default=list(ENDPOINTS),
+                        help=f"comma-separated from {', '.join(ENDPOINTS)}")
+    parser.add_argument("--no-email", action="store_true", help="skip the PDF and outbox path")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--completion-tokens", type=int, default=1200)
+    parser.add_argument("--weather-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="append one JSON result per run to this file")
+    parser.add_argument("--keep", action="store_true", help="keep each run's data directory (logs, databases)")
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    mocks = MockServers(args.openai_latency, args.tokens_per_second, args.completion_tokens,
+                        args.weather_latency).start()
+    print(f"mock model: {args.openai_latency}s to first token, {args.tokens_per_second:g} tokens/s, "
+          f"{args.completion_tokens} tokens per completion")
+    try:
+        for workers, worker_class, threads in itertools.product(args.workers, args.worker_class, args.threads):
+            data_dir = tempfile.mkdtemp(prefix="diet-load-")
+            server = Gunicorn(workers, worker_class, threads, mocks.env(), data_dir)
+            try:
+                server.start()
+                report = run(server, args, mocks)
+            finally:
+                server.stop()
+                if not args.keep:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+                else:
+                    print(f"  data kept in {data_dir}")
+            print_report(report)
+            if args.json:
+                with open(args.json, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(report) + "\n")
+    finally:
+        mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
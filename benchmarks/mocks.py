@@ -0,0 +1,368 @@
+"""Local stand-ins for OpenAI, OpenWeather and SMTP, for load tests and development.
+
+    python benchmarks/mocks.py --openai-latency 0.5 --tokens-per-second 80
+
+Prints the environment variables that point the app at the mocks and
+serves until interrupted. benchmarks/load_test.py starts the same servers
+in-process through MockServers.
+
+The OpenAI mock answers POST .../chat/completions, both plain and streamed
+(SSE, with a final usage chunk when stream_options.include_usage is set).
+It waits --openai-latency seconds before the first token and then writes
+tokens at --tokens-per-second; the text is benchmarks/sample_plan.md cut to
+the requested length, at about 4 characters per token. A request with a
+json_schema response_format gets a structured 7-day plan (plan_model.py)
+instead. The weather mock
+answers any GET with a fixed OpenWeather response. The SMTP sink accepts
+every message without authentication (use SMTP_SECURITY=none) and counts it,
+and its connections.
+
+Faults can be injected into the OpenAI and weather mocks, from the command
+line or at run time with MockServers.set_faults(): a share of requests
+(error_rate) answered with error_status, and a share (stall_rate) held
+for stall_seconds before the answer. For OpenAI they can be limited to
+some models, e.g. a slow primary model next to a healthy fallback.
+benchmarks/fault_test.py uses them to exercise resilience.py. The SMTP sink
+takes error_rate at run time: that share of messages is answered with
+error_status as the SMTP reply code after DATA (451 by default), which
+benchmarks/outbox_test.py uses to exercise retries and dead letters.
+"""
+import argparse
+import json
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = 4  # tokens per streamed chunk
+
+with open(os.path.join(HERE, "sample_plan.md"), encoding="utf-8") as f:
+    SAMPLE_PLAN = f.read()
+
+WEATHER_BODY = json.dumps({
+    "name": "Delhi", "sys": {"country": "IN"},
+    "weather": [{"description": "haze"}], "main": {"temp": 31.2},
+}).encode()
+
+
+MEALS = ["Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", "Bedtime"]
+
+
+def _plan_json():
+    meal = lambda name: {"name": name, "why": "Light and easy to digest; balances Vata and Pitta.",
+                         "items": [{"food": "Moong dal chilla", "quantity": 120, "unit": "g"},
+                                   {"food": "Warm water with lemon", "quantity": 250, "unit": "ml"}]}
+    return json.dumps({"general_recommendations": ["Drink 2.5 L of warm water daily.", "Avoid cold, processed foods."],
+                       "days": [{"meals": [meal(name) for name in MEALS]} for _ in range(7)]})
+
+
+def _plan_text(tokens):
+    chars = tokens * CHARS_PER_TOKEN
+    text = SAMPLE_PLAN * (chars // len(SAMPLE_PLAN) + 1)
+    return text[:chars]
+
+
+class _Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {"openai_requests": 0, "openai_streams": 0, "weather_requests": 0,
+                       "smtp_connections": 0, "smtp_messages": 0, "smtp_bytes": 0}
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+
+class Faults:
+    """What share of requests one mock fails or stalls; change it with MockServers.set_faults()."""
+
+    def __init__(self, error_rate=0.0, error_status=503, stall_rate=0.0, stall_seconds=30.0, models=None):
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.models = set(models) if models else None  # None: every model
+
+    def pick(self, model=None):
+        """"error", "stall" or None for one request."""
+        if self.models is not None and model not in self.models:
+            return None
+        if random.random() < self.error_rate:
+            return "error"
+        if random.random() < self.stall_rate:
+            return "stall"
+        return None
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # A client that gave up on a stalled request closed the socket; that is no error of the mock
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # Set on the subclass MockServers creates
+    latency = 0.0
+    tokens_per_second = 0.0
+    completion_tokens = 0
+    counters = None
+    faults = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        model = body.get("model", "gpt-4o")
+        self.counters.add(f"openai_requests_{model}")
+        fault = self.faults.pick(model)
+        if fault == "error":
+            self.counters.add("openai_faults")
+            self._json(self.faults.error_status, {"error": {"message": "Injected fault", "type": "server_error"}})
+            return
+        if fault == "stall":
+            self.counters.add("openai_stalls")
+            time.sleep(self.faults.stall_seconds)
+        tokens = min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens)
+        usage = {"prompt_tokens": sum(len(m.get("content") or "") for m in body.get("messages", [])) // CHARS_PER_TOKEN,
+                 "completion_tokens": tokens}
+        usage["total_tokens"] = usage["prompt_tokens"] + tokens
+        time.sleep(self.latency)
+        if body.get("stream"):
+            self.counters.add("openai_streams")
+            self._stream(body, _plan_text(tokens), usage)
+        else:
+            self.counters.add("openai_requests")
+            structured = (body.get("response_format") or {}).get("type") == "json_schema"
+            if self.tokens_per_second > 0:
+                time.sleep(tokens / self.tokens_per_second)
+            self._json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant",
+                                         "content": _plan_json() if structured else _plan_text(tokens)}}],
+                "usage": usage,
+            })
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, payload):
+        data = f"data: {payload}\n\n".encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, body, text, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o")}
+        step = CHUNK_TOKENS * CHARS_PER_TOKEN
+        delay = CHUNK_TOKENS / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for start in range(0, len(text), step):
+            if delay:
+                time.sleep(delay)
+            self._chunk(json.dumps(dict(base, choices=[
+                {"index": 0, "delta": {"content": text[start:start + step]}, "finish_reason": None}])))
+        self._chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._chunk(json.dumps(dict(base, choices=[], usage=usage)))
+        self._chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class _WeatherHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    counters = None
+    faults = None
+
+    def do_GET(self):
+        self.counters.add("weather_requests")
+        fault = self.faults.pick()
+        if fault == "error":
+            self.counters.add("weather_faults")
+            self.send_error(self.faults.error_status)
+            return
+        if fault == "stall":
+            self.counters.add("weather_stalls")
+            time.sleep(self.faults.stall_seconds)
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(WEATHER_BODY)))
+        self.end_headers()
+        self.wfile.write(WEATHER_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT. No AUTH."""
+
+    counters = None
+    faults = None
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.counters.add("smtp_connections")
+        try:
+            self._session()
+        except ConnectionError:
+            pass  # the app's worker was stopped mid-session
+
+    def _session(self):
+        self._reply("220 mock-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self._reply("250-mock-smtp\r\n250-8BITMIME\r\n250 SIZE 52428800")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data in self.rfile:
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                if self.faults.pick() == "error":
+                    self.counters.add("smtp_faults")
+                    self._reply(f"{self.faults.error_status} Injected fault")
+                    continue
+                self.counters.add("smtp_messages")
+                self.counters.add("smtp_bytes", size)
+                self._reply("250 OK queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockServers:
+    """The three mocks on free localhost ports, each served by its own thread."""
+
+    def __init__(self, openai_latency=0.5, tokens_per_second=80, completion_tokens=1500, weather_latency=0.05,
+                 openai_faults=None, weather_faults=None):
+        self.counters = _Counters()
+        self.faults = {"openai": openai_faults or Faults(), "weather": weather_faults or Faults(),
+                       "smtp": Faults(error_status=451)}
+        openai_handler = type("OpenAIHandler", (_OpenAIHandler,), {
+            "latency": openai_latency, "tokens_per_second": tokens_per_second,
+            "completion_tokens": completion_tokens, "counters": self.counters, "faults": self.faults["openai"]})
+        weather_handler = type("WeatherHandler", (_WeatherHandler,), {
+            "latency": weather_latency, "counters": self.counters, "faults": self.faults["weather"]})
+        smtp_handler = type("SMTPHandler", (_SMTPHandler,), {"counters": self.counters, "faults": self.faults["smtp"]})
+        self._servers = [
+            _HTTPServer(("127.0.0.1", 0), openai_handler),
+            _HTTPServer(("127.0.0.1", 0), weather_handler),
+            _SMTPServer(("127.0.0.1", 0), smtp_handler),
+        ]
+        self.openai_port, self.weather_port, self.smtp_port = (s.server_address[1] for s in self._servers)
+
+    def start(self):
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, name=f"mock-{server.server_address[1]}", daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def env(self):
+        """Environment for the app (settings.py and the OpenAI client) to use the mocks."""
+        return {
+            "OPENAI_API_KEY": "mock",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{self.openai_port}/v1",
+            "OPENWEATHER_API_KEY": "mock",
+            "OPENWEATHER_URL": f"http://127.0.0.1:{self.weather_port}/data/2.5/weather",
+            "SMTP_HOST": "127.0.0.1",
+            "SMTP_PORT": str(self.smtp_port),
+            "SMTP_SECURITY": "none",
+            "SMTP_USERNAME": "mock",
+            "SMTP_PASSWORD": "mock",
+            "EMAIL_FROM": "plans@example.com",
+        }
+
+    def set_faults(self, mock, **faults):
+        """Change the faults of the "openai", "weather" or "smtp" mock; requests already stalled are not affected."""
+        target = self.faults[mock]
+        defaults = vars(Faults(error_status=451)) if mock == "smtp" else vars(Faults())
+        for name, value in dict(defaults, **faults).items():
+            setattr(target, name, set(value) if name == "models" and value else value)
+
+    def stats(self):
+        with self.counters.lock:
+            return dict(self.counters.values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="0 answers at once")
+    parser.add_argument("--completion-tokens", type=int, default=1500, help="tokens per completion (capped by max_tokens)")
+    parser.add_argument("--weather-latency", type=float, default=0.05)
+    for mock in ("openai", "weather"):
+        parser.add_argument(f"--{mock}-error-rate", type=float, default=0.0, help="share of requests failed")
+        parser.add_argument(f"--{mock}-error-status", type=int, default=503)
+        parser.add_argument(f"--{mock}-stall-rate", type=float, default=0.0, help="share of requests stalled")
+        parser.add_argument(f"--{mock}-stall-seconds", type=float, default=30.0)
+    parser.add_argument("--openai-fault-models", help="comma-separated models the OpenAI faults apply to (default: all)")
+    args = parser.parse_args()
+
+    faults = {mock: Faults(getattr(args, f"{mock}_error_rate"), getattr(args, f"{mock}_error_status"),
+                           getattr(args, f"{mock}_stall_rate"), getattr(args, f"{mock}_stall_seconds"))
+              for mock in ("openai", "weather")}
+    if args.openai_fault_models:
+        faults["openai"].models = set(args.openai_fault_models.split(","))
+    mocks = MockServers(args.openai_latency, args.tokens_per_second, args.completion_tokens, args.weather_latency,
+                        faults["openai"], faults["weather"]).start()
+    for name, value in mocks.env().items():
+        print(f"export {name}={value}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(mocks.stats()), flush=True)
+    except KeyboardInterrupt:
+        mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Check the email outbox against the SMTP sink in benchmarks/mocks.py.
+
+    python benchmarks/outbox_test.py [--messages 5] [--base 0.2]
+
+Runs outbox.py in-process against the sink in a temporary DATA_DIR. Each
+case delivers with one outbox.SmtpConnection, as a sender thread would:
+
+- pooled: --messages messages go over a single SMTP connection;
+- retry: the sink rejects the first attempt with 451; the message is sent
+  on the second attempt, no sooner than OUTBOX_RETRY_BASE_SECONDS (--base)
+  after the first;
+- dead-letter: the sink rejects every attempt; after OUTBOX_MAX_ATTEMPTS (3
+  here), with backoffs of --base, 2 x --base, ..., the message is dead,
+  listed by dead_letters(), and sent once requeue_dead() retries it;
+- retention: sent messages older than OUTBOX_RETENTION_SECONDS are purged,
+  newer ones and dead letters are kept.
+
+Exits with status 1 when any check fails.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+from mocks import MockServers  # noqa: E402
+
+MAX_ATTEMPTS = 3
+
+
+def _row(message_id):
+    import outbox
+
+    return dict(outbox._db().execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone())
+
+
+def _drain(connection, message_id, statuses, timeout):
+    """Send due messages until message_id reaches one of statuses; returns the send attempt times."""
+    import outbox
+
+    attempts = []
+    deadline = time.time() + timeout
+    while _row(message_id)["status"] not in statuses:
+        if time.time() > deadline:
+            break
+        started = time.time()
+        if not outbox.send_next(connection):
+            time.sleep(0.02)
+            continue
+        attempts.append(started)
+    return attempts
+
+
+def run_checks(mocks, args):
+    import outbox
+
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}: {detail}")
+        if not ok:
+            failures.append(f"{name}: {detail}")
+
+    connection = outbox.SmtpConnection()
+    enqueue = lambda n: outbox.enqueue(f"user{n}@example.com", "Your plan", "Hello")  # noqa: E731
+
+    print("pooled")
+    before = mocks.stats()
+    ids = [enqueue(n) for n in range(args.messages)]
+    for message_id in ids:
+        _drain(connection, message_id, {outbox.SENT}, timeout=10)
+    after = mocks.stats()
+    sent = sum(_row(message_id)["status"] == outbox.SENT for message_id in ids)
+    check("sent", sent == args.messages, f"{sent} of {args.messages}")
+    check("messages", after["smtp_messages"] - before["smtp_messages"] == args.messages,
+          f"{after['smtp_messages'] - before['smtp_messages']} at the sink")
+    check("connections", after["smtp_connections"] - before["smtp_connections"] == 1,
+          f"{after['smtp_connections'] - before['smtp_connections']} opened")
+
+    print("retry")
+    mocks.set_faults("smtp", error_rate=1.0)
+    message_id = enqueue("retry")
+    attempts = [time.time()]
+    outbox.send_next(connection)
+    row = _row(message_id)
+    check("first attempt", row["status"] == outbox.PENDING and row["attempts"] == 1 and "451" in (row["last_error"] or ""),
+          f"{row['status']} after {row['attempts']} attempt(s): {row['last_error']}")
+    mocks.set_faults("smtp")
+    attempts += _drain(connection, message_id, {outbox.SENT, outbox.DEAD}, timeout=args.base * 10)
+    row = _row(message_id)
+    gap = attempts[-1] - attempts[0] if len(attempts) > 1 else 0
+    check("second attempt", row["status"] == outbox.SENT and row["attempts"] == 2,
+          f"{row['status']} after {row['attempts']} attempt(s)")
+    check("backoff", gap >= args.base * 0.95, f"{gap:.2f}s between attempts, base {args.base}s")
+
+    print("dead-letter")
+    mocks.set_faults("smtp", error_rate=1.0)
+    before = mocks.stats()
+    message_id = enqueue("dead")
+    attempts = _drain(connection, message_id, {outbox.DEAD, outbox.SENT}, timeout=args.base * 2 ** MAX_ATTEMPTS * 5)
+    after = mocks.stats()
+    row = _row(message_id)
+    waited = attempts[-1] - attempts[0] if attempts else 0
+    minimum = sum(args.base * 2 ** n for n in range(MAX_ATTEMPTS - 1))
+    check("dead", row["status"] == outbox.DEAD and row["attempts"] == MAX_ATTEMPTS,
+          f"{row['status']} after {row['attempts']} attempt(s)")
+    check("rejected", after.get("smtp_faults", 0) - before.get("smtp_faults", 0) == MAX_ATTEMPTS,
+          f"{after.get('smtp_faults', 0) - before.get('smtp_faults', 0)} rejections at the sink")
+    check("backoff", waited >= minimum * 0.95, f"{waited:.2f}s from first to last attempt, at least {minimum:.2f}s")
+    check("listed", any(dead["id"] == message_id for dead in outbox.dead_letters()), "in dead_letters()")
+    mocks.set_faults("smtp")
+    check("requeued", outbox.requeue_dead(message_id), "requeue_dead()")
+    _drain(connection, message_id, {outbox.SENT, outbox.DEAD}, timeout=10)
+    check("sent after requeue", _row(message_id)["status"] == outbox.SENT, _row(message_id)["status"])
+    dead_id = enqueue("stays-dead")
+    outbox._db().execute("UPDATE outbox SET status = ? WHERE id = ?", (outbox.DEAD, dead_id))
+
+    print("retention")
+    import settings
+
+    old = ids[: len(ids) // 2 + 1]
+    outbox._db().executemany("UPDATE outbox SET sent_at = ? WHERE id = ?",
+                             [(time.time() - settings.OUTBOX_RETENTION_SECONDS - 60, message_id) for message_id in old])
+    purged = outbox._purge_expired()
+    remaining = outbox.stats()
+    check("purged", purged == len(old), f"{purged} sent messages past retention deleted, expected {len(old)}")
+    check("kept", remaining[outbox.SENT] == args.messages - len(old) + 2 and remaining[outbox.DEAD] == 1,
+          f"{remaining[outbox.SENT]} sent and {remaining[outbox.DEAD]} dead kept")
+    connection.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5, help="messages for the pooled case")
+    parser.add_argument("--base", type=float, default=0.2, help="OUTBOX_RETRY_BASE_SECONDS")
+    args = parser.parse_args()
+
+    mocks = MockServers().start()
+    data_dir = tempfile.mkdtemp(prefix="outbox-test-")
+    # No sender threads: the checks deliver inline, so attempts are counted exactly
+    os.environ.update(mocks.env(), DATA_DIR=data_dir, LOG_FILE=os.path.join(data_dir, "app.log"), OUTBOX_SENDERS="0",
+                      OUTBOX_MAX_ATTEMPTS=str(MAX_ATTEMPTS), OUTBOX_RETRY_BASE_SECONDS=str(args.base),
+                      LOG_LEVEL="WARNING")
+    try:
+        failures = run_checks(mocks, args)
+    finally:
+        mocks.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{'FAILED' if failures else 'OK'}: {len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
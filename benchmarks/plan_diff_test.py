@@ -0,0 +1,149 @@
+"""Check that one new tracking entry does not regenerate a stored Node plan.
+
+    python benchmarks/plan_diff_test.py [--trials 50] [--seed 1]
+
+For --trials random users with 1 to 30 days of weight, sleep and water
+logs, the profile stored with a plan (plan_store.profile) is diffed against
+the profile after one more entry in one of the series, as
+plan_store.plan_update does on a refresh. The same day must need no model
+call, and the next day one (the new Day 7). Control cases check that
+material changes still regenerate the whole plan: a new dosha, a 10%
+weight change across the whole history, a new health condition. A drift
+case then refreshes one stored plan through NodeGenerate, the weight falling
+4% per same-day refresh: each step alone is within PLAN_DIFF_TOLERANCE, but
+the plan must be regenerated as soon as the total is not. Exits with status
+1 when any case needs a different number of section calls.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plan_store  # noqa: E402
+import settings  # noqa: E402
+
+FULL = 8  # general + seven days
+START = date(2026, 3, 2)
+WEATHER = "haze, 31°C"
+
+
+def _metadata(rng, days):
+    weight = rng.uniform(50, 100)
+    entry_date = lambda d: (START - timedelta(days=days - d)).isoformat()  # noqa: E731
+    return {
+        "userId": "u1",
+        "basicInfo": {"age": rng.randint(18, 75), "gender": rng.choice(["female", "male"]),
+                      "height": rng.randint(150, 190), "weight": round(weight)},
+        "dosha": rng.choice(["vata", "pitta", "kapha"]),
+        "healthConditions": [rng.choice(["none", "diabetes", "pcos"])],
+        "weightLogs": [{"date": entry_date(d), "kg": round(weight + rng.uniform(-0.8, 0.8), 1)} for d in range(days)],
+        "sleep": [{"date": entry_date(d), "hours": round(rng.uniform(5, 9), 1)} for d in range(days)],
+        "waterIntake": [{"date": entry_date(d), "liters": round(rng.uniform(1, 3.5), 1), "target": 2.5}
+                        for d in range(days)],
+    }
+
+
+def _append_entry(rng, metadata):
+    series = rng.choice(["weightLogs", "sleep", "waterIntake"])
+    entries = metadata[series]
+    entry = dict(entries[-1], date=START.isoformat())
+    if series == "weightLogs":
+        entry["kg"] = round(entry["kg"] + rng.uniform(-0.8, 0.8), 1)
+    elif series == "sleep":
+        entry["hours"] = round(rng.uniform(5, 9), 1)
+    else:
+        entry["liters"] = round(rng.uniform(1, 3.5), 1)
+    metadata[series] = entries + [entry]
+    return series
+
+
+def _calls(old_metadata, new_metadata, start_date=START):
+    stored = {"profile": plan_store.profile(old_metadata), "location": "Delhi, IN", "weather": WEATHER,
+              "start_date": START, "days": [f"day {n}" for n in range(1, 8)]}
+    update = plan_store.plan_update(stored, plan_store.profile(new_metadata), "Delhi, IN", WEATHER, start_date)
+    return FULL if update is None else plan_store.model_calls(update)
+
+
+def _drift(steps=10, factor=0.96, weight=57.6):
+    """Refresh one stored plan as the weight falls by factor per step.
+
+    Returns (step of the first full regeneration or None, first step whose total change is over tolerance).
+    """
+    import pipeline
+
+    generate = pipeline.NODE_PIPELINE.stage("generate")
+
+    def refresh(kg):
+        ctx = pipeline.new_context({"userId": "drift", "metadata": {
+            "basicInfo": {"age": 30, "gender": "female", "height": 160, "weight": kg}}}, deliver=False)
+        ctx.update(location_name="Delhi, IN", weather_desc=WEATHER)
+        return ctx, generate.lookup(ctx)
+
+    ctx, _ = refresh(weight)
+    ctx["sections"] = ("general", [f"day {n}" for n in range(1, 8)])
+    generate.store(ctx)
+    over = regenerated = None
+    for step in range(1, steps + 1):
+        kg = round(weight * factor ** step, 1)
+        if over is None and abs(weight - kg) > settings.PLAN_DIFF_TOLERANCE * weight:
+            over = step
+        ctx, answered = refresh(kg)
+        if not answered and ctx["update"] is None:
+            regenerated = step
+            break
+    return regenerated, over
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failures = []
+    counts = {}
+    for trial in range(args.trials):
+        old = _metadata(rng, rng.randint(1, 30))
+        new = {key: list(value) if isinstance(value, list) else value for key, value in old.items()}
+        series = _append_entry(rng, new)
+        for label, start_date, expected in (("same day", START, 0), ("next day", START + timedelta(days=1), 1)):
+            calls = _calls(old, new, start_date)
+            counts[(label, calls)] = counts.get((label, calls), 0) + 1
+            if calls != expected:
+                failures.append(f"trial {trial} ({len(old[series])} {series} entries + 1, {label}): "
+                                f"{calls} calls, expected {expected}")
+
+        controls = (
+            ("new dosha", dict(old, dosha={"vata": "pitta", "pitta": "kapha", "kapha": "vata"}[old["dosha"]])),
+            ("weight -10%", dict(old, basicInfo=dict(old["basicInfo"], weight=round(old["basicInfo"]["weight"] * 0.9)),
+                                 weightLogs=[dict(e, kg=round(e["kg"] * 0.9, 1)) for e in old["weightLogs"]])),
+            ("new condition", dict(old, healthConditions=old["healthConditions"] + ["hypertension"])),
+        )
+        for label, changed in controls:
+            calls = _calls(old, changed)
+            if calls != FULL:
+                failures.append(f"trial {trial} ({label}): {calls} calls, expected a full regeneration")
+
+    with tempfile.TemporaryDirectory(prefix="plan-diff-") as data_dir:
+        settings.PLAN_STORE_PATH = os.path.join(data_dir, "plan_store.db")
+        settings.FOODS_INDEX_PATH = os.path.join(data_dir, "foods.bin")
+        regenerated, over = _drift()
+    print(f"drift: regenerated at step {regenerated}, total change over tolerance at step {over}")
+    if regenerated != over:
+        failures.append(f"drift: regenerated at step {regenerated}, expected step {over}")
+
+    for (label, calls), count in sorted(counts.items()):
+        print(f"{label}: {count} trials needed {calls} section call(s)")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{'FAILED' if failures else 'OK'}: {args.trials} trials, {len(failures)} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Offline plan generation and PDF rendering from JSONL, without the web server.
+
+    python cli.py generate profiles.jsonl --out runs/refresh [--kind node|form] [--concurrency 16]
+    python cli.py render plans.jsonl --out runs/rerender [--render-workers 4]
+
+generate reads one request per line, either a /generate-diet-from-node-data
+body or, with --kind form, the /generate form fields. Each request runs
+through the same pipeline as the routes (pipeline.py), up to the PDF, with
+at most --concurrency requests in flight on a bounded asyncio pool. render
+reads {"id": ..., "plan": "<markdown>"} lines with existing plans. In both
+cases the PDFs are rendered by --render-workers processes, because layout
+is CPU-bound, and identical plans are rendered only once.
+
+The output directory gets plans/<id>.md (plus plans/<id>.json for
+output_format "json"), pdf/<id>.pdf and results.ndjson, one line per
+record. results.ndjson is also the checkpoint. Rerunning the same command
+skips the records already done, so an interrupted run resumes where it
+stopped, and records that failed are tried again. Records without an "id"
+are named after their line number.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import admission
+import artifacts
+import batch
+import logging_setup
+import pdf_renderer
+import pipeline
+import settings
+
+logger = logging.getLogger("cli")
+
+PROGRESS_EVERY = 100
+
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", str(value))[:100]
+
+
+def _read_records(path):
+    """(line number, record or None, error or None) for each non-empty line, streamed."""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield number, None, "not a JSON object"
+                continue
+            yield number, record, None
+
+
+def _record_id(number, record):
+    value = (record or {}).get("id")
+    return _safe_name(value) if value not in (None, "") else f"line-{number}"
+
+
+def _done_ids(results_path):
+    """Ids whose latest result in results_path is a success."""
+    status = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by the interruption
+                status[result.get("id")] = result.get("status")
+    return {record_id for record_id, value in status.items() if value == "ok"}
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _init_render_worker():
+    # Already parsed when the pool forked from the parent; parsed here otherwise
+    pdf_renderer.load_fonts()
+
+
+def _render_pdf(pdf_path, plan_text, blocks=None):
+    """Process pool task: render plan_text (or its layout blocks) to pdf_path. Returns the seconds it took."""
+    started = time.perf_counter()
+    _write_atomic(pdf_path, bytes(pdf_renderer.create_pdf(plan_text, blocks)))
+    return time.perf_counter() - started
+
+
+class Run:
+    """One generate or render run over a JSONL file into an output directory."""
+
+    def __init__(self, args):
+        self.command = args.command
+        self.full = getattr(args, "full", False)
+        self.pipeline = pipeline.FORM_PIPELINE if getattr(args, "kind", "node") == "form" else pipeline.NODE_PIPELINE
+        self.out = args.out
+        for name in ("plans", "pdf"):
+            os.makedirs(os.path.join(self.out, name), exist_ok=True)
+        self.results_path = os.path.join(self.out, "results.ndjson")
+        self.done = _done_ids(self.results_path)
+        self.concurrency = args.concurrency
+        self.limiter = batch.RateLimiter(args.rate / 60, burst=max(args.concurrency, 1))
+        self.counts = Counter()
+        self._renders = {}  # artifact id -> (pdf path, future) of the first record with that plan
+
+        # Fork the render processes now, while this process is still single-threaded
+        # apart from logging, so they inherit the parsed fonts
+        pdf_renderer.load_fonts()
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        self.render_pool = ProcessPoolExecutor(args.render_workers, mp_context=context,
+                                               initializer=_init_render_worker)
+        self.render_pool.submit(_init_render_worker).result()
+        self.io_pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="cli")
+
+    def close(self):
+        self.io_pool.shutdown(wait=True)
+        self.render_pool.shutdown(wait=True)
+
+    async def run(self, path):
+        started = time.perf_counter()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        with open(self.results_path, "a", encoding="utf-8") as self._results:
+            for number, record, error in _read_records(path):
+                record_id = _record_id(number, record)
+                if record_id in self.done:
+                    self.counts["skipped"] += 1
+                    continue
+                # Backpressure: the file is read only as fast as records finish
+                await self._slots.acquire()
+                task = asyncio.create_task(self._process(number, record_id, record, error))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        finished = self.counts["ok"] + self.counts["failed"]
+        return dict(self.counts, seconds=round(elapsed, 2),
+                    records_per_second=round(finished / elapsed, 2) if elapsed else None)
+
+    async def _process(self, number, record_id, record, error):
+        result = {"id": record_id, "line": number}
+        try:
+            if error:
+                raise ValueError(error)
+            if self.command == "render":
+                plan_text, timings, structured = record.get("plan"), {}, None
+                if not plan_text:
+                    raise ValueError('no "plan" markdown')
+            else:
+                ctx = await self._generate(record_id, record)
+                plan_text, timings, structured = pipeline.plan_text(ctx), ctx["timings"], ctx.get("plan")
+                plan_path = os.path.join(self.out, "plans", f"{record_id}.md")
+                _write_atomic(plan_path, plan_text.encode("utf-8"))
+                if structured is not None:
+                    json_path = os.path.join(self.out, "plans", f"{record_id}.json")
+                    _write_atomic(json_path, structured.dumps().encode("utf-8"))
+                    result["plan_json"] = os.path.relpath(json_path, self.out)
+                result.update(plan=os.path.relpath(plan_path, self.out), used_location=ctx["location_name"],
+                              used_weather=ctx["weather_desc"], regenerated=ctx.get("regenerated"))
+            pdf_path, timings["render"] = await self._render(
+                record_id, plan_text, structured.blocks() if structured is not None else None)
+            result.update(status="ok", pdf=os.path.relpath(pdf_path, self.out), timings=timings)
+            self.counts["ok"] += 1
+        except Exception as e:
+            logger.error(f"Record {record_id} (line {number}) failed: {type(e).__name__}: {e}")
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+            self.counts["failed"] += 1
+        finally:
+            self._slots.release()
+        self._results.write(json.dumps(result) + "\n")
+        self._results.flush()
+        finished = self.counts["ok"] + self.counts["failed"]
+        if finished % PROGRESS_EVERY == 0:
+            logger.info(f"{finished} records done ({self.counts['failed']} failed, {self.counts['skipped']} skipped)")
+
+    async def _generate(self, record_id, record):
+        if self.full:
+            record = dict(record, regenerate="full")
+        # Wait for model call slots and the rate limit instead of failing with 429
+        admission.set_blocking()
+        logging_setup.set_request_id(f"cli-{record_id}")
+        ctx = pipeline.new_context(record, deliver=False)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.io_pool, self.limiter.acquire, pipeline.model_calls(ctx["generation_mode"]))
+        return await self.pipeline.run_async(ctx, executor=self.io_pool, stop="render")
+
+    async def _render(self, record_id, plan_text, blocks=None):
+        """Render to pdf/<record_id>.pdf. Returns (path, render seconds; 0 for a copy)."""
+        pdf_path = os.path.join(self.out, "pdf", f"{record_id}.pdf")
+        key = artifacts.artifact_id(plan_text)
+        first = self._renders.get(key)
+        if first is None:
+            future = asyncio.get_running_loop().run_in_executor(self.render_pool, _render_pdf, pdf_path, plan_text, blocks)
+            self._renders[key] = (pdf_path, future)
+            return pdf_path, round(await future, 4)
+        first_path, future = first
+        await future
+        if first_path != pdf_path:
+            shutil.copyfile(first_path, pdf_path)
+        self.counts["pdf_reused"] += 1
+        return pdf_path, 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="generate plans and PDFs from request JSONL")
+    generate.add_argument("--kind", choices=("node", "form"), default="node",
+                          help="node: /generate-diet-from-node-data bodies; form: /generate fields")
+    generate.add_argument("--full", action="store_true",
+                          help="regenerate whole plans instead of refreshing users' stored plans")
+    render = commands.add_parser("render", help='render PDFs from {"id", "plan"} JSONL')
+    for command in (generate, render):
+        command.add_argument("input", help="JSONL file, one record per line")
+        command.add_argument("--out", required=True, help="output directory (reused to resume)")
+        command.add_argument("--concurrency", type=int, default=16, help="records in flight at once")
+        command.add_argument("--render-workers", type=int, default=os.cpu_count() or 1,
+                             help="processes rendering PDFs")
+        command.add_argument("--rate", type=float, default=0,
+                             help="model calls per minute (0: limited by --concurrency only)")
+    args = parser.parse_args(argv)
+
+    logging_setup.configure()
+    if args.command == "generate" and not settings.OPENAI_API_KEY:
+        parser.error("OPENAI_API_KEY is not configured")
+
+    run = Run(args)
+    if run.done:
+        logger.info(f"Resuming: {len(run.done)} records already done in {run.results_path}")
+    try:
+        summary = asyncio.run(run.run(args.input))
+    finally:
+        run.close()
+    print(json.dumps(summary))
+    return 1 if summary.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
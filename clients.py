@@ -0,0 +1,88 @@
+import logging
+import os
+import threading
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # newer openai releases are built on httpx2
+    import httpx2 as httpx
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Clients hold open sockets, so they must never cross a fork: with
+# preload_app = True the master imports this module, and each worker
+# builds its own clients lazily on first use.
+_lock = threading.Lock()
+_clients = {}
+_owner_pid = None
+
+
+def _get(name, factory):
+    global _owner_pid
+    pid = os.getpid()
+    client = _clients.get(name) if _owner_pid == pid else None
+    if client is not None:
+        return client
+
+    with _lock:
+        if _owner_pid != pid:
+            # Inherited from the parent process: drop the references without
+            # closing, the sockets still belong to the parent.
+            _clients.clear()
+            _owner_pid = pid
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = factory()
+            logger.info(f"Created {name} client in process {pid} (pool size {settings.HTTP_POOL_SIZE})")
+    return client
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.HTTP_POOL_SIZE, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _make_openai():
+    timeout = openai.Timeout(settings.OPENAI_READ_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+    http_client = openai.DefaultHttpxClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_POOL_SIZE,
+            max_keepalive_connections=settings.HTTP_POOL_SIZE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_SECONDS,
+        ),
+    )
+    return openai.OpenAI(api_key=settings.OPENAI_API_KEY, timeout=timeout, http_client=http_client)
+
+
+def http_session():
+    """Keep-alive requests.Session shared by the threads of this process."""
+    return _get("http", _make_session)
+
+
+def openai_client():
+    """Pooled OpenAI client shared by the threads of this process."""
+    return _get("openai", _make_openai)
+
+
+def reset():
+    """Close and forget this process's clients (e.g. after settings change)."""
+    global _owner_pid
+    with _lock:
+        if _owner_pid == os.getpid():
+            for client in _clients.values():
+                try:
+                    client.close()
+                except Exception as e:
+                    logger.warning(f"Error closing client: {e}")
+        _clients.clear()
+        _owner_pid = None
@@ -7,8 +7,15 @@ bind = "0.0.0.0:4000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# Requests spend nearly all their time waiting on OpenAI, so concurrency comes
+# from threads, not processes: one worker per core (at least two, so a
+# recycled worker never leaves the server empty). Each worker costs ~105 MB;
+# each busy thread ~2 MB (see "Worker Model and Admission Control" in the Readme).
+workers = int(os.environ.get("GUNICORN_WORKERS", max(2, multiprocessing.cpu_count())))
+# Threaded workers so long-lived /generate-stream responses don't each pin a
+# whole process; "gevent" also works if it is installed.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
 worker_connections = 1000
 timeout = 300  # Increased to 300 seconds for large file generation
 keepalive = 2
@@ -50,3 +57,15 @@ max_worker_connections = 1000
 raw_env = [
     'FLASK_ENV=production',
 ]
+
+
+def on_starting(server):
+    # Each run starts with empty per-worker metrics files (see metrics.py)
+    import metrics
+    metrics.reset_dir()
+
+
+def post_fork(server, worker):
+    # Start this worker's job and email threads and build its clients before it takes requests (see warmup.py)
+    import warmup
+    warmup.worker_init()
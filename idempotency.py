@@ -0,0 +1,152 @@
+"""Idempotency keys: one execution per key, shared by every gunicorn worker.
+
+The key comes from the Idempotency-Key header, or else from a hash of the
+route and the payload, so a double-clicked form or a retried Node call is
+recognised without client changes. The first request claims the key in
+instance/idempotency.db and runs. Duplicates that arrive while it runs
+wait for its result; later duplicates get the stored result back for
+IDEMPOTENCY_TTL seconds. Server errors are not stored, so a retry runs
+again.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    result TEXT,
+    status_code INTEGER,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_expires ON requests (expires_at);
+"""
+
+RUNNING = "running"
+DONE = "done"
+
+POLL_INTERVAL = 0.25
+
+
+class Conflict(Exception):
+    """An Idempotency-Key header was reused with a different payload."""
+
+
+def _db():
+    return storage.connect(settings.IDEMPOTENCY_DB_PATH, _SCHEMA)
+
+
+def make_key(scope, payload, header_key=None):
+    """(key, fingerprint) for a request: scope is the route (and mode), payload its body."""
+    encoded = json.dumps([scope, payload], sort_keys=True, separators=(",", ":"), default=str)
+    fingerprint = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    if header_key:
+        return f"{scope}:key:{header_key.strip()[:200]}", fingerprint
+    return f"{scope}:body:{fingerprint}", fingerprint
+
+
+def _claim(key, fingerprint, owner):
+    """Claim key for owner. Returns None when claimed, else the existing row."""
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        # Expired rows are stored results past their window, or runs whose owner died
+        conn.execute("DELETE FROM requests WHERE expires_at < ?", (now,))
+        row = conn.execute("SELECT * FROM requests WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            if row["fingerprint"] != fingerprint:
+                raise Conflict(key)
+            return row
+        conn.execute(
+            "INSERT INTO requests (key, fingerprint, status, owner, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, fingerprint, RUNNING, owner, now + settings.IDEMPOTENCY_LEASE_SECONDS),
+        )
+    return None
+
+
+def _store(key, owner, result, status_code):
+    _db().execute(
+        "UPDATE requests SET status = ?, result = ?, status_code = ?, expires_at = ? WHERE key = ? AND owner = ?",
+        (DONE, json.dumps(result), status_code, time.time() + settings.IDEMPOTENCY_TTL, key, owner),
+    )
+
+
+def _release(key, owner):
+    _db().execute("DELETE FROM requests WHERE key = ? AND owner = ?", (key, owner))
+
+
+def begin(key, fingerprint):
+    """Claim key for this request, waiting while another request with it runs.
+
+    Returns (owner, None) when this request should run, and then call
+    finish() or release() with owner; or (None, (result, status_code)) with
+    the result of the request that ran. Returns (None, None) when
+    idempotency is off. Raises Conflict when the key was used for a
+    different payload.
+    """
+    if not settings.IDEMPOTENCY_ENABLED:
+        return None, None
+
+    owner = f"{os.getpid()}-{threading.get_ident()}-{time.time()}"
+    waited = False
+    while True:
+        row = _claim(key, fingerprint, owner)
+        if row is None:
+            break
+        if row["status"] == DONE:
+            metrics.inc("idempotency_requests_total", result="coalesced" if waited else "replayed")
+            logger.info(f"Duplicate request {key[:40]} answered from the {'in-flight' if waited else 'stored'} result")
+            return None, (json.loads(row["result"]), row["status_code"])
+        # Another request with this key is running, in this or another worker: wait for it
+        # (if its owner dies, the row expires and this request claims the key instead)
+        waited = True
+        time.sleep(POLL_INTERVAL)
+    metrics.inc("idempotency_requests_total", result="executed")
+    return owner, None
+
+
+def finish(key, owner, result, status_code):
+    """Store the result for duplicates; server errors and 429s are released instead, so a retry runs."""
+    if owner is None:
+        return
+    if status_code >= 500 or status_code == 429:
+        _release(key, owner)
+    else:
+        _store(key, owner, result, status_code)
+
+
+def release(key, owner):
+    """Give up the claim without a result (the request failed or was abandoned)."""
+    if owner is not None:
+        _release(key, owner)
+
+
+def run(key, fingerprint, execute):
+    """Run execute() -> (result, status_code) once per key.
+
+    Returns (result, status_code, replayed); replayed is True when the
+    result came from another request with the same key. Raises Conflict
+    when the key was used for a different payload.
+    """
+    owner, stored = begin(key, fingerprint)
+    if stored is not None:
+        return (*stored, True)
+    try:
+        result, status_code = execute()
+    except BaseException:
+        release(key, owner)
+        raise
+    finish(key, owner, result, status_code)
+    return result, status_code, False
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import admission
+import logging_setup
+import metrics
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    status_code INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 2
+
+_handlers = {}
+_wakeup = threading.Event()
+_pool_lock = threading.Lock()
+_pool_pid = None
+_migrated = set()
+
+
+def register(kind, handler):
+    """Register handler(payload) -> (result_dict, status_code) for a job kind."""
+    _handlers[kind] = handler
+
+
+def _db():
+    conn = storage.connect(settings.JOB_DB_PATH, _SCHEMA)
+    if settings.JOB_DB_PATH not in _migrated:
+        # Queues created before running jobs renewed their claim
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        _migrated.add(settings.JOB_DB_PATH)
+    return conn
+
+
+def enqueue(kind, payload):
+    """Persist a job and wake the local workers. Returns the job id."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    _db().execute(
+        "INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+        (job_id, kind, json.dumps(payload), QUEUED, time.time()),
+    )
+    logger.info(f"Job {job_id} ({kind}) queued")
+    start_workers()
+    _wakeup.set()
+    return job_id
+
+
+def get(job_id):
+    """Return the job row as a dict, or None if it does not exist."""
+    row = _db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job.pop("payload")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def _claim(worker_name):
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        # Jobs left "running" by a worker that died (e.g. recycled by max_requests) stop renewing
+        # their claim, and go back in the queue once it is JOB_STALE_SECONDS old
+        stale = now - settings.JOB_STALE_SECONDS
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ? AND attempts < ?",
+            (QUEUED, RUNNING, stale, MAX_ATTEMPTS),
+        )
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at) < ?",
+            (FAILED, "Job abandoned by worker", now, RUNNING, stale),
+        )
+        row = conn.execute(
+            "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+            (QUEUED,),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            (RUNNING, worker_name, now, now, row["id"]),
+        )
+    return row["id"], row["kind"], json.loads(row["payload"])
+
+
+def _heartbeat(job_id, worker_name, stop):
+    """Renew worker_name's claim on a running job every JOB_HEARTBEAT_SECONDS until stop is set."""
+    while not stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+        try:
+            renewed = _db().execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time(), job_id, worker_name, RUNNING),
+            ).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Job {job_id} heartbeat failed: {e}")
+            continue
+        if not renewed:
+            logger.warning(f"Job {job_id} is no longer claimed by {worker_name}")
+            return
+
+
+def _finish(job_id, worker_name, status, result=None, status_code=None, error=None):
+    """Record the outcome if worker_name still holds the job. Returns False when another worker took it over."""
+    return _db().execute(
+        "UPDATE jobs SET status = ?, result = ?, status_code = ?, error = ?, finished_at = ? "
+        "WHERE id = ? AND worker = ? AND status = ?",
+        (status, json.dumps(result) if result is not None else None, status_code, error, time.time(),
+         job_id, worker_name, RUNNING),
+    ).rowcount > 0
+
+
+def _purge_expired():
+    cutoff = time.time() - settings.JOB_RETENTION_SECONDS
+    _db().execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, cutoff))
+
+
+def run_once(worker_name="inline"):
+    """Claim and execute a single job. Returns False when the queue is empty."""
+    claimed = _claim(worker_name)
+    if claimed is None:
+        return False
+
+    job_id, kind, payload = claimed
+    logging_setup.set_request_id(f"job-{job_id[:12]}")
+    # Jobs have no client waiting on a 429; they queue for a model call slot instead
+    admission.set_blocking()
+    logger.info(f"Job {job_id} ({kind}) started by {worker_name}")
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, worker_name, stop),
+                     name=f"{worker_name}-heartbeat", daemon=True).start()
+    try:
+        with metrics.timer("job", kind=kind):
+            result, status_code = _handlers[kind](payload)
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {e}")
+        owned = _finish(job_id, worker_name, FAILED, error=str(e))
+    else:
+        status = DONE if status_code < 400 else FAILED
+        owned = _finish(job_id, worker_name, status, result=result, status_code=status_code,
+                        error=None if status == DONE else result.get("error"))
+        logger.info(f"Job {job_id} ({kind}) finished with status {status_code}")
+    finally:
+        stop.set()
+    if not owned:
+        logger.warning(f"Job {job_id} ({kind}) was claimed by another worker meanwhile; this run's outcome is not recorded")
+    return True
+
+
+def _worker_loop(worker_name):
+    last_purge = 0
+    while True:
+        try:
+            if time.time() - last_purge > 3600:
+                _purge_expired()
+                last_purge = time.time()
+            if run_once(worker_name):
+                continue
+        except Exception as e:
+            logger.error(f"Job worker {worker_name} error: {e}")
+        _wakeup.wait(settings.JOB_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_workers(count=None):
+    """Start the job worker threads for this process (idempotent, fork-aware)."""
+    global _pool_pid
+    pid = os.getpid()
+    if _pool_pid == pid:
+        return
+    with _pool_lock:
+        if _pool_pid == pid:
+            return
+        count = settings.JOB_WORKERS if count is None else count
+        for i in range(count):
+            name = f"job-worker-{pid}-{i}"
+            threading.Thread(target=_worker_loop, args=(name,), name=name, daemon=True).start()
+        _pool_pid = pid
+        logger.info(f"Started {count} job worker threads in process {pid}")
@@ -0,0 +1,239 @@
+"""Queue-based logging: JSON lines with request ids, written by one process.
+
+Log calls only put the record on a bounded in-memory queue. A forwarder
+thread in each process sends records as datagrams over a Unix socket pair
+to the process that called configure() (the gunicorn master under
+preload_app, or the single dev-server process). A listener thread there
+writes them to a size-rotated JSON file and the console. With a single
+writer, rotation cannot race between workers. Each datagram is sent
+atomically by the kernel, so there is no lock shared between processes: a
+worker killed in the middle of a send cannot block the others. A send that
+cannot complete within SEND_TIMEOUT, because the listener is behind, drops
+the record and counts it in dropped().
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import pickle
+import queue
+import socket
+import sys
+import threading
+from datetime import datetime, timezone
+
+import settings
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+SEND_TIMEOUT = 1.0
+# Longer messages and tracebacks are cut so that a record fits in one datagram
+MAX_DATAGRAM = 64 * 1024
+
+_configured_pid = None
+_sink = None  # sending end, inherited by forked workers
+_source = None  # receiving end, read by the listener
+_local = None  # (pid, queue) of the current process
+_local_lock = threading.Lock()
+_dropped = 0
+_exception_formatter = logging.Formatter()
+
+# Attributes every LogRecord has; anything else was passed with extra= and is kept
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+
+def set_request_id(request_id):
+    """Tag log records from the current thread (or task) with request_id."""
+    _request_id.set(request_id)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{line} [{request_id}]" if request_id else line
+
+
+class _ForwardingHandler(logging.handlers.QueueHandler):
+    """Puts records on this process's local queue without blocking; drops them when it is full."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def prepare(self, record):
+        # Resolve everything that may not pickle (args, tracebacks) into plain text
+        record = copy.copy(record)
+        record.request_id = _request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            _local_queue().put_nowait(record)
+        except queue.Full:
+            _count_dropped()
+
+
+def _count_dropped():
+    global _dropped
+    with _local_lock:
+        _dropped += 1
+
+
+def _send(record):
+    """Send one record to the listener; False if it had to be dropped."""
+    data = pickle.dumps(record)
+    if len(data) > MAX_DATAGRAM:
+        record.msg = record.msg[:MAX_DATAGRAM // 4] + " [truncated]"
+        record.exc_text = record.exc_text and record.exc_text[-MAX_DATAGRAM // 4:]
+        data = pickle.dumps(record)
+    try:
+        _sink.send(data)
+        return True
+    except OSError:  # timed out because the listener is behind, or it is gone (shutdown)
+        return False
+
+
+def _local_queue():
+    """Queue for this process, with its forwarder thread; recreated after a fork."""
+    global _local
+    pid = os.getpid()
+    local = _local
+    if local is not None and local[0] == pid:
+        return local[1]
+    with _local_lock:
+        if _local is None or _local[0] != pid:
+            # A queue inherited over fork may have been locked by a parent thread
+            q = queue.Queue(settings.LOG_QUEUE_SIZE)
+            threading.Thread(target=_forward, args=(q,), name=f"log-forwarder-{pid}", daemon=True).start()
+            atexit.register(_drain, q, pid)
+            _local = (pid, q)
+        return _local[1]
+
+
+def _forward(q):
+    while True:
+        if not _send(q.get()):
+            _count_dropped()
+
+
+def _drain(q, pid):
+    """Flush whatever is still queued when a worker exits (e.g. recycled by max_requests)."""
+    if os.getpid() != pid:
+        return  # inherited over fork; the parent flushes its own queue
+    while True:
+        try:
+            record = q.get_nowait()
+        except queue.Empty:
+            return
+        if not _send(record):
+            return
+
+
+def _listen(handlers):
+    while True:
+        try:
+            record = pickle.loads(_source.recv(MAX_DATAGRAM * 2))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            continue
+        if record is None:
+            return
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+
+def _stop_listener(listener):
+    if os.getpid() == _configured_pid:
+        try:
+            _sink.send(pickle.dumps(None))
+        except OSError:
+            return
+        listener.join(timeout=5)
+
+
+def dropped():
+    """Records this process dropped because its log queue was full or a send timed out."""
+    return _dropped
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure():
+    """Install the queue pipeline on the root logger (once; call before forking workers)."""
+    global _configured_pid, _sink, _source
+    if _configured_pid is not None:
+        return
+    _configured_pid = os.getpid()
+
+    handlers = []
+    if settings.LOG_FILE:
+        os.makedirs(os.path.dirname(settings.LOG_FILE) or ".", exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            settings.LOG_FILE, maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT,
+            encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(JsonFormatter() if settings.LOG_CONSOLE_FORMAT == "json" else TextFormatter())
+    handlers.append(console)
+
+    _source, _sink = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    _source.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    _sink.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * MAX_DATAGRAM)
+    _sink.settimeout(SEND_TIMEOUT)
+    listener = threading.Thread(target=_listen, args=(handlers,), name="log-listener", daemon=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_ForwardingHandler())
+    root.setLevel(settings.LOG_LEVEL)
+    for name, level in _parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,128 @@
+"""Single-pass tokenizer for the markdown subset the model returns.
+
+parse() turns plan text into a flat list of Block tuples that
+pdf_renderer draws. Inline text is split into runs of (style, text) where
+style is "", "B", "I" or "BI", so the renderer only switches fonts when
+the style actually changes.
+"""
+import re
+from collections import namedtuple
+
+# kind:   heading | bullet | number | paragraph | table | rule | blank
+# level:  heading level (1-6) or list nesting depth (0-based)
+# marker: "1." style label for numbered items, else None
+# content: runs for text blocks; list of rows (each a list of runs) for tables
+Block = namedtuple("Block", "kind level marker content")
+
+_HEADING_RE = re.compile(r"(#{1,6})\s+(.*?)\s*#*\s*$")
+_BULLET_RE = re.compile(r"([ \t]*)[-*+•]\s+(.*)$")
+_NUMBER_RE = re.compile(r"([ \t]*)(\d{1,3})[.)]\s+(.*)$")
+_RULE_RE = re.compile(r"\s*([-*_])(\s*\1){2,}\s*$")
+_TABLE_SEPARATOR_RE = re.compile(r"\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_INLINE_RE = re.compile(r"(\*\*|__|\*|_|`)")
+
+BLANK = Block("blank", 0, None, ())
+RULE = Block("rule", 0, None, ())
+
+
+def parse_inline(text):
+    """Split inline markdown into [(style, text), ...] runs, merging adjacent runs of the same style."""
+    runs = []
+    bold = italic = False
+    pos = 0
+    for match in _INLINE_RE.finditer(text):
+        token = match.group(1)
+        start, end = match.span()
+        before = text[start - 1] if start else " "
+        after = text[end] if end < len(text) else " "
+        if token == "_" and before.isalnum() and after.isalnum():
+            continue  # snake_case words, not emphasis
+        if token in ("*", "_") and (before.isspace() if italic else after.isspace()):
+            continue  # "2 * 3" or a closing marker after a space is literal text
+        if start > pos:
+            _append_run(runs, bold, italic, text[pos:start])
+        if token in ("**", "__"):
+            bold = not bold
+        elif token in ("*", "_"):
+            italic = not italic
+        # backticks are dropped: code spans render as plain text
+        pos = end
+    if pos < len(text):
+        _append_run(runs, bold, italic, text[pos:])
+    return runs
+
+
+def _append_run(runs, bold, italic, text):
+    style = ("B" if bold else "") + ("I" if italic else "")
+    if runs and runs[-1][0] == style:
+        runs[-1] = (style, runs[-1][1] + text)
+    else:
+        runs.append((style, text))
+
+
+def _indent_depth(indent):
+    width = len(indent.expandtabs(4))
+    return min(width // 2, 3)
+
+
+def _table_cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [parse_inline(cell.strip()) for cell in line.split("|")]
+
+
+def parse(text):
+    """Tokenize plan markdown into a list of Blocks in one pass over the lines."""
+    blocks = []
+    lines = text.split("\n")
+    i = 0
+    count = len(lines)
+    while i < count:
+        raw = lines[i].rstrip()
+        stripped = raw.strip()
+        i += 1
+
+        if not stripped:
+            if blocks and blocks[-1] is not BLANK:
+                blocks.append(BLANK)
+            continue
+
+        if stripped.startswith("#"):
+            match = _HEADING_RE.match(stripped)
+            if match:
+                blocks.append(Block("heading", len(match.group(1)), None, parse_inline(match.group(2))))
+                continue
+
+        if stripped.startswith("|"):
+            rows = [_table_cells(stripped)]
+            while i < count and lines[i].strip().startswith("|"):
+                row = lines[i].strip()
+                i += 1
+                if not _TABLE_SEPARATOR_RE.match(row):
+                    rows.append(_table_cells(row))
+            blocks.append(Block("table", 0, None, rows))
+            continue
+
+        if _RULE_RE.match(stripped):
+            blocks.append(RULE)
+            continue
+
+        match = _BULLET_RE.match(raw)
+        if match:
+            blocks.append(Block("bullet", _indent_depth(match.group(1)), None, parse_inline(match.group(2))))
+            continue
+
+        match = _NUMBER_RE.match(raw)
+        if match:
+            blocks.append(Block("number", _indent_depth(match.group(1)), f"{match.group(2)}.",
+                                parse_inline(match.group(3))))
+            continue
+
+        blocks.append(Block("paragraph", 0, None, parse_inline(stripped)))
+
+    while blocks and blocks[-1] is BLANK:
+        blocks.pop()
+    return blocks
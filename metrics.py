@@ -0,0 +1,258 @@
+"""Counters, gauges and histograms shared across gunicorn workers.
+
+Each process keeps its metrics in memory and a background thread writes
+them to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds. The
+/metrics endpoint sums the files of every process (the same idea as
+prometheus_client's multiprocess mode, without the dependency) and renders
+the Prometheus text format. Counters and histograms of exited workers are
+kept; their gauges are ignored.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "diet_"
+
+# Seconds; generation stages range from milliseconds (cache hits) to minutes
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = defaultdict(float)
+_histograms = {}
+_types = {}
+_dirty = False
+_flusher_pid = None
+
+
+def _series(name, labels):
+    name = PREFIX + name
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{labels[k]}"' for k in sorted(labels)) + "}"
+
+
+def _split(series):
+    name, _, labels = series.partition("{")
+    return name, labels.rstrip("}")
+
+
+def inc(name, amount=1, **labels):
+    """Add to a counter."""
+    global _dirty
+    with _lock:
+        _types[PREFIX + name] = "counter"
+        _counters[_series(name, labels)] += amount
+        _dirty = True
+    _start_flusher()
+
+
+def gauge_add(name, delta, **labels):
+    """Move a gauge up or down (e.g. in-flight work)."""
+    global _dirty
+    with _lock:
+        _types[PREFIX + name] = "gauge"
+        _gauges[_series(name, labels)] += delta
+        _dirty = True
+    _start_flusher()
+
+
+def observe(name, value, **labels):
+    """Record a value in a histogram with the shared BUCKETS."""
+    global _dirty
+    with _lock:
+        _types[PREFIX + name] = "histogram"
+        histogram = _histograms.setdefault(_series(name, labels), {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        _dirty = True
+    _start_flusher()
+
+
+@contextmanager
+def timer(stage, **labels):
+    """Time one stage of a request: latency histogram, outcome counter and in-flight gauge."""
+    started = time.perf_counter()
+    outcome = "ok"
+    gauge_add("stage_in_flight", 1, stage=stage)
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        gauge_add("stage_in_flight", -1, stage=stage)
+        observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+        inc("stage_total", stage=stage, outcome=outcome, **labels)
+
+
+def record_usage(usage):
+    """Count OpenAI token usage from a completion's ``usage`` (may be None)."""
+    if usage is None:
+        return
+    inc("openai_tokens_total", usage.prompt_tokens or 0, kind="prompt")
+    inc("openai_tokens_total", usage.completion_tokens or 0, kind="completion")
+
+
+def _state():
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {k: dict(v, buckets=list(v["buckets"])) for k, v in _histograms.items()},
+            "types": dict(_types),
+        }
+
+
+def flush():
+    """Write this process's metrics file."""
+    global _dirty
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    with _lock:
+        _dirty = False
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_state(), f)
+    os.replace(tmp, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        if _dirty:
+            try:
+                flush()
+            except OSError as e:
+                logger.warning(f"Could not write metrics: {e}")
+
+
+def _start_flusher():
+    global _flusher_pid, _dirty
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _lock:
+        if _flusher_pid == pid:
+            return
+        if _flusher_pid is not None:
+            # Forked from a process that already recorded metrics: start from zero
+            _counters.clear()
+            _gauges.clear()
+            _histograms.clear()
+            _dirty = False
+        _flusher_pid = pid
+    threading.Thread(target=_flush_loop, name=f"metrics-flush-{pid}", daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Sum the metrics of every process. Returns a dict like _state() plus a live process count."""
+    if _dirty:
+        flush()
+    merged = {"counters": defaultdict(float), "gauges": defaultdict(float), "histograms": {}, "types": {}, "processes": 0}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue  # being replaced, or left half-written by a killed worker
+        merged["types"].update(state["types"])
+        for series, value in state["counters"].items():
+            merged["counters"][series] += value
+        for series, value in state["histograms"].items():
+            total = merged["histograms"].setdefault(series, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], value["buckets"])]
+            total["sum"] += value["sum"]
+            total["count"] += value["count"]
+        if _alive(state["pid"]):
+            merged["processes"] += 1
+            for series, value in state["gauges"].items():
+                merged["gauges"][series] += value
+    return merged
+
+
+def total(values, name, **labels):
+    """Sum the series of one metric in values (a collect() section) whose labels match."""
+    wanted = [f'{k}="{v}"' for k, v in labels.items()]
+    result = 0
+    for series, value in values.items():
+        series_name, series_labels = _split(series)
+        if series_name == PREFIX + name and all(label in series_labels.split(",") for label in wanted):
+            result += value
+    return result
+
+
+def render(snapshot=None):
+    """Prometheus text exposition format."""
+    snapshot = snapshot or collect()
+    lines = []
+    by_name = defaultdict(list)
+    for section in ("counters", "gauges"):
+        for series, value in sorted(snapshot[section].items()):
+            by_name[_split(series)[0]].append(f"{series} {value:g}")
+    for series, histogram in sorted(snapshot["histograms"].items()):
+        name, labels = _split(series)
+        prefix = labels + "," if labels else ""
+        # observe() counts a value in every bucket it fits, so buckets are already cumulative
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            by_name[name].append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {count}')
+        by_name[name].append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram["count"]}')
+        suffix = "{" + labels + "}" if labels else ""
+        by_name[name].append(f"{name}_sum{suffix} {histogram['sum']:g}")
+        by_name[name].append(f"{name}_count{suffix} {histogram['count']}")
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {name} {snapshot['types'].get(name, 'untyped')}")
+        lines.extend(by_name[name])
+    return "\n".join(lines) + "\n"
+
+
+def reset_dir():
+    """Remove every process file; called by the gunicorn master before workers start."""
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class Window:
+    """Counter deltas over roughly the last ``seconds``, for readiness checks."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        # Until the window has filled, deltas are counted from zero
+        self._baselines = [(time.time(), {})]
+        self._lock = threading.Lock()
+
+    def deltas(self, snapshot):
+        now = time.time()
+        with self._lock:
+            self._baselines.append((now, dict(snapshot["counters"])))
+            # Keep the newest baseline that is at least `seconds` old, and everything after it
+            while len(self._baselines) > 1 and now - self._baselines[1][0] >= self.seconds:
+                self._baselines.pop(0)
+            baseline = self._baselines[0][1]
+        return {series: value - baseline.get(series, 0) for series, value in snapshot["counters"].items()}
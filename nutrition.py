@@ -0,0 +1,289 @@
+"""Energy and macro targets, and dosha-suited candidate foods, for the prompts.
+
+targets() computes BMR (Mifflin-St Jeor), TDEE and daily protein, carbs,
+fat and fibre from the profile, so the model no longer estimates them, or
+invents different numbers, on every call. candidates() picks foods from
+foods.csv that do not aggravate the user's doshas, without high-GI foods
+for diabetes, PCOS and weight management. prompt_section() formats both
+for PROMPT_TEMPLATE and NODE_PROMPT_TEMPLATE, with per-100 g values the
+model sizes its portions from.
+
+foods.csv is compiled to a flat binary file (FOODS_INDEX_PATH): a header
+with the CSV's digest, fixed-size records and a string table. load() maps
+it read-only with mmap and decodes records from the map on demand. With
+preload_app it is loaded before fork (warmup.py), so every worker reads the
+same pages. The file is rebuilt whenever foods.csv changes.
+"""
+import csv
+import functools
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+from dataclasses import dataclass
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+GROUPS = ("grain", "legume", "dairy", "vegetable", "leafy", "fruit", "nut_seed", "fat", "sweetener", "spice", "beverage")
+GROUP_LABELS = {
+    "grain": "Grains", "legume": "Legumes", "dairy": "Dairy", "vegetable": "Vegetables", "leafy": "Greens",
+    "fruit": "Fruit", "nut_seed": "Nuts and seeds", "fat": "Fats", "sweetener": "Sweeteners",
+    "spice": "Spices", "beverage": "Drinks",
+}
+# Used in small amounts, so only their names go into the prompt
+NAME_ONLY_GROUPS = {"spice", "beverage"}
+GI_CLASSES = ("L", "M", "H")
+DOSHAS = ("vata", "pitta", "kapha")
+
+# Conditions that leave out high-GI foods and sweeteners
+LOW_GI_CONDITIONS = ("diabet", "pcos", "insulin", "weight", "obes")
+
+ACTIVITY_FACTORS = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "very": 1.9, "active": 1.725}
+
+# Share of the day's energy per meal section
+MEAL_SHARES = (
+    ("Early Morning", 0.05), ("Breakfast", 0.20), ("Mid-Morning Snack", 0.10), ("Lunch", 0.30),
+    ("Evening Snack", 0.10), ("Dinner", 0.20), ("Bedtime", 0.05),
+)
+
+MAGIC = b"FOOD"
+FORMAT_VERSION = 1
+# magic, format version, record count, CSV digest, string table offset
+HEADER = struct.Struct("<4sHH16sI")
+# name offset and length, group, GI class, kcal, protein, carbs, fat, fibre, vata, pitta, kapha
+RECORD = struct.Struct("<IHBB5f3b")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class Food:
+    name: str
+    group: str
+    kcal: float
+    protein: float
+    carbs: float
+    fat: float
+    fibre: float
+    gi: str
+    vata: int
+    pitta: int
+    kapha: int
+
+    def effect(self, doshas):
+        """Summed effect on the doshas (+1 pacifies, -1 aggravates); all three when doshas is empty."""
+        return sum(getattr(self, dosha) for dosha in doshas or DOSHAS)
+
+    def aggravates(self, doshas):
+        return any(getattr(self, dosha) < 0 for dosha in doshas or DOSHAS)
+
+
+@dataclass(frozen=True, slots=True)
+class Targets:
+    bmr: int
+    tdee: int
+    kcal: int
+    protein: int
+    carbs: int
+    fat: int
+    fibre: int
+    goal: str
+
+    def meals(self):
+        return [(meal, int(round(self.kcal * share / 5) * 5)) for meal, share in MEAL_SHARES]
+
+
+def _digest(csv_path):
+    with open(csv_path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()[:16]
+
+
+def compile_index(csv_path, index_path):
+    """Compile foods.csv to the binary index. Returns the number of foods."""
+    records, strings = [], bytearray()
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                name = row["name"].strip().encode("utf-8")
+                records.append(RECORD.pack(
+                    len(strings), len(name), GROUPS.index(row["group"]), GI_CLASSES.index(row["gi"]),
+                    *(float(row[field]) for field in ("kcal", "protein", "carbs", "fat", "fibre")),
+                    *(int(row[dosha]) for dosha in DOSHAS)))
+            except (KeyError, ValueError, struct.error) as e:
+                raise ValueError(f"{csv_path} line {line}: {e}") from e
+            strings += name
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(records), _digest(csv_path),
+                         HEADER.size + RECORD.size * len(records))
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header + b"".join(records) + bytes(strings))
+    os.replace(tmp_path, index_path)
+    return len(records)
+
+
+class FoodIndex:
+    """Read-only view of a compiled index file, with the record numbers of each group."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.digest, self._strings = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} food index")
+        groups = {}
+        for number in range(self.count):
+            group = self._map[HEADER.size + number * RECORD.size + 6]
+            groups.setdefault(GROUPS[group], []).append(number)
+        self._groups = {group: tuple(numbers) for group, numbers in groups.items()}
+
+    def __len__(self):
+        return self.count
+
+    def food(self, number):
+        offset, length, group, gi, *values = RECORD.unpack_from(self._map, HEADER.size + number * RECORD.size)
+        start = self._strings + offset
+        return Food(self._map[start:start + length].decode("utf-8"), GROUPS[group],
+                    *(round(value, 1) for value in values[:5]), GI_CLASSES[gi], *values[5:])
+
+    def group(self, name):
+        return [self.food(number) for number in self._groups.get(name, ())]
+
+
+def load():
+    """The food index of this process, compiled from FOODS_CSV_PATH first if it is missing or stale."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                digest = _digest(settings.FOODS_CSV_PATH)
+                try:
+                    index = FoodIndex(settings.FOODS_INDEX_PATH)
+                except (OSError, ValueError, struct.error):
+                    index = None
+                if index is None or index.digest != digest:
+                    count = compile_index(settings.FOODS_CSV_PATH, settings.FOODS_INDEX_PATH)
+                    logger.info(f"Compiled {count} foods to {settings.FOODS_INDEX_PATH}")
+                    index = FoodIndex(settings.FOODS_INDEX_PATH)
+                _index = index
+    return _index
+
+
+def version():
+    """Changes with foods.csv; part of the plan cache namespace."""
+    if not settings.NUTRITION_ENABLED:
+        return "off"
+    try:
+        return load().digest.hex()[:8]
+    except (OSError, ValueError) as e:
+        logger.warning(f"Food index unavailable: {e}")
+        return "nofoods"
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def doshas_of(text):
+    """The doshas named in a dosha field ("Vata-Pitta" -> vata, pitta); () for mixed or unknown."""
+    text = str(text or "").lower()
+    return tuple(dosha for dosha in DOSHAS if dosha in text)
+
+
+def _low_gi(conditions):
+    text = " ".join(str(condition or "") for condition in conditions).lower()
+    return any(keyword in text for keyword in LOW_GI_CONDITIONS)
+
+
+def _activity_factor(activity):
+    factor = _number(activity)
+    if factor and 1.1 <= factor <= 2.5:
+        return factor
+    text = str(activity or "").lower()
+    return next((value for keyword, value in ACTIVITY_FACTORS.items() if keyword in text),
+                settings.NUTRITION_ACTIVITY_FACTOR)
+
+
+def targets(age, gender, height, weight, conditions=(), activity=None):
+    """Daily Targets from the profile, or None when age, height or weight is missing or implausible."""
+    age, height, weight = _number(age), _number(height), _number(weight)
+    if not (age and height and weight) or not (10 <= age <= 110 and 100 <= height <= 250 and 25 <= weight <= 300):
+        return None
+    gender = str(gender or "").strip().lower()
+    offset = 5 if gender.startswith("m") else -161 if gender.startswith("f") else -78
+    bmr = 10 * weight + 6.25 * height - 5 * age + offset
+    tdee = bmr * _activity_factor(activity)
+    bmi = weight / (height / 100) ** 2
+    conditions_text = " ".join(str(condition or "") for condition in conditions).lower()
+    if bmi >= 25 or "weight" in conditions_text or "obes" in conditions_text:
+        goal, kcal = "gradual weight loss", max(tdee * 0.85, bmr, 1200)
+    elif bmi < 18.5:
+        goal, kcal = "weight gain", tdee * 1.10
+    else:
+        goal, kcal = "maintenance", tdee
+    kcal = round(kcal / 10) * 10
+    protein_per_kg = 1.2 if age >= 60 or goal == "gradual weight loss" else 1.0
+    protein = min(round(protein_per_kg * weight), round(kcal * 0.30 / 4))
+    fat = round(kcal * (0.30 if _low_gi(conditions) else 0.28) / 9)
+    carbs = round((kcal - protein * 4 - fat * 9) / 4)
+    return Targets(round(bmr), round(tdee), kcal, protein, carbs, fat, round(14 * kcal / 1000), goal)
+
+
+@functools.lru_cache(maxsize=64)
+def _candidates(doshas, low_gi, per_group):
+    index = load()
+    chosen = {}
+    for group in GROUPS:
+        if low_gi and group == "sweetener":
+            continue
+        foods = [food for food in index.group(group)
+                 if not food.aggravates(doshas) and not (low_gi and food.gi == "H")]
+        foods.sort(key=lambda food: (-food.effect(doshas), -(food.protein * 4 / food.kcal if food.kcal else 0), food.name))
+        if foods:
+            chosen[group] = tuple(foods[:per_group])
+    return chosen
+
+
+def candidates(dosha, conditions=(), per_group=None):
+    """{group: foods} that do not aggravate the dosha, best suited first."""
+    return _candidates(doshas_of(dosha), _low_gi(conditions), per_group or settings.NUTRITION_FOODS_PER_GROUP)
+
+
+def _format_food(food):
+    if food.group in NAME_ONLY_GROUPS:
+        return food.name
+    return f"{food.name} {food.kcal:g}/{food.protein:g}/{food.carbs:g}/{food.fat:g}"
+
+
+def prompt_section(age, gender, height, weight, dosha, conditions=(), activity=None):
+    """Targets and candidate foods as prompt text; "" when off or nothing could be computed."""
+    if not settings.NUTRITION_ENABLED:
+        return ""
+    lines = []
+    daily = targets(age, gender, height, weight, conditions, activity)
+    if daily:
+        lines += [
+            "**Computed Daily Targets (use as given, do not recalculate):**",
+            f"* Energy: {daily.kcal} kcal/day (BMR {daily.bmr}, TDEE {daily.tdee}; goal: {daily.goal})",
+            f"* Protein {daily.protein} g, carbohydrates {daily.carbs} g, fat {daily.fat} g, fibre {daily.fibre} g",
+            "* Meal energy (kcal): " + ", ".join(f"{meal} {kcal}" for meal, kcal in daily.meals()),
+        ]
+    try:
+        foods = candidates(dosha, conditions)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Food index unavailable: {e}")
+        foods = {}
+    if foods:
+        suited = "-".join(dosha.capitalize() for dosha in doshas_of(dosha)) or "all doshas"
+        lines.append(f"**Candidate Foods for {suited} (kcal/protein g/carbs g/fat g per 100 g as served):**")
+        lines += [f"* {GROUP_LABELS[group]}: " + "; ".join(_format_food(food) for food in group_foods)
+                  for group, group_foods in foods.items()]
+    return "\n".join(lines)
@@ -0,0 +1,309 @@
+import logging
+import os
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+import uuid
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import artifacts
+import metrics
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    to_addr TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attachment BLOB,
+    artifact_id TEXT,
+    filename TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+# A message claimed this long ago by a sender that never reported back is retried
+CLAIM_TIMEOUT = 300
+
+_wakeup = threading.Event()
+_senders_lock = threading.Lock()
+_senders_pid = None
+_migrated = set()
+
+
+def _db():
+    conn = storage.connect(settings.OUTBOX_DB_PATH, _SCHEMA)
+    if settings.OUTBOX_DB_PATH not in _migrated:
+        # Outboxes created before attachments could live in the artifact store
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if "artifact_id" not in columns:
+            try:
+                conn.execute("ALTER TABLE outbox ADD COLUMN artifact_id TEXT")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        _migrated.add(settings.OUTBOX_DB_PATH)
+    return conn
+
+
+def smtp_configured():
+    return all([settings.SMTP_HOST, settings.SMTP_PORT, settings.SMTP_USERNAME,
+                settings.SMTP_PASSWORD, settings.EMAIL_FROM])
+
+
+def build_message(to_email, subject, body, attachment=None, filename="Ayurvedic_Diet_Plan.pdf"):
+    msg = MIMEMultipart()
+    msg['From'] = settings.EMAIL_FROM
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+
+    if attachment is not None:
+        part = MIMEApplication(attachment, Name=filename)
+        part['Content-Disposition'] = f'attachment; filename="{filename}"'
+        msg.attach(part)
+    return msg
+
+
+def enqueue(to_email, subject, body, attachment=None, filename="Ayurvedic_Diet_Plan.pdf", artifact_id=None):
+    """Store a message for background delivery. Returns the message id, or None if SMTP is not configured.
+
+    The attachment is either bytes stored with the message or the id of a
+    PDF in the artifact store, read (or rendered again) when it is sent.
+    """
+    if not smtp_configured():
+        logger.warning("SMTP settings are not fully configured. Skipping email.")
+        return None
+
+    message_id = uuid.uuid4().hex
+    now = time.time()
+    _db().execute(
+        "INSERT INTO outbox (id, to_addr, subject, body, attachment, artifact_id, filename, status, "
+        "next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (message_id, to_email, subject, body, bytes(attachment) if attachment is not None else None,
+         artifact_id, filename, PENDING, now, now),
+    )
+    logger.info(f"Email {message_id} to {to_email} queued")
+    start_senders()
+    _wakeup.set()
+    return message_id
+
+
+def stats():
+    rows = _db().execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+    counts = {row["status"]: row["n"] for row in rows}
+    return {status: counts.get(status, 0) for status in (PENDING, SENDING, SENT, DEAD)}
+
+
+def dead_letters(limit=50):
+    """Messages that exhausted their retries, newest first (without attachments)."""
+    rows = _db().execute(
+        "SELECT id, to_addr, subject, attempts, last_error, created_at FROM outbox "
+        "WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+        (DEAD, limit),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def requeue_dead(message_id):
+    """Give a dead-lettered message a fresh set of attempts."""
+    cur = _db().execute(
+        "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ? WHERE id = ? AND status = ?",
+        (PENDING, time.time(), message_id, DEAD),
+    )
+    if cur.rowcount:
+        start_senders()
+        _wakeup.set()
+    return bool(cur.rowcount)
+
+
+class SmtpConnection:
+    """An authenticated SMTP connection kept open and reused across messages."""
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0
+
+    def _connect(self):
+        host, port = settings.SMTP_HOST, settings.SMTP_PORT
+        if settings.SMTP_SECURITY == "ssl":
+            server = smtplib.SMTP_SSL(host, port, context=ssl.create_default_context(), timeout=30)
+        else:
+            server = smtplib.SMTP(host, port, timeout=30)
+            if settings.SMTP_SECURITY == "starttls":
+                server.starttls(context=ssl.create_default_context())
+        server.ehlo()
+        if server.has_extn("auth"):
+            server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+        logger.info(f"Opened SMTP connection to {host}:{port}")
+        return server
+
+    def _alive(self):
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    def send(self, msg):
+        if self._server is not None and time.time() - self._last_used > settings.SMTP_IDLE_SECONDS and not self._alive():
+            self.close()
+        for attempt in range(2):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.sendmail(settings.EMAIL_FROM, msg['To'], msg.as_string())
+                self._last_used = time.time()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped an idle connection; reconnect once
+                self._server = None
+                if attempt == 1:
+                    raise
+
+    def close_if_idle(self):
+        if self._server is not None and time.time() - self._last_used > settings.SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def _claim(sender_name):
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        conn.execute(
+            "UPDATE outbox SET status = ? WHERE status = ? AND claimed_at < ?",
+            (PENDING, SENDING, now - CLAIM_TIMEOUT),
+        )
+        row = conn.execute(
+            "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+            (PENDING, now),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE outbox SET status = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+            (SENDING, now, row["id"]),
+        )
+    return dict(row, attempts=row["attempts"] + 1)
+
+
+def _record_failure(message, error, permanent=False):
+    attempts = message["attempts"]
+    if permanent or attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Email {message['id']} to {message['to_addr']} moved to dead letters after {attempts} attempts: {error}")
+        metrics.inc("outbox_dead_letters_total")
+        _db().execute("UPDATE outbox SET status = ?, last_error = ? WHERE id = ?", (DEAD, str(error), message["id"]))
+        return
+
+    # Exponential backoff, off the request path
+    wait_time = settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    metrics.inc("retries_total", stage="smtp")
+    logger.warning(f"Email {message['id']} failed (attempt {attempts}): {error}; retrying in {wait_time:.0f}s")
+    _db().execute(
+        "UPDATE outbox SET status = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+        (PENDING, str(error), time.time() + wait_time, message["id"]),
+    )
+
+
+def _purge_expired():
+    """Delete sent messages, with their recipient and subject, after OUTBOX_RETENTION_SECONDS."""
+    cutoff = time.time() - settings.OUTBOX_RETENTION_SECONDS
+    purged = _db().execute("DELETE FROM outbox WHERE status = ? AND sent_at < ?", (SENT, cutoff)).rowcount
+    if purged:
+        logger.info(f"Purged {purged} sent emails older than OUTBOX_RETENTION_SECONDS")
+    return purged
+
+
+def send_next(connection, sender_name="inline"):
+    """Deliver one due message over connection. Returns False when nothing is due."""
+    message = _claim(sender_name)
+    if message is None:
+        return False
+
+    attachment = message["attachment"]
+    if attachment is None and message["artifact_id"]:
+        try:
+            attachment = artifacts.read(message["artifact_id"])
+        except Exception as e:
+            _record_failure(message, f"Rendering the attachment failed: {e}")
+            return True
+        if attachment is None:
+            _record_failure(message, f"PDF artifact {message['artifact_id']} has expired", permanent=True)
+            return True
+
+    msg = build_message(message["to_addr"], message["subject"], message["body"], attachment, message["filename"])
+    try:
+        with metrics.timer("smtp"):
+            connection.send(msg)
+    except smtplib.SMTPAuthenticationError as e:
+        connection.close()
+        _record_failure(message, e, permanent=True)
+    except (smtplib.SMTPException, OSError) as e:
+        connection.close()
+        _record_failure(message, e)
+    else:
+        _db().execute(
+            "UPDATE outbox SET status = ?, sent_at = ?, attachment = NULL, last_error = NULL WHERE id = ?",
+            (SENT, time.time(), message["id"]),
+        )
+        logger.info(f"Email sent successfully to {message['to_addr']}")
+    return True
+
+
+def _sender_loop(sender_name):
+    connection = SmtpConnection()
+    last_purge = 0
+    while True:
+        try:
+            if time.time() - last_purge > 3600:
+                _purge_expired()
+                last_purge = time.time()
+            if send_next(connection, sender_name):
+                continue
+            connection.close_if_idle()
+        except Exception as e:
+            logger.error(f"Outbox sender {sender_name} error: {e}")
+        _wakeup.wait(settings.OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_senders(count=None):
+    """Start the background sender threads for this process (idempotent, fork-aware)."""
+    global _senders_pid
+    pid = os.getpid()
+    if _senders_pid == pid:
+        return
+    with _senders_lock:
+        if _senders_pid == pid:
+            return
+        count = settings.OUTBOX_SENDERS if count is None else count
+        for i in range(count):
+            name = f"outbox-sender-{pid}-{i}"
+            threading.Thread(target=_sender_loop, args=(name,), name=name, daemon=True).start()
+        _senders_pid = pid
@@ -0,0 +1,108 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import resilience
+import settings
+
+logger = logging.getLogger(__name__)
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+MEAL_SECTIONS = ["Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", "Bedtime"]
+
+GENERAL_INSTRUCTION = """
+Write ONLY the "General Recommendations" part of this 7-day plan: hydration, foods to favour and avoid,
+lifestyle and seasonal guidance for the user's profile, location and weather.
+Start with the heading "### General Recommendations". Do not write any daily meal plans.
+"""
+
+DAY_INSTRUCTION = """
+Write ONLY Day {number} ({day_name}) of this 7-day plan. Start with the heading "### Day {number} ({day_name})"
+and include these sections as "#### " subheadings: {sections}.
+Give portion sizes in grams (g) or milliliters (ml) and briefly explain why each meal suits the user.
+Vary the dishes so this day does not repeat the other days (this is day {number} of 7).
+Do not write general recommendations or any other day.
+"""
+
+
+def day_names(current_day):
+    """The seven weekday names starting from current_day."""
+    start = DAYS.index(current_day) if current_day in DAYS else 0
+    return [DAYS[(start + i) % 7] for i in range(7)]
+
+
+def _complete(client, system_instruction, prompt, max_tokens, label, model=None):
+    """One chat completion with exponential-backoff retries, within the request deadline."""
+    for attempt in range(settings.PARALLEL_MAX_RETRIES + 1):
+        try:
+            completion = resilience.chat_completion(
+                client,
+                model=model or settings.OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": system_instruction},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=max_tokens,
+                temperature=0.3,
+            )
+            return completion.choices[0].message.content.strip()
+        except (resilience.CircuitOpen, resilience.DeadlineExceeded) as e:
+            logger.error(f"{label} failed: {e}")
+            raise
+        except Exception as e:
+            wait_time = 2 ** attempt
+            left = resilience.remaining()
+            if attempt == settings.PARALLEL_MAX_RETRIES or (left is not None and left <= wait_time):
+                logger.error(f"{label} failed after {attempt + 1} attempts: {e}")
+                raise
+            metrics.inc("retries_total", stage="openai")
+            logger.warning(f"{label} failed (attempt {attempt + 1}): {e}; retrying in {wait_time}s")
+            time.sleep(wait_time)
+
+
+def generate_general(client, system_instruction, user_prompt):
+    return _complete(client, system_instruction, user_prompt + GENERAL_INSTRUCTION,
+                     settings.PARALLEL_GENERAL_MAX_TOKENS, "General recommendations")
+
+
+def generate_day(client, system_instruction, user_prompt, number, day_name):
+    prompt = user_prompt + DAY_INSTRUCTION.format(
+        number=number, day_name=day_name, sections=", ".join(MEAL_SECTIONS))
+    return _complete(client, system_instruction, prompt, settings.PARALLEL_DAY_MAX_TOKENS, f"Day {number}")
+
+
+def generate_sections(client, system_instruction, user_prompt, days, general=True, max_concurrency=None):
+    """Generate the general section and the given (number, day_name) days concurrently.
+
+    Returns (general_text or None, [day_text, ...] in the order of days).
+    """
+    max_concurrency = max_concurrency or settings.PARALLEL_MAX_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="plan-day") as pool:
+        # Each call runs in a copy of this thread's context variables: request id and deadline
+        submit = lambda fn, *args: pool.submit(contextvars.copy_context().run, fn, *args)
+        general_future = submit(generate_general, client, system_instruction, user_prompt) if general else None
+        day_futures = [
+            submit(generate_day, client, system_instruction, user_prompt, number, day_name)
+            for number, day_name in days
+        ]
+        return (general_future.result() if general_future else None), [day.result() for day in day_futures]
+
+
+def generate(client, system_instruction, user_prompt, current_day, max_concurrency=None):
+    """Generate the plan as one general call plus seven day calls run concurrently.
+
+    The sections are stitched back into the same "### Day N" markdown a
+    single completion produces, so create_pdf and the front end need no
+    changes. Wall-clock time is roughly that of the slowest call.
+    """
+    started = time.time()
+    days = list(enumerate(day_names(current_day), start=1))
+    general, day_texts = generate_sections(client, system_instruction, user_prompt, days,
+                                           max_concurrency=max_concurrency)
+    sections = [general] + day_texts
+
+    logger.info(f"Parallel plan generated with {len(sections)} calls in {time.time() - started:.1f}s")
+    return "\n\n".join(sections)
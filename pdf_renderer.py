@@ -0,0 +1,319 @@
+import copy
+import logging
+import os
+import re
+import string
+import threading
+from io import BytesIO
+
+from fontTools import subset as ftsubset
+from fontTools import ttLib
+from fpdf import FPDF, XPos, YPos
+from fpdf.fonts import SubsetMap
+
+import markdown_blocks
+import settings
+
+logger = logging.getLogger(__name__)
+
+FONT_FAMILY = "DejaVu"
+
+# Adding all three styles: Regular, Bold, and Italic (Oblique)
+FONT_FILES = {
+    "": "DejaVuSans.ttf",
+    "B": "DejaVuSans-Bold.ttf",
+    "I": "DejaVuSans-Oblique.ttf",
+}
+
+# Characters the model routinely uses in plans. Documents that stay inside
+# this set embed fonts from a pre-subset copy instead of the full TTF.
+COMMON_CHARS = string.printable + "•–—‘’“”…°×½¼¾₹·→≈"
+
+
+class PDF(FPDF):
+    def header(self):
+        try:
+            self.set_font('DejaVu', 'B', 14)
+        except RuntimeError:
+            self.set_font('Arial', 'B', 14)
+        # Corrected call to avoid deprecation warnings
+        self.cell(0, 10, 'Your Personalized Ayurvedic Diet Plan', align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.ln(10)
+
+    def footer(self):
+        self.set_y(-15)
+        try:
+            self.set_font('DejaVu', 'I', 8)
+        except RuntimeError:
+            self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', align='C')
+
+
+class _CachedFont:
+    """A font file parsed once per process and cloned into each document.
+
+    fpdf2 parses the whole TTF (cmap, widths, glyph ids) in add_font and
+    then destructively subsets ``ttfont`` when the document is written, so
+    the parsed metrics can be shared between documents but each document
+    needs its own ``ttfont``. That one is loaded from bytes kept in memory,
+    preferably from a copy already subset to COMMON_CHARS.
+    """
+
+    def __init__(self, style, path):
+        self.style = style
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+        template = FPDF()
+        template.add_font(FONT_FAMILY, style, path)
+        self.prototype = template.fonts[f"{FONT_FAMILY.lower()}{style}"]
+        self.common_data = self._subset_common()
+
+    def _subset_common(self):
+        font = ttLib.TTFont(BytesIO(self.data), recalcTimestamp=False)
+        # Keep glyph names: fpdf2 looks glyphs up by the names from the full font's cmap
+        options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True)
+        options.drop_tables += ["GSUB", "GPOS", "GDEF", "FFTM", "hdmx", "meta", "MATH"]
+        subsetter = ftsubset.Subsetter(options)
+        subsetter.populate(unicodes=[ord(c) for c in COMMON_CHARS if ord(c) in self.prototype.cmap])
+        subsetter.subset(font)
+        output = BytesIO()
+        font.save(output)
+        return output.getvalue()
+
+    def attach(self, pdf, common_only):
+        font = copy.copy(self.prototype)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(
+            BytesIO(self.common_data if common_only else self.data), recalcTimestamp=False, lazy=True)
+        font.subset = SubsetMap(font)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        pdf.fonts[font.fontkey] = font
+
+
+_fonts = None
+_fonts_lock = threading.Lock()
+_common_set = frozenset(COMMON_CHARS)
+
+
+def load_fonts():
+    """Parse the DejaVu fonts once for this process.
+
+    Safe to call in the gunicorn master under preload_app: the cache is
+    plain data, so forked workers share it copy-on-write.
+    """
+    global _fonts
+    if _fonts is None:
+        with _fonts_lock:
+            if _fonts is None:
+                _fonts = [
+                    _CachedFont(style, os.path.join(settings.BASE_DIR, fname))
+                    for style, fname in FONT_FILES.items()
+                ]
+                logger.info(f"Loaded {len(_fonts)} PDF fonts")
+    return _fonts
+
+
+def _add_fonts(pdf, plan_text):
+    if not settings.PDF_FONT_CACHE:
+        for style, fname in FONT_FILES.items():
+            pdf.add_font(FONT_FAMILY, style, os.path.join(settings.BASE_DIR, fname))
+        return
+
+    common_only = _common_set.issuperset(plan_text)
+    for font in load_fonts():
+        font.attach(pdf, common_only)
+
+
+# (font size, line height, space after) per heading level
+HEADING_STYLES = {
+    1: (20, 12, 6),
+    2: (18, 11, 5),
+    3: (16, 10, 4),
+    4: (13, 8, 2),
+    5: (12, 7, 2),
+    6: (12, 7, 2),
+}
+BODY_SIZE = 11
+BODY_HEIGHT = 7
+LIST_INDENT = 5
+
+
+# fpdf2's own emphasis markers; literal occurrences in plan text are escaped
+_FPDF_MARKERS = re.compile(r"(\*\*|__|~~|--)")
+_FPDF_STYLE_MARKERS = {"": "", "B": "**", "I": "__"}
+_WORDS_RE = re.compile(r"\S+|\s+")
+
+
+def _face(style):
+    # Only regular, bold and italic faces are loaded; bold wins for bold-italic runs
+    return "B" if style == "BI" else style
+
+
+def _fpdf_markdown(runs, base_style=""):
+    """Turn styled runs into one fpdf2 markdown string for a single-line cell.
+
+    Returns (text, markdown); a line entirely in the base style is passed
+    through as plain text.
+    """
+    if len(runs) == 1 and runs[0][0] == base_style:
+        return runs[0][1], False
+    parts = []
+    for style, text in runs:
+        marker = _FPDF_STYLE_MARKERS[style]
+        text = _FPDF_MARKERS.sub(r"\\\1", text)
+        parts.append(f"{marker}{text}{marker}" if marker else text)
+    return "".join(parts), True
+
+
+def _merge(runs):
+    merged = []
+    for style, text in runs:
+        if merged and merged[-1][0] == style:
+            merged[-1] = (style, merged[-1][1] + text)
+        else:
+            merged.append((style, text))
+    return merged
+
+
+class _BlockRenderer:
+    """Draws markdown_blocks output.
+
+    fpdf2's multi_cell re-measures the whole line for every character it
+    adds, which gets slow once a line holds several styled fragments. The
+    renderer measures each word once, wraps the lines itself and emits
+    each line as a single no-wrap cell, switching fonts only when the
+    block's base style or size changes.
+    """
+
+    def __init__(self, pdf, family):
+        self.pdf = pdf
+        self.family = family
+        self.current = None
+        self.faces = {}
+
+    def font(self, style, size):
+        key = (style, size)
+        if key != self.current:
+            self.pdf.set_font(self.family, style, size)
+            self.current = key
+
+    def width(self, style, text, size):
+        face = self.faces.get(style)
+        if face is None:
+            self.font(style, size)
+            face = self.faces[style] = self.pdf.current_font
+        return face.get_text_width(text, size, None)[1] / self.pdf.k
+
+    def wrap(self, runs, size, max_width):
+        """Greedy word wrap of styled runs into lines of runs."""
+        lines = []
+        line, line_width = [], 0
+        word, word_width = [], 0
+        space, space_width = None, 0
+
+        def flush_word():
+            nonlocal line, line_width
+            if line and line_width + space_width + word_width > max_width:
+                lines.append(line)
+                line, line_width = [], 0
+            elif line and space is not None:
+                line.append(space)
+                line_width += space_width
+            line.extend(word)
+            line_width += word_width
+
+        for style, text in runs:
+            style = _face(style)
+            for token in _WORDS_RE.findall(text):
+                if token.isspace():
+                    if word:
+                        flush_word()
+                        word, word_width = [], 0
+                    space = (style, " ")
+                    space_width = self.width(style, " ", size)
+                else:
+                    word.append((style, token))
+                    word_width += self.width(style, token, size)
+        if word:
+            flush_word()
+        if line:
+            lines.append(line)
+        return lines
+
+    def text(self, runs, size, height, base_style=""):
+        pdf = self.pdf
+        if base_style:
+            runs = [(base_style, "".join(text for _, text in runs))]
+        x = pdf.get_x()
+        lines = self.wrap(runs, size, pdf.w - pdf.r_margin - x - 2 * pdf.c_margin)
+        # Markdown cells start from the current font, so select the block's base style last
+        self.font(base_style, size)
+        for line in lines or [[(base_style, "")]]:
+            content, markdown = _fpdf_markdown(_merge(line), base_style)
+            pdf.set_x(x)
+            pdf.cell(0, height, content, markdown=markdown, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    def list_item(self, block, label):
+        pdf = self.pdf
+        self.font("", BODY_SIZE)
+        # Hanging indent: continuation lines start where the first line's
+        # text does, not under the bullet
+        pdf.set_x(pdf.l_margin + LIST_INDENT * (block.level + 1))
+        pdf.cell(pdf.get_string_width(label), BODY_HEIGHT, label)
+        self.text(block.content, BODY_SIZE, BODY_HEIGHT)
+        pdf.ln(1)
+
+    def table(self, rows):
+        self.font("", BODY_SIZE - 1)
+        with self.pdf.table(text_align="LEFT", line_height=6, padding=1) as table:
+            for cells in rows:
+                row = table.row()
+                for runs in cells:
+                    row.cell("".join(text for _, text in runs))
+        self.current = None  # the table sets its own heading font
+        self.pdf.ln(2)
+
+    def render(self, blocks):
+        pdf = self.pdf
+        for block in blocks:
+            kind = block.kind
+            if kind == "paragraph":
+                self.text(block.content, BODY_SIZE, BODY_HEIGHT)
+                pdf.ln(2)
+            elif kind == "bullet":
+                self.list_item(block, "\u2022 ")
+            elif kind == "heading":
+                size, height, after = HEADING_STYLES[block.level]
+                self.text(block.content, size, height, base_style="B")
+                pdf.ln(after)
+            elif kind == "blank":
+                pdf.ln(5)
+            elif kind == "number":
+                self.list_item(block, f"{block.marker} ")
+            elif kind == "table":
+                self.table(block.content)
+            elif kind == "rule":
+                y = pdf.get_y() + 2
+                pdf.line(pdf.l_margin, y, pdf.w - pdf.r_margin, y)
+                pdf.ln(5)
+
+
+def create_pdf(plan_text, blocks=None):
+    """Render plan markdown to PDF bytes. blocks, when given, are used instead of parsing plan_text."""
+    pdf = PDF()
+
+    family = FONT_FAMILY
+    try:
+        _add_fonts(pdf, plan_text)
+        pdf.set_font(family, '', 12)
+    except (RuntimeError, OSError) as e:
+        logger.error(f"Font error: {e}. You may be missing font files. Falling back to Arial.")
+        family = 'Arial'
+        pdf.set_font(family, '', 12)
+
+    pdf.add_page()
+    _BlockRenderer(pdf, family).render(markdown_blocks.parse(plan_text) if blocks is None else blocks)
+    return pdf.output()
@@ -0,0 +1,509 @@
+"""Plan generation as a pipeline of stages shared by every entry point.
+
+    location -> weather -> prompt -> generate -> render -> deliver
+
+A run threads one context dict (see new_context) through the stages. Each
+stage is timed as diet_stage_seconds{stage=<name>}, and may answer from a
+cache instead of running: lookup() fills the context and skips run(), and
+store() saves what run() produced. A Pipeline is a list of stages:
+replace() swaps one out, and run(start=..., stop=...) runs a slice. The
+same pipeline runs inline (run), on an executor (submit, map) or from
+asyncio (run_async).
+
+FORM_PIPELINE serves /generate and /generate-stream; NODE_PIPELINE serves
+/generate-diet-from-node-data and /generate-batch.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+
+import admission
+import artifacts
+import clients
+import metrics
+import nutrition
+import outbox
+import parallel_plan
+import plan_cache
+import plan_model
+import plan_store
+import prompt_compaction
+import resilience
+import settings
+import weather
+from prompts import (
+    PROMPT_TEMPLATE, SYSTEM_INSTRUCTION, NODE_PROMPT_TEMPLATE, NODE_SYSTEM_INSTRUCTION,
+    PLAN_CACHE_NAMESPACE, NODE_PLAN_NAMESPACE,
+)
+
+logger = logging.getLogger(__name__)
+
+# /generate form fields and their defaults
+FORM_DEFAULTS = {
+    "age": "30", "gender": "Female", "height": "165", "weight": "60", "dosha": "mixed",
+    "disease": "None", "water": "2", "bmi": "22", "sleep": "Good",
+    "secondary_condition": "None", "appetite": "Normal",
+}
+
+
+def new_context(data, deliver=True):
+    """Context for one plan: data is the /generate form or a Node request body.
+
+    Stages add location_hint, latitude, longitude (location);
+    location_name, weather_desc (weather); user_prompt and cache_key
+    (prompt); plan_text, or for output_format "json" the plan_model.Plan
+    as plan, and regenerated (generate); artifact_id and plan_pdf_url
+    (render); email_queued (deliver). timings holds the seconds each stage
+    took. plan_text(ctx) gives the markdown in either case.
+    """
+    today = datetime.now().date()
+    output_format = data.get("output_format", settings.PLAN_OUTPUT_FORMAT)
+    # A structured plan comes from one completion; per-day calls only write markdown
+    generation_mode = "single" if output_format == "json" else data.get("generation_mode", settings.PLAN_GENERATION_MODE)
+    return {
+        "input": data,
+        "email_to": data.get("email"),
+        "generation_mode": generation_mode,
+        "output_format": output_format,
+        "deliver": deliver,
+        "today": today,
+        "current_day": today.strftime("%A"),
+        "timings": {},
+    }
+
+
+def plan_text(ctx):
+    """The plan as markdown; for a structured plan it is built on first use."""
+    plan = ctx.get("plan")
+    return plan.markdown() if plan is not None else ctx.get("plan_text")
+
+
+def model_calls(generation_mode):
+    """Model calls a generation keeps in flight at once, for admission control."""
+    if generation_mode == "parallel":
+        return min(len(parallel_plan.DAYS) + 1, settings.PARALLEL_MAX_CONCURRENCY)
+    return 1
+
+
+def deliver_plan(email_to, plan):
+    """Queue the plan's PDF for email. Returns True if the email was queued.
+
+    plan is the markdown or a plan_model.Plan. The outbox sender attaches
+    the PDF from the artifact store, rendering it there if no earlier
+    download or email already has.
+    """
+    email_queued = False
+    if plan and email_to:
+        try:
+            logger.debug(f"Queueing plan email to: {email_to}")
+            artifact_id = artifacts.register(plan)
+            email_subject = "Your Personalized Ayurvedic Diet Plan"
+            email_body = "Hello,\n\nPlease find your personalized 7-day Ayurvedic diet plan attached.\n\nBest regards,\nSamsara Wellness"
+
+            email_queued = outbox.enqueue(email_to, email_subject, email_body, artifact_id=artifact_id) is not None
+        except Exception as email_error:
+            logger.error(f"Queueing email failed with exception: {email_error}")
+            email_queued = False
+    else:
+        logger.info("No email provided or plan text empty - skipping email")
+    return email_queued
+
+
+class Stage:
+    """One step of a pipeline. Subclasses set name and implement run(ctx)."""
+
+    name = None
+
+    def labels(self, ctx):
+        """Extra metric labels for this run."""
+        return {}
+
+    def lookup(self, ctx):
+        """Fill ctx from a cache and return True to skip run()."""
+        return False
+
+    def store(self, ctx):
+        """Save what run() produced for later lookups."""
+
+    def run(self, ctx):
+        raise NotImplementedError
+
+
+class FormLocation(Stage):
+    name = "location"
+
+    def run(self, ctx):
+        form = ctx["input"]
+        ctx["location_hint"] = form.get("location", "Unknown")
+        ctx["latitude"] = form.get("latitude")
+        ctx["longitude"] = form.get("longitude")
+
+
+class NodeLocation(Stage):
+    """Location and coordinates from basicInfo, else from the top level of the metadata."""
+
+    name = "location"
+
+    def run(self, ctx):
+        metadata = ctx["input"].get("metadata") or {}
+        sources = (metadata.get("basicInfo") or {}, metadata)
+        # Each field is looked up on its own, so a top-level longitude is found next to a top-level latitude
+        for field, default in (("location", "Unknown"), ("latitude", None), ("longitude", None)):
+            value = next((source[field] for source in sources if source.get(field) is not None), default)
+            ctx["location_hint" if field == "location" else field] = value
+
+
+class Weather(Stage):
+    """Current weather for the coordinates; weather.lookup caches it per grid cell."""
+
+    name = "weather"
+
+    def run(self, ctx):
+        ctx["location_name"], ctx["weather_desc"] = weather.lookup(
+            ctx["latitude"], ctx["longitude"], ctx["location_hint"])
+        logger.info(f"Location: {ctx['location_name']}, Weather: {ctx['weather_desc']}")
+
+
+class FormPrompt(Stage):
+    name = "prompt"
+
+    def run(self, ctx):
+        form = ctx["input"]
+        prompt_data = {field: form.get(field, default) for field, default in FORM_DEFAULTS.items()}
+        logger.debug(f"User inputs: {prompt_data}, lat {ctx['latitude']}, lon {ctx['longitude']}, email {ctx['email_to']}")
+        prompt_data.update(location=ctx["location_name"], weather=ctx["weather_desc"],
+                           current_day=ctx["current_day"])
+        # Targets come from the bucketed age, height and weight of the cache key, so a cached plan
+        # always carries the targets of every profile it is served to
+        profile = plan_cache.bucketed_profile(prompt_data)
+        prompt_data["nutrition"] = nutrition.prompt_section(
+            profile["age"], prompt_data["gender"], profile["height"], profile["weight"],
+            prompt_data["dosha"], (prompt_data["disease"], prompt_data["secondary_condition"]))
+        ctx["user_prompt"] = PROMPT_TEMPLATE.format(**prompt_data)
+        # A change to foods.csv changes the candidate foods, so it needs a new namespace
+        namespace = f"{PLAN_CACHE_NAMESPACE}:{nutrition.version()}"
+        namespace = namespace if ctx["output_format"] != "json" else f"{namespace}:json"
+        ctx["cache_key"] = plan_cache.make_key(prompt_data, namespace=namespace)
+        logger.debug(f"Prompt sent to OpenAI (first 200 chars): {ctx['user_prompt'][:200]}...")
+
+
+class NodePrompt(Stage):
+    """The Node metadata, compacted (tracking histories summarized), in NODE_PROMPT_TEMPLATE."""
+
+    name = "prompt"
+
+    def run(self, ctx):
+        metadata = ctx["input"].get("metadata") or {}
+        logger.debug(f"Metadata received: {metadata}")
+        enhanced_metadata = dict(metadata, current_day=ctx["current_day"], location_info={
+            "location_name": ctx["location_name"],
+            "weather": ctx["weather_desc"],
+        })
+        user_data, compaction = prompt_compaction.compact(enhanced_metadata)
+        ctx["user_prompt"] = NODE_PROMPT_TEMPLATE.format(
+            user_data=user_data, nutrition=self.nutrition(metadata), current_day=ctx["current_day"],
+            location_name=ctx["location_name"], weather_desc=ctx["weather_desc"])
+        logger.debug(f"Prompt sent to OpenAI (first 200 chars): {ctx['user_prompt'][:200]}...")
+        logger.info(f"Prompt size: {prompt_compaction.count_tokens(ctx['user_prompt'])} tokens "
+                    f"(metadata {compaction['tokens']}/{compaction['budget']}, {compaction['raw_tokens']} before compaction)")
+
+
+    @staticmethod
+    def nutrition(metadata):
+        """nutrition.prompt_section for the profile in basicInfo, else the top level of the metadata."""
+        sources = (metadata.get("basicInfo") or {}, metadata)
+
+        def field(*names):
+            return next((source[name] for source in sources for name in names if source.get(name) is not None), None)
+
+        dosha = field("dosha", "dominantDosha")
+        conditions = field("healthConditions", "healthIssues") or ()
+        if isinstance(conditions, str):
+            conditions = (conditions,)
+        return nutrition.prompt_section(
+            field("age"), field("gender"), field("height"), field("weight"),
+            dosha if isinstance(dosha, str) else "",
+            tuple(condition for condition in conditions if isinstance(condition, str)),
+            field("activityLevel", "activity"))
+
+
+class Generate(Stage):
+    """The plan from one completion, or from per-day calls in parallel mode.
+
+    With cache=True plans are shared through plan_cache, keyed on the
+    normalized prompt inputs. For output_format "json" the model fills
+    plan_model.JSON_SCHEMA and the cache holds the structured plan; its
+    markdown is only built if something asks for plan_text(ctx).
+    """
+
+    name = "generate"
+
+    def __init__(self, system_instruction, max_tokens, cache=True):
+        self.system_instruction = system_instruction
+        self.max_tokens = max_tokens
+        self.cache = cache
+
+    def labels(self, ctx):
+        return {"mode": ctx["generation_mode"]}
+
+    def lookup(self, ctx):
+        plan_text = plan_cache.get(ctx["cache_key"]) if self.cache else None
+        if not plan_text:
+            return False
+        if ctx["output_format"] == "json":
+            try:
+                ctx["plan"] = plan_model.loads(plan_text, ctx["current_day"])
+            except plan_model.InvalidPlan as e:
+                logger.warning(f"Plan cache entry {ctx['cache_key'][:12]} is not a structured plan ({e}); regenerating")
+                return False
+            plan_text = None
+        logger.info(f"Plan cache hit ({ctx['cache_key'][:12]})")
+        ctx["plan_text"] = plan_text
+        return True
+
+    def store(self, ctx):
+        if self.cache:
+            plan_cache.put(ctx["cache_key"], ctx["plan"].dumps() if ctx.get("plan") else ctx["plan_text"])
+
+    def run(self, ctx):
+        with admission.acquire(model_calls(ctx["generation_mode"])):
+            ctx["plan_text"] = self.complete(ctx)
+        ctx["regenerated"] = "all"
+
+    def stream(self, ctx):
+        """Yield the plan text as the model writes it, then set plan_text.
+
+        For /generate-stream: one completion, and the caller holds the
+        admission slot and calls store() afterwards.
+        """
+        logger.info("Calling OpenAI API (streaming)...")
+        chunks = []
+        model = resilience.available_model(settings.OPENAI_MODEL)
+        # Text already sent cannot be hedged or moved to another model; the breaker still sees the outcome
+        with resilience.guarded(f"openai:{model}", settings.OPENAI_READ_TIMEOUT):
+            with metrics.timer(self.name, mode="stream"), metrics.timer("openai"):
+                completion = clients.openai_client().chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": self.system_instruction},
+                        {"role": "user", "content": ctx["user_prompt"]},
+                    ],
+                    max_tokens=self.max_tokens,
+                    temperature=0.3,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                for chunk in completion:
+                    # The last chunk carries usage and no choices
+                    metrics.record_usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        chunks.append(text)
+                        yield text
+        ctx["plan_text"] = "".join(chunks)
+        ctx["regenerated"] = "all"
+
+    def complete(self, ctx):
+        logger.debug("Calling OpenAI API...")
+        client = clients.openai_client()
+        if ctx["output_format"] == "json":
+            return self.complete_structured(client, ctx)
+        if ctx["generation_mode"] == "parallel":
+            return parallel_plan.generate(client, self.system_instruction, ctx["user_prompt"], ctx["current_day"])
+        completion = resilience.chat_completion(
+            client,
+            model=settings.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": self.system_instruction},
+                {"role": "user", "content": ctx["user_prompt"]},
+            ],
+            max_tokens=self.max_tokens,
+            temperature=0.3,
+        )
+        if completion.usage:
+            logger.info(f"OpenAI usage: {completion.usage.prompt_tokens} prompt tokens, "
+                        f"{completion.usage.completion_tokens} completion tokens")
+        return completion.choices[0].message.content
+
+    def complete_structured(self, client, ctx):
+        """A plan_model.Plan as ctx["plan"] from a JSON-schema answer; plan_text stays None."""
+        completion = resilience.chat_completion(
+            client,
+            model=settings.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": self.system_instruction},
+                {"role": "user", "content": ctx["user_prompt"] + plan_model.JSON_INSTRUCTION},
+            ],
+            max_tokens=settings.STRUCTURED_MAX_TOKENS,
+            temperature=0.3,
+            response_format=plan_model.RESPONSE_FORMAT,
+        )
+        message = completion.choices[0].message
+        if getattr(message, "refusal", None):
+            raise plan_model.InvalidPlan(f"model refused: {message.refusal}")
+        ctx["plan"] = plan_model.loads(message.content, ctx["current_day"])
+        return None
+
+
+class NodeGenerate(Generate):
+    """Generate, refreshing the user's stored plan (plan_store.py) section by section.
+
+    lookup() answers from the stored plan when nothing material changed;
+    run() regenerates only the changed sections, or the whole plan when
+    there is no usable stored plan; store() saves the result.
+    """
+
+    def __init__(self, system_instruction, max_tokens):
+        super().__init__(system_instruction, max_tokens, cache=False)
+
+    def labels(self, ctx):
+        return {"mode": "incremental" if ctx.get("update") else ctx["generation_mode"]}
+
+    def lookup(self, ctx):
+        data = ctx["input"]
+        # Sections regenerated on their own come back as markdown, so structured plans are always whole
+        use_store = settings.PLAN_STORE_ENABLED and ctx["output_format"] != "json"
+        ctx["store_key"] = plan_store.user_key(data, f"{NODE_PLAN_NAMESPACE}:{nutrition.version()}") if use_store else None
+        ctx["profile"] = plan_store.profile(data.get("metadata") or {})
+        stored = plan_store.load(ctx["store_key"]) if ctx["store_key"] and data.get("regenerate") != "full" else None
+        update = plan_store.plan_update(stored, ctx["profile"], ctx["location_name"], ctx["weather_desc"], ctx["today"])
+        ctx["stored"], ctx["update"] = stored, update
+        if update is None:
+            return False
+        calls = plan_store.model_calls(update)
+        ctx["regenerated"] = {"general": update.general, "days": [number for number, _ in update.days]}
+        logger.info(f"Incremental refresh ({', '.join(update.reasons) or 'no changes'}): {calls} model calls")
+        if calls:
+            return False
+        self._finish(ctx, plan_store.apply(update, stored, None, []))
+        self.store(ctx)
+        return True
+
+    def run(self, ctx):
+        update = ctx["update"]
+        if update is None:
+            super().run(ctx)
+            sections = plan_store.split(ctx["plan_text"]) if ctx["store_key"] else None
+            if ctx["store_key"] and sections is None:
+                logger.warning("Plan does not have seven '### Day N' sections; the next refresh regenerates it in full")
+            ctx["sections"] = sections
+            return
+        calls = plan_store.model_calls(update)
+        with admission.acquire(min(calls, settings.PARALLEL_MAX_CONCURRENCY)):
+            general_text, day_texts = parallel_plan.generate_sections(
+                clients.openai_client(), self.system_instruction, ctx["user_prompt"], update.days,
+                general=update.general)
+        self._finish(ctx, plan_store.apply(update, ctx["stored"], general_text, day_texts))
+
+    def _finish(self, ctx, sections):
+        ctx["sections"] = sections
+        ctx["plan_text"] = plan_store.assemble(*sections, ctx["today"])
+
+    def store(self, ctx):
+        if ctx["store_key"] and ctx["sections"] is not None:
+            # An incremental refresh keeps the profile the plan was generated from, so small changes
+            # add up until they regenerate it; only a full regeneration moves the baseline
+            baseline = ctx["stored"]["profile"] if ctx.get("update") is not None else ctx["profile"]
+            plan_store.save(ctx["store_key"], baseline, ctx["location_name"], ctx["weather_desc"],
+                            ctx["today"], *ctx["sections"])
+
+
+class Render(Stage):
+    """Register the plan's PDF in the artifact store (artifacts.py).
+
+    The PDF is rendered on its first download or email; eager=True renders
+    it here instead, for callers that want the file straight away.
+    """
+
+    name = "render"
+
+    def __init__(self, eager=False):
+        self.eager = eager
+
+    def run(self, ctx):
+        # A structured plan is registered as itself, so its PDF is laid out from Plan.blocks()
+        plan = ctx.get("plan") or ctx.get("plan_text")
+        ctx["artifact_id"] = artifacts.register(plan) if plan else None
+        ctx["plan_pdf_url"] = f"/plans/{ctx['artifact_id']}.pdf" if plan else None
+        if self.eager and plan:
+            artifacts.path(ctx["artifact_id"])
+
+
+class Deliver(Stage):
+    """Queue the PDF for email when the context asks for delivery."""
+
+    name = "deliver"
+
+    def run(self, ctx):
+        ctx["email_queued"] = bool(ctx["deliver"]) and deliver_plan(ctx["email_to"], ctx.get("plan") or ctx.get("plan_text"))
+
+
+class Pipeline:
+    """Stages run in order over one context."""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def stage(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def replace(self, name, stage):
+        """A copy of this pipeline with the stage called name swapped for stage."""
+        return Pipeline([stage if existing.name == name else existing for existing in self.stages])
+
+    def _slice(self, start=None, stop=None):
+        """Stages from start up to, not including, stop (both stage names)."""
+        names = [stage.name for stage in self.stages]
+        first = names.index(start) if start else 0
+        last = names.index(stop) if stop else len(names)
+        return self.stages[first:last]
+
+    def run_stage(self, stage, ctx):
+        started = time.perf_counter()
+        if stage.lookup(ctx):
+            metrics.inc("stage_cached_total", stage=stage.name)
+        else:
+            with metrics.timer(stage.name, **stage.labels(ctx)):
+                stage.run(ctx)
+            stage.store(ctx)
+        ctx["timings"][stage.name] = round(time.perf_counter() - started, 4)
+
+    def run(self, ctx, start=None, stop=None):
+        """Run the stages inline in this thread. Returns ctx."""
+        for stage in self._slice(start, stop):
+            self.run_stage(stage, ctx)
+        return ctx
+
+    def submit(self, executor, ctx, start=None, stop=None):
+        """Run on a concurrent.futures executor; returns a Future for ctx."""
+        # Copy the context variables (request id, admission mode) into the pool thread
+        return executor.submit(contextvars.copy_context().run, self.run, ctx, start, stop)
+
+    def map(self, executor, contexts):
+        """Run many contexts on executor; yields (ctx, error or None) as they finish."""
+        futures = {self.submit(executor, ctx): ctx for ctx in contexts}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+    async def run_async(self, ctx, executor=None, start=None, stop=None):
+        """Run from asyncio: each stage in executor (the loop's default one if None)."""
+        loop = asyncio.get_running_loop()
+        for stage in self._slice(start, stop):
+            await loop.run_in_executor(executor, contextvars.copy_context().run, self.run_stage, stage, ctx)
+        return ctx
+
+
+FORM_PIPELINE = Pipeline([
+    FormLocation(), Weather(), FormPrompt(),
+    Generate(SYSTEM_INSTRUCTION, max_tokens=3500), Render(), Deliver(),
+])
+
+NODE_PIPELINE = Pipeline([
+    NodeLocation(), Weather(), NodePrompt(),
+    NodeGenerate(NODE_SYSTEM_INSTRUCTION, max_tokens=4000), Render(), Deliver(),
+])
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import re
+import time
+
+import metrics
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    key TEXT PRIMARY KEY,
+    plan TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_accessed ON plans (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Bucket widths: profiles that land in the same bucket share a cached plan
+AGE_BUCKET = 5
+WEIGHT_BUCKET = 2.0
+HEIGHT_BUCKET = 2.0
+BMI_BUCKET = 0.5
+WATER_BUCKET = 0.5
+TEMP_BUCKET = 3.0
+
+_TEMP_RE = re.compile(r"Temp:\s*(-?\d+(?:\.\d+)?)")
+
+
+def _db():
+    return storage.connect(settings.PLAN_CACHE_PATH, _SCHEMA)
+
+
+def _text(value):
+    return " ".join(str(value or "").split()).casefold()
+
+
+def _bucket(value, width):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return _text(value)
+    bucket = round(number / width) * width
+    return int(bucket) if float(bucket).is_integer() else round(bucket, 2)
+
+
+def weather_bucket(weather_desc):
+    """Split 'Light Rain, Temp: 27.4°C' into a condition and a temperature bucket."""
+    condition = _text(weather_desc.split(",")[0]) if weather_desc else ""
+    match = _TEMP_RE.search(weather_desc or "")
+    temp = _bucket(match.group(1), TEMP_BUCKET) if match else None
+    return condition, temp
+
+
+def bucketed_profile(prompt_data):
+    """Age, height and weight as the middle of their key buckets.
+
+    Anything computed from these (the nutrition targets in the prompt) is
+    then the same for every submission that shares a key. Values that are
+    not numbers are passed through.
+    """
+    try:
+        age = int(float(prompt_data.get("age"))) // AGE_BUCKET * AGE_BUCKET + AGE_BUCKET / 2
+    except (TypeError, ValueError):
+        age = prompt_data.get("age")
+    return {"age": age, "height": _bucket(prompt_data.get("height"), HEIGHT_BUCKET),
+            "weight": _bucket(prompt_data.get("weight"), WEIGHT_BUCKET)}
+
+
+def make_key(prompt_data, namespace=""):
+    """Canonical hash of the prompt inputs.
+
+    Free text is case- and whitespace-folded and numbers are bucketed, so
+    near-identical submissions map to the same key. ``namespace`` should
+    change whenever the prompt or model does, to invalidate old entries.
+    """
+    try:
+        age = int(float(prompt_data.get("age"))) // AGE_BUCKET * AGE_BUCKET
+    except (TypeError, ValueError):
+        age = _text(prompt_data.get("age"))
+    condition, temp = weather_bucket(prompt_data.get("weather"))
+
+    canonical = {
+        "age": age,
+        "gender": _text(prompt_data.get("gender")),
+        "height": _bucket(prompt_data.get("height"), HEIGHT_BUCKET),
+        "weight": _bucket(prompt_data.get("weight"), WEIGHT_BUCKET),
+        "bmi": _bucket(prompt_data.get("bmi"), BMI_BUCKET),
+        "water": _bucket(prompt_data.get("water"), WATER_BUCKET),
+        "dosha": _text(prompt_data.get("dosha")),
+        "location": _text(prompt_data.get("location")),
+        "weather": condition,
+        "temp": temp,
+        "disease": _text(prompt_data.get("disease")),
+        "secondary_condition": _text(prompt_data.get("secondary_condition")),
+        "sleep": _text(prompt_data.get("sleep")),
+        "appetite": _text(prompt_data.get("appetite")),
+        "current_day": _text(prompt_data.get("current_day")),
+    }
+    blob = json.dumps([namespace, canonical], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _count(conn, name):
+    conn.execute(
+        "INSERT INTO counters (name, value) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,),
+    )
+
+
+def get(key):
+    """Return the cached plan text for key, or None on a miss or expired entry."""
+    if not settings.PLAN_CACHE_ENABLED:
+        return None
+
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        row = conn.execute("SELECT plan, created_at FROM plans WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row["created_at"] > settings.PLAN_CACHE_TTL:
+            conn.execute("DELETE FROM plans WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            _count(conn, "misses")
+            metrics.inc("cache_requests_total", cache="plan", result="miss")
+            return None
+        conn.execute("UPDATE plans SET accessed_at = ? WHERE key = ?", (now, key))
+        _count(conn, "hits")
+    metrics.inc("cache_requests_total", cache="plan", result="hit")
+    return row["plan"]
+
+
+def put(key, plan_text):
+    """Store a plan and evict the least recently used entries over the size limit."""
+    if not settings.PLAN_CACHE_ENABLED or not plan_text:
+        return
+
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO plans (key, plan, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, plan_text, now, now),
+        )
+        conn.execute("DELETE FROM plans WHERE created_at < ?", (now - settings.PLAN_CACHE_TTL,))
+        excess = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0] - settings.PLAN_CACHE_MAX_ENTRIES
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM plans WHERE key IN (SELECT key FROM plans ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+            _count(conn, "evictions")
+
+
+def stats():
+    """Hit/miss counters shared by every worker process."""
+    if not settings.PLAN_CACHE_ENABLED:
+        return {"enabled": False}
+
+    conn = _db()
+    counters = {row["name"]: row["value"] for row in conn.execute("SELECT name, value FROM counters")}
+    hits = counters.get("hits", 0)
+    misses = counters.get("misses", 0)
+    return {
+        "enabled": True,
+        "entries": conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0],
+        "hits": hits,
+        "misses": misses,
+        "evictions": counters.get("evictions", 0),
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+    }
@@ -0,0 +1,234 @@
+"""Structured plans: days -> meals -> items with grams or millilitres.
+
+With output_format "json" the model answers against JSON_SCHEMA
+(OpenAI structured outputs) instead of writing markdown. loads() checks the
+answer and builds a Plan out of small slotted dataclasses. The views are
+built from it only when asked for and then kept: markdown() for the
+response's "plan" text; to_dict() for API consumers and dumps(), which the
+plan cache and the artifact store keep; and blocks(), the PDF layout
+blocks, made without parsing any markdown, so a food name with a stray "*"
+or "|" still renders as written.
+"""
+import json
+from dataclasses import dataclass, field
+
+import markdown_blocks
+import parallel_plan
+
+UNITS = ("g", "ml")
+
+# Sanity bound on one portion; larger numbers are a unit mix-up or a typo
+MAX_QUANTITY = 5000
+
+JSON_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["general_recommendations", "days"],
+    "properties": {
+        "general_recommendations": {"type": "array", "items": {"type": "string"}},
+        "days": {
+            "type": "array",
+            "description": "Exactly 7 days, starting from the current day",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["meals"],
+                "properties": {
+                    "meals": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": ["name", "items", "why"],
+                            "properties": {
+                                "name": {"type": "string", "enum": parallel_plan.MEAL_SECTIONS},
+                                "items": {
+                                    "type": "array",
+                                    "items": {
+                                        "type": "object",
+                                        "additionalProperties": False,
+                                        "required": ["food", "quantity", "unit"],
+                                        "properties": {
+                                            "food": {"type": "string"},
+                                            "quantity": {"type": "number"},
+                                            "unit": {"type": "string", "enum": list(UNITS)},
+                                        },
+                                    },
+                                },
+                                "why": {"type": "string"},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
+
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {"name": "diet_plan", "strict": True, "schema": JSON_SCHEMA}}
+
+# Appended to the user prompt: the schema fixes the shape, this the content rules
+JSON_INSTRUCTION = """
+Return the plan as JSON matching the given schema: general recommendations as short sentences, then exactly
+7 days starting from the current day, each with the meals {sections} in that order. Every item is one food
+with its portion as a number and a unit, "g" or "ml". Put the reasoning for a meal in "why", not in the items.
+""".format(sections=", ".join(parallel_plan.MEAL_SECTIONS))
+
+
+class InvalidPlan(ValueError):
+    """The model's JSON does not describe a usable 7-day plan."""
+
+
+@dataclass(slots=True)
+class Item:
+    food: str
+    quantity: float
+    unit: str
+
+    def portion(self):
+        quantity = int(self.quantity) if float(self.quantity).is_integer() else self.quantity
+        return f"{quantity} {self.unit}"
+
+
+@dataclass(slots=True)
+class Meal:
+    name: str
+    items: list
+    why: str
+
+
+@dataclass(slots=True)
+class Day:
+    number: int
+    day_name: str
+    meals: list
+
+
+@dataclass(slots=True)
+class Plan:
+    general: list
+    days: list
+    _markdown: str = field(default=None, repr=False, compare=False)
+    _blocks: list = field(default=None, repr=False, compare=False)
+    _dict: dict = field(default=None, repr=False, compare=False)
+
+    def markdown(self):
+        """The plan as the markdown the free-form prompt asks for, so existing consumers keep working."""
+        if self._markdown is None:
+            lines = ["### General Recommendations"]
+            lines.extend(f"- {text}" for text in self.general)
+            for day in self.days:
+                lines += ["", f"### Day {day.number} ({day.day_name})"]
+                for meal in day.meals:
+                    lines.append(f"#### {meal.name}")
+                    lines.extend(f"- **{item.food}:** {item.portion()}" for item in meal.items)
+                    if meal.why:
+                        lines.append(f"- *Why:* {meal.why}")
+            self._markdown = "\n".join(lines)
+        return self._markdown
+
+    def blocks(self):
+        """PDF layout blocks (markdown_blocks.Block), built directly from the structure."""
+        if self._blocks is None:
+            Block = markdown_blocks.Block
+            blocks = [Block("heading", 3, None, [("", "General Recommendations")])]
+            blocks.extend(Block("bullet", 0, None, [("", text)]) for text in self.general)
+            for day in self.days:
+                blocks += [markdown_blocks.BLANK, Block("heading", 3, None, [("", f"Day {day.number} ({day.day_name})")])]
+                for meal in day.meals:
+                    blocks.append(Block("heading", 4, None, [("", meal.name)]))
+                    blocks.extend(Block("bullet", 0, None, [("B", f"{item.food}:"), ("", f" {item.portion()}")])
+                                  for item in meal.items)
+                    if meal.why:
+                        blocks.append(Block("bullet", 0, None, [("I", "Why:"), ("", f" {meal.why}")]))
+            self._blocks = blocks
+        return self._blocks
+
+    def to_dict(self):
+        """The plan for API consumers and dumps(); treat it as read-only, it is shared."""
+        if self._dict is None:
+            self._dict = {
+                "general_recommendations": list(self.general),
+                "days": [
+                    {"day": day.number, "day_name": day.day_name, "meals": [
+                        {"name": meal.name, "why": meal.why,
+                         "items": [{"food": item.food, "quantity": item.quantity, "unit": item.unit}
+                                   for item in meal.items]}
+                        for meal in day.meals
+                    ]}
+                    for day in self.days
+                ],
+            }
+        return self._dict
+
+    def dumps(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"), ensure_ascii=False)
+
+
+def _text(value, what):
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidPlan(f"{what} must be a non-empty string")
+    return value.strip()
+
+
+def _item(data, where):
+    if not isinstance(data, dict):
+        raise InvalidPlan(f"{where} must be an object")
+    food = _text(data.get("food"), f"{where} food")
+    quantity = data.get("quantity")
+    if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) or not 0 < quantity <= MAX_QUANTITY:
+        raise InvalidPlan(f"{where} ({food}) has quantity {quantity!r}")
+    unit = data.get("unit")
+    if unit not in UNITS:
+        raise InvalidPlan(f"{where} ({food}) has unit {unit!r}; expected g or ml")
+    return Item(food, quantity, unit)
+
+
+def _meal(data, where):
+    if not isinstance(data, dict):
+        raise InvalidPlan(f"{where} must be an object")
+    name = data.get("name")
+    if name not in parallel_plan.MEAL_SECTIONS:
+        raise InvalidPlan(f"{where} has unknown meal {name!r}")
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        raise InvalidPlan(f"{where} ({name}) has no items")
+    why = data.get("why")
+    return Meal(name, [_item(item, f"{where} ({name}) item {i + 1}") for i, item in enumerate(items)],
+                why.strip() if isinstance(why, str) else "")
+
+
+def from_json(data, current_day=None):
+    """Validate the model's decoded JSON and build a Plan. Raises InvalidPlan.
+
+    Days are numbered 1-7 and named from current_day, whatever the model called them.
+    """
+    if not isinstance(data, dict):
+        raise InvalidPlan("plan must be a JSON object")
+    general = data.get("general_recommendations") or []
+    if not isinstance(general, list):
+        raise InvalidPlan("general_recommendations must be a list")
+    days = data.get("days")
+    if not isinstance(days, list) or len(days) != 7:
+        raise InvalidPlan(f"expected 7 days, got {len(days) if isinstance(days, list) else days!r}")
+
+    parsed = []
+    for number, (day, day_name) in enumerate(zip(days, parallel_plan.day_names(current_day)), start=1):
+        meals = day.get("meals") if isinstance(day, dict) else None
+        if not isinstance(meals, list) or not meals:
+            raise InvalidPlan(f"day {number} has no meals")
+        meals = [_meal(meal, f"day {number} meal {i + 1}") for i, meal in enumerate(meals)]
+        names = [meal.name for meal in meals]
+        if len(set(names)) != len(names):
+            raise InvalidPlan(f"day {number} repeats a meal")
+        parsed.append(Day(number, day_name, meals))
+    return Plan([_text(text, "general recommendation") for text in general], parsed)
+
+
+def loads(text, current_day=None):
+    """Plan from JSON text (a model answer or Plan.dumps()). Raises InvalidPlan."""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise InvalidPlan(f"not JSON: {e}") from None
+    return from_json(data, current_day)
@@ -0,0 +1,296 @@
+"""Stored Node plans split into sections, for incremental regeneration.
+
+The last plan of each user is kept as its "General Recommendations" section
+and seven days, each stored as its "#### " meal sections, with the
+compacted profile, location and weather it was generated from and the
+date of Day 1. When the same user asks again, plan_update() compares the
+new inputs with the stored ones and decides what must be generated again:
+
+- a changed non-numeric field (health issue, dosha, preference, ...), a
+  numeric field that moved by more than PLAN_DIFF_TOLERANCE, a tracking
+  series whose recent mean moved by more than PLAN_SERIES_TOLERANCE, or a
+  new location: everything;
+- a different weather condition or temperature bucket: the general section;
+- a later start date: only the new days at the end, while the days that
+  still fall inside the week are kept and renumbered.
+
+An incremental refresh saves the refreshed sections with the profile of the
+last full regeneration, not the new one, so many small changes are still
+measured against the inputs the plan was written for.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+import plan_cache
+import prompt_compaction
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    user_key TEXT PRIMARY KEY,
+    profile TEXT NOT NULL,
+    location TEXT,
+    weather TEXT,
+    start_date TEXT NOT NULL,
+    general TEXT NOT NULL,
+    days TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Identity fields, in order of preference; the email is the last resort
+USER_ID_KEYS = ("user_id", "userId", "_id")
+
+# Series bookkeeping (see prompt_compaction.summarize_series) that changes with
+# every new log entry without saying anything new about the user
+IGNORED_FIELDS = {"n", "from", "to", "current_day", "location_info"}
+
+# Keys of a series summary; only its recent_mean is compared
+SERIES_SUMMARY_KEYS = {"latest", "recent_mean", "trend", "n", "min", "max"}
+
+_SECTION_RE = re.compile(r"^###(?!#)\s*(.*?)\s*$")
+_MEAL_RE = re.compile(r"^####(?!#)\s*(.*?)\s*$")
+_DAY_RE = re.compile(r"^Day\s+(\d+)\b")
+
+# What plan_update() decided: general is True when the general section is
+# regenerated; days lists (number, day_name) to generate; reused maps a new
+# day number to the stored day body that is kept
+Update = namedtuple("Update", "general days reused reasons")
+
+Section = namedtuple("Section", "title body")
+
+
+def _db():
+    return storage.connect(settings.PLAN_STORE_PATH, _SCHEMA)
+
+
+def _identity(data):
+    metadata = data.get("metadata") or {}
+    for source in (data, metadata, metadata.get("basicInfo") or {}):
+        for key in USER_ID_KEYS:
+            if source.get(key):
+                return f"id:{source[key]}"
+    if data.get("email"):
+        return f"email:{data['email'].strip().lower()}"
+    return None
+
+
+def user_key(data, namespace=""):
+    """Stable key for the user a Node request is for, or None if it cannot be identified."""
+    identity = _identity(data)
+    if identity is None:
+        return None
+    return hashlib.sha256(f"{namespace}|{identity}".encode("utf-8")).hexdigest()
+
+
+def profile(metadata):
+    """The metadata as the prompt sees it (tracking series summarized), for diffing."""
+    return prompt_compaction.prune(metadata)
+
+
+def split(plan_text):
+    """Split plan markdown into (general, [day_body, ...]).
+
+    general is everything before the first "### Day" heading (intro and
+    General Recommendations). Day bodies exclude their heading line, so a
+    day can be renumbered. Returns None unless there are exactly seven days.
+    """
+    general, days, current = [], [], None
+    for line in plan_text.splitlines():
+        match = _SECTION_RE.match(line)
+        if match and _DAY_RE.match(match.group(1)):
+            current = []
+            days.append(current)
+            continue
+        (current if current is not None else general).append(line)
+    if len(days) != 7:
+        return None
+    return "\n".join(general).strip(), ["\n".join(body).strip() for body in days]
+
+
+def meals(day_body):
+    """A day body's "#### " sections as [Section(title, body), ...]; text before the first has title None."""
+    sections, title, lines = [], None, []
+    for line in day_body.splitlines():
+        match = _MEAL_RE.match(line)
+        if match:
+            if title is not None or any(l.strip() for l in lines):
+                sections.append(Section(title, "\n".join(lines).strip()))
+            title, lines = match.group(1), []
+        else:
+            lines.append(line)
+    if title is not None or any(l.strip() for l in lines):
+        sections.append(Section(title, "\n".join(lines).strip()))
+    return sections
+
+
+def _join_meals(sections):
+    return "\n\n".join(body if title is None else f"#### {title}\n{body}".rstrip() for title, body in sections)
+
+
+def _day_body(text):
+    """A generated day without its "### Day N" heading."""
+    lines = text.strip().splitlines()
+    if lines and _SECTION_RE.match(lines[0]):
+        lines = lines[1:]
+    return "\n".join(lines).strip()
+
+
+def assemble(general, days, start_date):
+    """Plan markdown from the general section and day bodies, numbered from start_date."""
+    sections = [general] if general else []
+    for number, body in enumerate(days, start=1):
+        day_name = (start_date + timedelta(days=number - 1)).strftime("%A")
+        sections.append(f"### Day {number} ({day_name})\n{body}")
+    return "\n\n".join(sections)
+
+
+def load(key):
+    row = _db().execute("SELECT * FROM plans WHERE user_key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    stored = dict(row)
+    stored["profile"] = json.loads(stored["profile"])
+    stored["days"] = [_join_meals(day) for day in json.loads(stored["days"])]
+    stored["start_date"] = date.fromisoformat(stored["start_date"])
+    return stored
+
+
+def save(key, user_profile, location, weather_desc, start_date, general, days):
+    now = time.time()
+    conn = _db()
+    conn.execute(
+        "INSERT OR REPLACE INTO plans (user_key, profile, location, weather, start_date, general, days, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (key, prompt_compaction.dumps(user_profile), location, weather_desc, start_date.isoformat(),
+         general, json.dumps([meals(body) for body in days]), now),
+    )
+    # A plan whose week is over has nothing left to reuse
+    conn.execute("DELETE FROM plans WHERE updated_at < ?", (now - 7 * 86400,))
+
+
+class _SeriesMean(float):
+    """Recent mean of a tracking series, compared with PLAN_SERIES_TOLERANCE."""
+
+
+def _is_log_entry(item):
+    """A number, or a dict of numbers and dates (one entry of a tracking list)."""
+    if isinstance(item, dict):
+        return all(_is_number(value) or key in prompt_compaction.DATE_KEYS or key in prompt_compaction.DROP_KEYS
+                   for key, value in item.items())
+    return _is_number(item)
+
+
+def _stable(value):
+    """The profile with every tracking series reduced to its recent mean, for diffing.
+
+    A summary's latest, min, max, n and trend move with every new entry, a
+    constant series is summarized as a plain number until one value
+    differs, so both are compared as recent means. Series shorter than
+    prompt_compaction.SERIES_MIN_LENGTH are left out: one more entry moves
+    the mean of two or three by too much to mean anything.
+    """
+    if isinstance(value, dict):
+        if "recent_mean" in value and set(value) <= SERIES_SUMMARY_KEYS:
+            return _SeriesMean(value["recent_mean"])
+        stable = {key: _stable(item) for key, item in value.items()}
+        return {key: item for key, item in stable.items() if item is not None}
+    if isinstance(value, list) and value and all(map(_is_log_entry, value)):
+        if len(value) < prompt_compaction.SERIES_MIN_LENGTH:
+            return None  # a few entries are too noisy to compare
+        summary = prompt_compaction.summarize_series(value, brief=True)
+        if summary is not None:
+            return _SeriesMean(summary) if _is_number(summary) else _stable(summary)
+        return [_stable(item) for item in value]
+    return value
+
+
+def _flatten(value, path=()):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, path + (key,))
+    elif isinstance(value, list) and all(not isinstance(item, (dict, list)) for item in value):
+        yield path, tuple(sorted(str(item) for item in value))  # e.g. a set of health issues
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _flatten(item, path + (str(index),))
+    else:
+        yield path, value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def profile_changes(old, new, tolerance=None):
+    """Dotted paths of fields that changed materially between two profiles."""
+    tolerance = settings.PLAN_DIFF_TOLERANCE if tolerance is None else tolerance
+    old_fields, new_fields = dict(_flatten(_stable(old))), dict(_flatten(_stable(new)))
+    changed = []
+    for path in sorted(set(old_fields) | set(new_fields), key=lambda p: ".".join(p)):
+        if any(part in IGNORED_FIELDS for part in path):
+            continue
+        a, b = old_fields.get(path), new_fields.get(path)
+        if isinstance(a, _SeriesMean) and b is None or a is None and isinstance(b, _SeriesMean):
+            continue  # a series that just became long enough to compare
+        if _is_number(a) and _is_number(b):
+            # A constant series is a plain number on one side and a mean on the other
+            series = isinstance(a, _SeriesMean) or isinstance(b, _SeriesMean)
+            limit = max(tolerance, settings.PLAN_SERIES_TOLERANCE) if series else tolerance
+            if abs(a - b) <= limit * max(abs(a), abs(b), 1):
+                continue
+        elif a == b:
+            continue
+        changed.append(".".join(path))
+    return changed
+
+
+def plan_update(stored, user_profile, location, weather_desc, start_date):
+    """What to regenerate against the stored plan: an Update, or None to regenerate everything."""
+    if stored is None:
+        return None
+    changed = profile_changes(stored["profile"], user_profile)
+    if changed:
+        logger.info(f"Profile changed ({', '.join(changed[:5])}); regenerating the whole plan")
+        return None
+    if (location or "") != (stored["location"] or ""):
+        logger.info("Location changed; regenerating the whole plan")
+        return None
+    shift = (start_date - stored["start_date"]).days
+    if not 0 <= shift < 7:
+        logger.info(f"Stored plan starts {stored['start_date']}, {shift} days off; regenerating the whole plan")
+        return None
+
+    reasons = []
+    general = plan_cache.weather_bucket(weather_desc) != plan_cache.weather_bucket(stored["weather"])
+    if general:
+        reasons.append("weather")
+    # Stored days from `shift` onwards cover the first days of the new week
+    reused = {number: body for number, body in enumerate(stored["days"][shift:], start=1)}
+    days = [
+        (number, (start_date + timedelta(days=number - 1)).strftime("%A"))
+        for number in range(len(reused) + 1, 8)
+    ]
+    if shift:
+        reasons.append(f"{shift} day shift")
+    return Update(general, days, reused, reasons)
+
+
+def apply(update, stored, general_text, day_texts):
+    """Merge regenerated sections into the stored plan: (general, [day_body x 7])."""
+    general = general_text.strip() if update.general else stored["general"]
+    generated = {number: _day_body(text) for (number, _), text in zip(update.days, day_texts)}
+    return general, [update.reused[number] if number in update.reused else generated[number]
+                     for number in range(1, 8)]
+
+
+def model_calls(update):
+    return int(update.general) + len(update.days)
@@ -0,0 +1,184 @@
+"""Compact serialization of Node user metadata for the model prompt.
+
+Tracking histories (water, sleep, weight, ...) grow with every day a user
+logs, so they are summarized into a few statistics instead of being sent
+verbatim. Empty values and bookkeeping fields are dropped and the rest is
+written as key-sorted compact JSON, so identical profiles always produce
+identical prompts.
+"""
+import json
+import logging
+import statistics
+import threading
+
+import settings
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a characters-per-token estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Database and account fields that say nothing about diet
+DROP_KEYS = {
+    "_id", "__v", "id", "userId", "user_id", "email", "password", "token", "fcmToken",
+    "createdAt", "updatedAt", "created_at", "updated_at", "avatar", "profileImage", "image",
+}
+
+DATE_KEYS = ("date", "day", "timestamp", "loggedAt", "logged_at", "recordedAt", "createdAt", "created_at")
+
+# Numeric lists at least this long are summarized rather than listed
+SERIES_MIN_LENGTH = 4
+MAX_STRING_LENGTH = 300
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Token count with tiktoken when installed, otherwise ~4 characters per token."""
+    global _encoding
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _round(value):
+    return round(value, 2) + 0.0 if isinstance(value, float) else value  # + 0.0 turns -0.0 into 0.0
+
+
+def _date_of(item):
+    for key in DATE_KEYS:
+        if key in item and item[key] is not None:
+            return str(item[key])
+    return None
+
+
+def _summarize_values(values, window, brief=False):
+    if min(values) == max(values):
+        return _round(values[-1])  # a constant such as a daily target
+    recent = values[-window:]
+    earlier = values[-2 * window:-window]
+    summary = {"latest": _round(values[-1]), "recent_mean": _round(statistics.fmean(recent))}
+    if earlier:
+        # Change of the recent window's mean against the window before it
+        summary["trend"] = _round(statistics.fmean(recent) - statistics.fmean(earlier))
+    if not brief:
+        summary.update(n=len(values), min=_round(min(values)), max=_round(max(values)))
+    return summary
+
+
+def summarize_series(items, window=None, brief=False):
+    """Summarize a tracking list (numbers, or dicts with numeric fields) into statistics.
+
+    brief keeps only latest, recent_mean and trend. Returns None when the
+    list does not look like a numeric series.
+    """
+    window = window or settings.PROMPT_SERIES_WINDOW
+    if all(_is_number(item) for item in items):
+        return _summarize_values([float(item) for item in items], window, brief)
+    if not all(isinstance(item, dict) for item in items):
+        return None
+
+    dated = [item for item in items if _date_of(item) is not None]
+    if len(dated) == len(items):
+        items = sorted(items, key=_date_of)
+
+    fields = {}
+    for item in items:
+        for key, value in item.items():
+            if _is_number(value) and key not in DROP_KEYS:
+                fields.setdefault(key, []).append(float(value))
+    if not fields:
+        return None
+
+    summary = {key: _summarize_values(values, window, brief) for key, values in sorted(fields.items())}
+    if dated and not brief:
+        summary["from"] = _date_of(items[0])
+        summary["to"] = _date_of(items[-1])
+    return summary
+
+
+def prune(value, brief=False):
+    """Drop empty values and bookkeeping keys; summarize long series; shorten long text."""
+    if isinstance(value, dict):
+        pruned = {}
+        for key, item in value.items():
+            if key in DROP_KEYS:
+                continue
+            item = prune(item, brief)
+            if item not in (None, "", [], {}):
+                pruned[key] = item
+        return pruned
+    if isinstance(value, list):
+        if len(value) >= SERIES_MIN_LENGTH:
+            summary = summarize_series(value, brief=brief)
+            if summary is not None:
+                return summary
+        return [item for item in (prune(item, brief) for item in value) if item not in (None, "", [], {})]
+    if isinstance(value, str):
+        value = value.strip()
+        return value[:MAX_STRING_LENGTH] + "…" if len(value) > MAX_STRING_LENGTH else value
+    return _round(value)
+
+
+def dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _largest_path(value, path=()):
+    """Path and serialized size of the largest non-dict value."""
+    best, best_size = None, -1
+    for key, item in value.items():
+        if isinstance(item, dict) and item:
+            child, size = _largest_path(item, path + (key,))
+        else:
+            child, size = path + (key,), len(dumps(item))
+        if size > best_size:
+            best, best_size = child, size
+    return best, best_size
+
+
+def compact(metadata, budget=None):
+    """Serialize metadata for the prompt within budget tokens.
+
+    Over budget, series summaries are first cut down to latest, recent
+    mean and trend, then the largest remaining fields are dropped. Returns
+    (text, info) where info has the raw and compacted token counts and any
+    dropped fields.
+    """
+    budget = budget or settings.PROMPT_TOKEN_BUDGET
+    data = prune(metadata)
+    text = dumps(data)
+    if count_tokens(text) > budget:
+        data = prune(metadata, brief=True)
+        text = dumps(data)
+    dropped = []
+    while count_tokens(text) > budget and data:
+        path, _ = _largest_path(data)
+        parent = data
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+        dropped.append(".".join(path))
+        data = prune(data)
+        text = dumps(data)
+
+    info = {
+        "raw_tokens": count_tokens(repr(metadata)),
+        "tokens": count_tokens(text),
+        "budget": budget,
+        "dropped": dropped,
+    }
+    if dropped:
+        logger.warning(f"Prompt metadata over budget ({budget} tokens); dropped {', '.join(dropped)}")
+    return text, info
@@ -0,0 +1,119 @@
+"""Prompts for both generation routes, and the cache namespaces derived from them."""
+import hashlib
+import json
+
+import parallel_plan
+import plan_model
+import settings
+
+PROMPT_TEMPLATE = """
+**User Parameters:**
+1.  **Age:** {age}
+2.  **Gender:** {gender}
+3.  **Height:** {height} cm
+4.  **Weight:** {weight} kg
+5.  **Dosha:** {dosha}
+6.  **Location:** {location}
+7.  **Weather:** {weather}
+8.  **Primary Disease/Health Condition:** {disease}
+9.  **Physiological Data:**
+    * Daily Water Intake: {water}L
+    * BMI: {bmi}  
+    * Sleep Quality: {sleep}
+10. **Secondary Condition:** {secondary_condition}
+11. **Appetite:** {appetite}
+12. **Current Day:** {current_day}
+
+{nutrition}
+"""
+
+SYSTEM_INSTRUCTION = """
+You are an expert clinical nutritionist and Ayurvedic specialist. Your task is to generate a highly personalized 7-day Ayurvedic diet plan.
+
+**CRITICAL INSTRUCTIONS:**
+1.  **Use the Computed Daily Targets:** When the prompt gives Computed Daily Targets, they are already calculated from the user's age, gender, height, weight and BMI. Use them as given and do not restate or recalculate them. Only if they are missing, estimate the daily caloric needs from the profile yourself.
+2.  **Size Portions from the Candidate Foods:** Build meals mainly from the Candidate Foods, which suit the user's dosha and conditions; other local foods may be added. Size each portion from the per-100 g values so that each meal roughly meets its meal energy target. Do not show the arithmetic.
+3.  **Personalize for Age and Gender:** Recommendations should be suitable for the user's specific demographic. For example, a plan for a younger person might focus on energy, while a plan for an older person might focus on joint health and digestion.
+4.  **Standard Requirements:**
+    - Generate a 7-day plan starting from the provided Current Day.
+    - Prioritize locally available and seasonal foods for the user's Location and Weather.
+    - For each day, include sections: "General Recommendations", "Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", and "Bedtime".
+    - Provide portion sizes for every food item in grams (g) or milliliters (ml).
+    - Explain in one sentence why each meal is suitable for the user's complete profile (Dosha, Disease, BMI, Age, etc.).
+    - Output using Markdown headings.
+"""
+
+# System instruction for metadata-based generation (/generate-diet-from-node-data)
+NODE_SYSTEM_INSTRUCTION = """
+You are an expert clinical nutritionist and Ayurvedic specialist. Your task is to generate a highly personalized 7-day Ayurvedic diet plan based on complete user data.
+
+**CRITICAL INSTRUCTIONS:**
+1. **Analyze Complete User Data:** Carefully examine all provided user data including:
+   - Basic information (age, gender, height, weight, body shape, goals, focus areas)
+   - Health data (dosha assessments, water tracking, sleep tracking, weight tracking, health issues)
+   - Diet preferences and notes
+   - Location and weather information
+
+2. **Extract Key Information:**
+   - Use the Computed Daily Targets and Candidate Foods when provided, without recalculating them; otherwise calculate BMI from height and weight and estimate caloric needs
+   - Determine dominant dosha from assessments
+   - Consider water intake targets and sleep patterns
+   - Factor in health issues and goals
+   - Use location and weather for seasonal recommendations
+
+3. **Generate Personalized Plan:**
+   - Create a 7-day plan starting from the specified current day
+   - Size portions from the candidate foods' per-100 g values to meet each meal's energy target, without showing the arithmetic
+   - Consider body shape (Ectomorph, Mesomorph, Endomorph) for meal timing and composition
+   - Factor in focus areas and goals (strength, flexibility, weight management, etc.)
+   - Address any health issues mentioned
+
+4. **Format Requirements:**
+   - Use markdown headings for each day
+   - Include all meal sections: General Recommendations, Early Morning, Breakfast, Mid-Morning Snack, Lunch, Evening Snack, Dinner, Bedtime
+   - Provide portion sizes in grams (g) or milliliters (ml)
+   - Explain the reasoning for each recommendation
+   - Prioritize locally available and seasonal foods
+
+5. **Personalization:**
+   - Tailor recommendations to the user's specific demographic and health profile
+   - Consider their tracking data and progress
+   - Address their specific goals and focus areas
+   - Factor in any health conditions or medications
+"""
+
+# User prompt for /generate-diet-from-node-data; user_data is the compacted metadata (prompt_compaction.py)
+NODE_PROMPT_TEMPLATE = """
+**Complete User Data (JSON; tracking series summarized as n, latest, recent_mean, min, max, trend):**
+{user_data}
+
+{nutrition}
+
+**Instructions:**
+Based on the complete user data provided above, generate a personalized 7-day Ayurvedic diet plan starting from {current_day}.
+
+**Requirements:**
+- Analyze all the user data including basic info, health data, diet preferences, and tracking information
+- Consider the user's location ({location_name}) and weather ({weather_desc}) for seasonal recommendations
+- Generate a 7-day plan with sections: "General Recommendations", "Early Morning", "Breakfast", "Mid-Morning Snack", "Lunch", "Evening Snack", "Dinner", and "Bedtime"
+- Provide portion sizes for every food item in grams (g) or milliliters (ml)
+- Explain why each meal is suitable based on the user's complete profile
+- Use markdown formatting with headings like "### Day 1 ({current_day})"
+- Prioritize locally available and seasonal foods for the user's location
+"""
+
+def _namespace(*parts):
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+# Cached plans are only served while the model and everything that shapes its
+# answer are unchanged: system instruction, prompt template, the per-day
+# instructions of parallel mode and the structured output schema
+PLAN_CACHE_NAMESPACE = _namespace(
+    settings.OPENAI_MODEL, SYSTEM_INSTRUCTION, PROMPT_TEMPLATE,
+    parallel_plan.GENERAL_INSTRUCTION, parallel_plan.DAY_INSTRUCTION,
+    plan_model.JSON_INSTRUCTION, json.dumps(plan_model.JSON_SCHEMA, sort_keys=True))
+# Stored Node plans (plan_store.py) are only reused under the same conditions
+NODE_PLAN_NAMESPACE = _namespace(
+    settings.OPENAI_MODEL, NODE_SYSTEM_INSTRUCTION, NODE_PROMPT_TEMPLATE,
+    parallel_plan.GENERAL_INSTRUCTION, parallel_plan.DAY_INSTRUCTION)
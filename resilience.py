@@ -0,0 +1,364 @@
+"""Circuit breakers, request deadlines, hedging and model fallback for upstream calls.
+
+Every dependency (OpenWeather, and each OpenAI model as "openai:<model>")
+has a CircuitBreaker per worker process. After BREAKER_FAILURE_THRESHOLD
+consecutive failures (timeouts, connection errors, 429 and 5xx) it opens,
+and for BREAKER_RECOVERY_SECONDS calls fail at once with CircuitOpen
+instead of each waiting out a timeout. Then a single trial call is let
+through, and its outcome closes the breaker or opens it again.
+
+deadline() gives a request a latency budget. Each upstream call made
+inside it gets at most the time that is left as its timeout, and none is
+started once the budget is spent (DeadlineExceeded).
+
+chat_completion() is how the app calls the chat completions API. Besides
+the breaker and the deadline it can hedge. When an answer takes longer
+than OPENAI_HEDGE_AFTER (seconds, or a percentile such as "p95" of this
+process's recent calls of the same size), a second request is sent and
+the first answer wins. The other call is left to finish in the background
+and its tokens are still billed. With OPENAI_FALLBACK_MODEL set, the hedge
+goes to that model, and so does a call whose primary model failed or has
+an open breaker.
+"""
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import openai
+import requests
+
+import metrics
+import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Successful call durations kept per (model, max_tokens) for the hedge percentile
+LATENCY_WINDOW = 200
+
+_deadline = contextvars.ContextVar("resilience_deadline", default=None)
+
+
+class CircuitOpen(Exception):
+    """The dependency failed repeatedly and is not being called for now."""
+
+    def __init__(self, dependency, retry_after):
+        super().__init__(f"{dependency} is unavailable (circuit open); retry after {retry_after}s")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's latency budget ran out."""
+
+    # Set when the dependency had at least half its usual timeout and still did not answer
+    slow_dependency = False
+
+
+@contextmanager
+def deadline(seconds):
+    """Run the block with a latency budget of seconds (0 or None: none). A nested budget can only shorten it."""
+    if not seconds:
+        yield
+        return
+    ends = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(ends if current is None else min(current, ends))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, or None without one."""
+    ends = _deadline.get()
+    return None if ends is None else ends - time.monotonic()
+
+
+def timeout(default):
+    """(seconds, capped): default, or what is left of the budget if that is less.
+
+    Raises DeadlineExceeded when nothing is left.
+    """
+    left = remaining()
+    if left is None or left >= default:
+        return default, False
+    if left <= 0:
+        metrics.inc("deadline_exceeded_total")
+        raise DeadlineExceeded("request latency budget exhausted")
+    return left, True
+
+
+def is_failure(exc):
+    """Whether exc says the dependency is unhealthy, rather than that the request was bad."""
+    if isinstance(exc, (openai.APIConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+    elif isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+    else:
+        return False
+    return status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """Closed, open or half-open state of one dependency in this process; see the module docstring."""
+
+    def __init__(self, name, failure_threshold=None, recovery_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.BREAKER_FAILURE_THRESHOLD
+        self.recovery_seconds = recovery_seconds or settings.BREAKER_RECOVERY_SECONDS
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(1, math.ceil(self._opened_at + self.recovery_seconds - time.monotonic()))
+
+    def _cooled_down(self):
+        return time.monotonic() - self._opened_at >= self.recovery_seconds
+
+    def _set(self, state):
+        if state == self.state:
+            return
+        if self.state == CLOSED:
+            metrics.gauge_add("circuit_open", 1, dependency=self.name)
+        elif state == CLOSED:
+            metrics.gauge_add("circuit_open", -1, dependency=self.name)
+        metrics.inc("circuit_transitions_total", dependency=self.name, state=state)
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit for {self.name} is now {state}" + (f" after {self._failures} failures" if state == OPEN else ""))
+        self.state = state
+
+    def _reject(self):
+        metrics.inc("circuit_rejected_total", dependency=self.name)
+        raise CircuitOpen(self.name, self.retry_after())
+
+    def check(self):
+        """Raise CircuitOpen if a call would be refused now, without taking the trial call."""
+        if self.state == HALF_OPEN or (self.state == OPEN and not self._cooled_down()):
+            self._reject()
+
+    def allow(self):
+        """Let a call through or raise CircuitOpen; once cooled down, only one trial call passes."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self._cooled_down():
+                self._set(HALF_OPEN)
+                return
+        self._reject()
+
+    def record(self, ok):
+        """Outcome of an allowed call: True, False (a dependency failure) or None (says nothing about it)."""
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self._set(CLOSED)
+            elif ok is None:
+                if self.state == HALF_OPEN:
+                    self._set(OPEN)  # still cooled down: the next call is the trial
+            else:
+                self._failures += 1
+                if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                    self._opened_at = time.monotonic()
+                    self._set(OPEN)
+
+    @contextmanager
+    def call(self):
+        """Guard one call: raises CircuitOpen instead of making it, and records how it went."""
+        self.allow()
+        try:
+            yield
+        except DeadlineExceeded as e:
+            self.record(False if e.slow_dependency else None)
+            raise
+        except Exception as e:
+            # An answered bad request still shows the dependency is up
+            self.record(not is_failure(e))
+            raise
+        except BaseException:
+            self.record(None)  # e.g. a stream closed by the client
+            raise
+        else:
+            self.record(True)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """This process's CircuitBreaker for the dependency called name."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def dependencies():
+    """Breaker names of the configured upstream dependencies."""
+    models = [settings.OPENAI_MODEL] + ([settings.OPENAI_FALLBACK_MODEL] if settings.OPENAI_FALLBACK_MODEL else [])
+    return ["openweather"] + [f"openai:{model}" for model in models]
+
+
+def reset():
+    """Forget this process's breakers and call latencies (e.g. between test scenarios)."""
+    with _breakers_lock:
+        for breaker in _breakers.values():
+            if breaker.state != CLOSED:
+                metrics.gauge_add("circuit_open", -1, dependency=breaker.name)
+        _breakers.clear()
+    with _latencies_lock:
+        _latencies.clear()
+
+
+def states():
+    """{dependency: state} of the breakers this process has used."""
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+@contextmanager
+def guarded(dependency, default_timeout):
+    """The dependency's breaker and the request deadline around one call. Yields the timeout to use.
+
+    A timeout that was cut short by the budget becomes DeadlineExceeded. It
+    only counts against the dependency if the call still had at least half
+    of default_timeout.
+    """
+    seconds, capped = timeout(default_timeout)
+    with breaker(dependency).call():
+        try:
+            yield seconds
+        except (openai.APITimeoutError, requests.exceptions.Timeout) as e:
+            if not capped:
+                raise
+            metrics.inc("deadline_exceeded_total")
+            error = DeadlineExceeded(f"{dependency} did not answer within the request latency budget")
+            error.slow_dependency = seconds >= default_timeout / 2
+            raise error from e
+
+
+def available_model(model):
+    """model, or OPENAI_FALLBACK_MODEL while model's breaker is open. Raises CircuitOpen if neither can be called."""
+    try:
+        breaker(f"openai:{model}").check()
+        return model
+    except CircuitOpen:
+        fallback = settings.OPENAI_FALLBACK_MODEL
+        if not fallback or fallback == model:
+            raise
+        breaker(f"openai:{fallback}").check()
+        return fallback
+
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def _record_latency(key, seconds):
+    with _latencies_lock:
+        _latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def _percentile(key, p):
+    with _latencies_lock:
+        values = sorted(_latencies.get(key, ()))
+    if len(values) < settings.HEDGE_MIN_SAMPLES:
+        return None
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def hedge_delay(key):
+    """Seconds to wait before hedging a call, or None to not hedge it."""
+    after = settings.OPENAI_HEDGE_AFTER
+    if not after:
+        return None
+    if after.startswith("p"):
+        return _percentile(key, float(after[1:]))
+    return float(after)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    """Threads for hedged calls; per process, since threads do not survive a fork."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=2 * settings.HTTP_POOL_SIZE, thread_name_prefix="hedge")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _call(client, kwargs, tried):
+    """One completion under its model's breaker, with a timeout capped by the deadline."""
+    model = kwargs["model"]
+    tried.add(model)
+    with guarded(f"openai:{model}", settings.OPENAI_READ_TIMEOUT) as seconds, metrics.timer("openai"):
+        if seconds < settings.OPENAI_READ_TIMEOUT:
+            kwargs = dict(kwargs, timeout=openai.Timeout(seconds, connect=min(settings.OPENAI_CONNECT_TIMEOUT, seconds)))
+        if remaining() is not None:
+            # The client's own retries would each get the full timeout again
+            client = client.with_options(max_retries=0)
+        started = time.monotonic()
+        completion = client.chat.completions.create(**kwargs)
+    _record_latency((model, kwargs.get("max_tokens")), time.monotonic() - started)
+    metrics.record_usage(completion.usage)
+    return completion
+
+
+def _hedged(client, kwargs, tried):
+    delay = hedge_delay((kwargs["model"], kwargs.get("max_tokens")))
+    left = remaining()
+    if delay is None or (left is not None and left <= delay):
+        return _call(client, kwargs, tried)
+
+    pool = _executor()
+    primary = pool.submit(contextvars.copy_context().run, _call, client, kwargs, tried)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    hedge_model = settings.OPENAI_FALLBACK_MODEL or kwargs["model"]
+    logger.info(f"OpenAI call to {kwargs['model']} still running after {delay:.1f}s; hedging with {hedge_model}")
+    metrics.inc("hedged_requests_total", model=hedge_model)
+    hedge = pool.submit(contextvars.copy_context().run, _call, client, dict(kwargs, model=hedge_model), tried)
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                metrics.inc("hedge_outcomes_total", winner="hedge" if future is hedge else "primary")
+                return future.result()
+            if error is None or future is primary:
+                error = future.exception()
+    raise error
+
+
+def chat_completion(client, **kwargs):
+    """client.chat.completions.create(**kwargs), not streamed, with breaker, deadline, hedge and fallback."""
+    tried = set()
+    try:
+        return _hedged(client, kwargs, tried)
+    except Exception as e:
+        fallback = settings.OPENAI_FALLBACK_MODEL
+        if not fallback or fallback in tried or not (isinstance(e, CircuitOpen) or is_failure(e)):
+            raise
+        logger.warning(f"OpenAI model {kwargs['model']} failed ({type(e).__name__}: {e}); falling back to {fallback}")
+        metrics.inc("openai_fallbacks_total", model=fallback)
+        return _call(client, dict(kwargs, model=fallback), tried)
@@ -0,0 +1,177 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runtime state (job queue, caches) lives here; shared by every gunicorn worker
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join(BASE_DIR, "instance"))
+
+# API Keys from .env
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
+SMTP_HOST = os.environ.get("SMTP_HOST")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 465))
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+EMAIL_FROM = os.environ.get("EMAIL_FROM")
+FLASK_PORT = int(os.environ.get("FLASK_PORT", 3000))
+FLASK_DEBUG = os.environ.get("FLASK_DEBUG", "False").lower() == "true"
+
+# Background job queue
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(DATA_DIR, "jobs.db"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 900))
+# A running job renews its claim this often; one not renewed for JOB_STALE_SECONDS is retried elsewhere
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", JOB_STALE_SECONDS / 3))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 86400))
+
+# Plan cache (content-addressed on the normalized prompt inputs)
+PLAN_CACHE_ENABLED = os.environ.get("PLAN_CACHE_ENABLED", "True").lower() == "true"
+PLAN_CACHE_PATH = os.environ.get("PLAN_CACHE_PATH", os.path.join(DATA_DIR, "plan_cache.db"))
+PLAN_CACHE_TTL = int(os.environ.get("PLAN_CACHE_TTL", 12 * 3600))
+PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("PLAN_CACHE_MAX_ENTRIES", 5000))
+
+# Weather lookups (snapped to a lat/lon grid and cached across workers)
+OPENWEATHER_URL = os.environ.get("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_GRID_DEG = float(os.environ.get("WEATHER_GRID_DEG", 0.1))
+WEATHER_CACHE_TTL = int(os.environ.get("WEATHER_CACHE_TTL", 1800))
+WEATHER_CACHE_PATH = os.environ.get("WEATHER_CACHE_PATH", os.path.join(DATA_DIR, "weather_cache.db"))
+WEATHER_TIMEOUT = float(os.environ.get("WEATHER_TIMEOUT", 10))
+WEATHER_CONNECT_TIMEOUT = float(os.environ.get("WEATHER_CONNECT_TIMEOUT", 3))
+
+# Per-process HTTP clients. The pool is sized to the number of threads that can
+# call out at once: request threads per worker plus the background job threads.
+WORKER_THREADS = int(os.environ.get("GUNICORN_THREADS", 16))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", WORKER_THREADS + JOB_WORKERS))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", 300))
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
+
+# Plan generation: "single" asks for all seven days in one completion,
+# "parallel" fans out one call per day plus one for the general section
+PLAN_GENERATION_MODE = os.environ.get("PLAN_GENERATION_MODE", "single")
+PARALLEL_MAX_CONCURRENCY = int(os.environ.get("PARALLEL_MAX_CONCURRENCY", 8))
+PARALLEL_MAX_RETRIES = int(os.environ.get("PARALLEL_MAX_RETRIES", 2))
+PARALLEL_DAY_MAX_TOKENS = int(os.environ.get("PARALLEL_DAY_MAX_TOKENS", 800))
+PARALLEL_GENERAL_MAX_TOKENS = int(os.environ.get("PARALLEL_GENERAL_MAX_TOKENS", 600))
+
+# PDF rendering
+PDF_FONT_CACHE = os.environ.get("PDF_FONT_CACHE", "True").lower() == "true"
+
+# Nutrition targets and candidate foods in the prompts (nutrition.py). foods.csv
+# is compiled to FOODS_INDEX_PATH and memory-mapped
+NUTRITION_ENABLED = os.environ.get("NUTRITION_ENABLED", "True").lower() == "true"
+FOODS_CSV_PATH = os.environ.get("FOODS_CSV_PATH", os.path.join(BASE_DIR, "foods.csv"))
+FOODS_INDEX_PATH = os.environ.get("FOODS_INDEX_PATH", os.path.join(DATA_DIR, "foods.bin"))
+NUTRITION_ACTIVITY_FACTOR = float(os.environ.get("NUTRITION_ACTIVITY_FACTOR", 1.375))  # lightly active
+NUTRITION_FOODS_PER_GROUP = int(os.environ.get("NUTRITION_FOODS_PER_GROUP", 4))
+
+# Startup warmup (warmup.py): template, SDK and tokenizer loaded before
+# gunicorn forks, and each worker's clients built in post_fork
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "True").lower() == "true"
+
+# Email outbox: messages are queued and sent by background threads
+SMTP_SECURITY = os.environ.get("SMTP_SECURITY", "ssl").lower()  # ssl, starttls or none
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", os.path.join(DATA_DIR, "outbox.db"))
+OUTBOX_SENDERS = int(os.environ.get("OUTBOX_SENDERS", 1))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", 30))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 2.0))
+SMTP_IDLE_SECONDS = float(os.environ.get("SMTP_IDLE_SECONDS", 60))
+# Sent messages (recipient, subject, body) are deleted this long after sending
+OUTBOX_RETENTION_SECONDS = int(os.environ.get("OUTBOX_RETENTION_SECONDS", 7 * 86400))
+
+# Batch generation (/generate-batch). The limits are per worker process and
+# shared by every batch it runs; the rate counts model calls, so a profile in
+# parallel mode uses one call per day plus one.
+BATCH_MAX_RECORDS = int(os.environ.get("BATCH_MAX_RECORDS", 5000))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
+BATCH_RATE_PER_MINUTE = float(os.environ.get("BATCH_RATE_PER_MINUTE", 60))
+BATCH_OUTPUT_DIR = os.environ.get("BATCH_OUTPUT_DIR", os.path.join(DATA_DIR, "batches"))
+
+# Prompt compaction for Node metadata: tracking series are summarized over the
+# last PROMPT_SERIES_WINDOW entries and the serialized metadata is trimmed to
+# PROMPT_TOKEN_BUDGET tokens
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 1500))
+PROMPT_SERIES_WINDOW = int(os.environ.get("PROMPT_SERIES_WINDOW", 7))
+
+# Metrics: per-process files aggregated by /metrics; /health readiness looks at
+# the last HEALTH_WINDOW_SECONDS of stage outcomes
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 2.0))
+HEALTH_WINDOW_SECONDS = float(os.environ.get("HEALTH_WINDOW_SECONDS", 300))
+HEALTH_MAX_ERROR_RATIO = float(os.environ.get("HEALTH_MAX_ERROR_RATIO", 0.5))
+HEALTH_MAX_OUTBOX_PENDING = int(os.environ.get("HEALTH_MAX_OUTBOX_PENDING", 500))
+
+# Logging: JSON lines in a size-rotated file, written by a single listener
+LOG_FILE = os.environ.get("LOG_FILE", os.path.join(BASE_DIR, "app.log"))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides, "name=LEVEL,..."; fontTools alone logs a line per subset table
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "fontTools=WARNING,httpx=WARNING,httpcore=WARNING,openai=WARNING,urllib3=WARNING")
+LOG_CONSOLE_FORMAT = os.environ.get("LOG_CONSOLE_FORMAT", "text").lower()  # text or json
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Admission control: model calls in flight per worker process. Requests that
+# cannot get a slot within LLM_ADMISSION_WAIT seconds get 429 + Retry-After;
+# jobs and batches wait. The default is three quarters of GUNICORN_THREADS
+# (12 of 16, 6 of 8, 3 of 4, and at least 2 unless there is one thread), so the
+# spare threads can still answer cache hits, /health and the 429s themselves.
+# A slot is only taken once a request needs the model, so cache hits are
+# never turned away.
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", max(min(2, WORKER_THREADS), WORKER_THREADS * 3 // 4)))
+LLM_ADMISSION_WAIT = float(os.environ.get("LLM_ADMISSION_WAIT", 0))
+
+# Idempotency: duplicate /generate and /generate-diet-from-node-data requests
+# (Idempotency-Key header, or same payload) share one execution; results are
+# replayed for IDEMPOTENCY_TTL seconds. A run whose worker died is taken over
+# after IDEMPOTENCY_LEASE_SECONDS.
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "True").lower() == "true"
+IDEMPOTENCY_DB_PATH = os.environ.get("IDEMPOTENCY_DB_PATH", os.path.join(DATA_DIR, "idempotency.db"))
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 600))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 360))
+
+# Incremental refresh of Node plans: the last plan per user is stored in
+# sections and only the sections whose inputs changed are regenerated.
+# Numeric profile fields may drift by PLAN_DIFF_TOLERANCE (relative) first,
+# and the recent mean of a tracking series (weight, sleep, water logs) by
+# PLAN_SERIES_TOLERANCE, so one new log entry does not regenerate the plan.
+PLAN_STORE_ENABLED = os.environ.get("PLAN_STORE_ENABLED", "True").lower() == "true"
+PLAN_STORE_PATH = os.environ.get("PLAN_STORE_PATH", os.path.join(DATA_DIR, "plan_store.db"))
+PLAN_DIFF_TOLERANCE = float(os.environ.get("PLAN_DIFF_TOLERANCE", 0.05))
+PLAN_SERIES_TOLERANCE = float(os.environ.get("PLAN_SERIES_TOLERANCE", 0.15))
+
+# Rendered PDFs, content-addressed by the plan text and served from
+# /plans/<id>.pdf; least recently used files go once they add up to
+# ARTIFACT_MAX_BYTES, and plans unused for ARTIFACT_TTL seconds are forgotten
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(DATA_DIR, "artifacts"))
+ARTIFACT_DB_PATH = os.environ.get("ARTIFACT_DB_PATH", os.path.join(DATA_DIR, "artifacts.db"))
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", 512 * 1024 * 1024))
+ARTIFACT_TTL = int(os.environ.get("ARTIFACT_TTL", 30 * 86400))
+ARTIFACT_MAX_AGE = int(os.environ.get("ARTIFACT_MAX_AGE", 86400))
+
+# Plan output: "markdown" (free text) or "json" (the model fills the
+# plan_model.py schema; markdown, PDF and API JSON are built from it).
+# Requests can override it with "output_format".
+PLAN_OUTPUT_FORMAT = os.environ.get("PLAN_OUTPUT_FORMAT", "markdown").lower()
+STRUCTURED_MAX_TOKENS = int(os.environ.get("STRUCTURED_MAX_TOKENS", 6000))
+
+# Resilience (resilience.py): a dependency's circuit breaker opens after
+# BREAKER_FAILURE_THRESHOLD consecutive failures and lets one trial call
+# through after BREAKER_RECOVERY_SECONDS. /generate and
+# /generate-diet-from-node-data get REQUEST_BUDGET_SECONDS in all (0: no
+# budget), below gunicorn's 300 s timeout. OPENAI_HEDGE_AFTER ("" for off,
+# seconds, or a percentile like "p95" over the last calls once there are
+# HEDGE_MIN_SAMPLES) sends a second completion when the first is slow.
+# OPENAI_FALLBACK_MODEL takes the hedges and the calls OPENAI_MODEL fails.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RECOVERY_SECONDS = float(os.environ.get("BREAKER_RECOVERY_SECONDS", 30))
+REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", 240))
+OPENAI_HEDGE_AFTER = os.environ.get("OPENAI_HEDGE_AFTER", "").lower()
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+OPENAI_FALLBACK_MODEL = os.environ.get("OPENAI_FALLBACK_MODEL", "")
@@ -19,6 +19,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const planContainer = document.getElementById('planContainer');
     const metaDataDiv = document.getElementById('metaData');
     const planOutputDiv = document.getElementById('planOutput');
+    const submitBtn = form.querySelector('button[type="submit"]');
+    let submitting = false;
 
     const converter = typeof showdown !== 'undefined' ? new showdown.Converter({
         tables: true,
@@ -74,43 +76,133 @@ document.addEventListener('DOMContentLoaded', function () {
         );
     });
 
+    // --- Plan Rendering ---
+    function renderMeta(data) {
+        metaDataDiv.innerHTML = `
+                <h3 class="text-lg font-semibold font-sans !text-emerald-900 !border-none !m-0 !p-0">Your Plan Details</h3>
+                <ul class="list-disc list-inside mt-2 text-sm">
+                    <li><strong>Location:</strong> ${data.used_location}</li>
+                    <li><strong>Weather:</strong> ${data.used_weather}</li>
+                    <li><strong>Starting Day:</strong> ${data.current_day}</li>
+                </ul>`;
+    }
+
+    // Completed sections (everything before the last "### " heading) are converted
+    // once; only the section still being written is re-rendered as text arrives.
+    let renderedSections = 0;
+    let renderPending = false;
+    let streamDone = false;
+    let planText = '';
+
+    function renderPlan(final) {
+        renderPending = false;
+        if (!converter) {
+            planOutputDiv.textContent = planText;
+            return;
+        }
+        const sections = planText.split(/\n(?=### )/);
+        const complete = final ? sections.length : sections.length - 1;
+        while (renderedSections < complete) {
+            const section = document.createElement('div');
+            section.innerHTML = converter.makeHtml(sections[renderedSections]);
+            planOutputDiv.insertBefore(section, planOutputDiv.querySelector('.plan-partial'));
+            renderedSections++;
+        }
+        let partial = planOutputDiv.querySelector('.plan-partial');
+        if (final) {
+            if (partial) partial.remove();
+            return;
+        }
+        if (!partial) {
+            partial = document.createElement('div');
+            partial.className = 'plan-partial';
+            planOutputDiv.appendChild(partial);
+        }
+        partial.innerHTML = converter.makeHtml(sections[sections.length - 1]);
+    }
+
+    function scheduleRender() {
+        if (!renderPending) {
+            renderPending = true;
+            window.requestAnimationFrame(() => {
+                if (!streamDone) renderPlan(false);
+            });
+        }
+    }
+
+    function handleEvent(event, data) {
+        if (event === 'meta') {
+            renderMeta(data);
+        } else if (event === 'delta') {
+            if (!planText) {
+                loadingDiv.classList.add('hidden');
+                planContainer.classList.remove('hidden');
+            }
+            planText += data.text;
+            scheduleRender();
+        } else if (event === 'error') {
+            throw new Error(data.error);
+        }
+    }
+
+    // Parse a Server-Sent Events body from fetch() (EventSource cannot POST)
+    async function readEventStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (data) handleEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
     // --- Form Submission Logic ---
     form.addEventListener('submit', async function (event) {
         event.preventDefault();
+        // One generation at a time: a double click would start (and email) a second plan
+        if (submitting) return;
+        submitting = true;
+        submitBtn.disabled = true;
+        submitBtn.classList.add('opacity-50', 'cursor-not-allowed');
         resultsDiv.classList.remove('hidden');
         loadingDiv.classList.remove('hidden');
         errorDiv.classList.add('hidden');
         planContainer.classList.add('hidden');
+        planOutputDiv.innerHTML = '';
+        planText = '';
+        renderedSections = 0;
+        streamDone = false;
         window.scrollTo({ top: resultsDiv.offsetTop - 40, behavior: 'smooth' });
 
         const formData = new FormData(form);
 
         try {
-            const response = await fetch('/generate', {
+            const response = await fetch('/generate-stream', {
                 method: 'POST',
                 body: formData,
             });
-            const data = await response.json();
 
             if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
                 throw new Error(data.error || `HTTP error! status: ${response.status}`);
             }
 
-            metaDataDiv.innerHTML = `
-                <h3 class="text-lg font-semibold font-sans !text-emerald-900 !border-none !m-0 !p-0">Your Plan Details</h3>
-                <ul class="list-disc list-inside mt-2 text-sm">
-                    <li><strong>Location:</strong> ${data.used_location}</li>
-                    <li><strong>Weather:</strong> ${data.used_weather}</li>
-                    <li><strong>Starting Day:</strong> ${data.current_day}</li>
-                </ul>`;
-            
-            if (converter) {
-                const htmlPlan = converter.makeHtml(data.plan);
-                planOutputDiv.innerHTML = htmlPlan;
-            } else {
-                planOutputDiv.textContent = data.plan;
-            }
-            
+            await readEventStream(response);
+            streamDone = true;
+            renderPlan(true);
             planContainer.classList.remove('hidden');
 
         } catch (err) {
@@ -118,6 +210,9 @@ document.addEventListener('DOMContentLoaded', function () {
             errorDiv.classList.remove('hidden');
         } finally {
             loadingDiv.classList.add('hidden');
+            submitting = false;
+            submitBtn.disabled = false;
+            submitBtn.classList.remove('opacity-50', 'cursor-not-allowed');
         }
     });
 });
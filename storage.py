@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def connect(path, schema=None):
+    """Return a SQLite connection for this thread and process.
+
+    Connections are never shared across threads or across a fork, so every
+    gunicorn worker (and every thread inside it) gets its own handle on the
+    shared database file. ``schema`` is executed once when the connection
+    is opened, so it should only contain idempotent ``IF NOT EXISTS`` DDL.
+    """
+    pid = os.getpid()
+    cache = getattr(_local, "connections", None)
+    if cache is None or getattr(_local, "pid", None) != pid:
+        cache = _local.connections = {}
+        _local.pid = pid
+
+    conn = cache.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        if schema:
+            conn.executescript(schema)
+        cache[path] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    """Run a block inside BEGIN IMMEDIATE so concurrent writers serialize."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
@@ -0,0 +1,137 @@
+"""Warm the app up before it serves traffic, and time how long that takes.
+
+app.py imports this module first, so report() can tell how long importing
+the app took. preload(app) then runs once in the importing process. Under
+gunicorn's preload_app that is the master, before it forks, so everything
+loaded here is shared by every worker copy-on-write, including workers
+started later to replace recycled ones (max_requests):
+- the parsed PDF fonts (also with WARMUP_ENABLED=False);
+- the compiled index.html template;
+- the parts of the OpenAI SDK and TLS stack that are only imported when
+  the first client is built;
+- the tiktoken encoding, when tiktoken is installed;
+- the memory-mapped food index (nutrition.py), compiled first if needed.
+Finally gc.freeze() moves all of it out of the collector's reach, so a
+worker's garbage collections do not write to, and so copy, those pages.
+
+worker_init() runs in each worker from gunicorn's post_fork hook, or before
+app.run() in the dev server. It starts the job workers (jobs.py) and email
+senders (outbox.py), so work left queued by a restart is resumed without
+waiting for traffic. It then builds the worker's OpenAI client and HTTP
+session (clients.py), so the first request does not pay for them.
+
+The timings are logged and shown under "startup" in /health. Each worker
+also exports diet_worker_init_seconds, and diet_first_request_seconds{route}
+for the first request to each route. benchmarks/bench_startup.py measures
+them and guards against regressions. Set WARMUP_ENABLED=False to compare.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+
+import metrics
+import settings
+
+# The heavy modules (openai, fpdf, flask) are imported after this, by app.py
+IMPORT_STARTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+_report = {"import_seconds": None, "preload": {}, "worker_init_seconds": None}
+_seen_routes = set()
+_seen_pid = None
+_seen_lock = threading.Lock()
+
+
+def _step(name, fn):
+    started = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        logger.warning(f"Warmup step {name} failed: {type(e).__name__}: {e}")
+    _report["preload"][name] = round(time.perf_counter() - started, 4)
+
+
+def _load_fonts():
+    import pdf_renderer
+    pdf_renderer.load_fonts()
+
+
+def _load_openai():
+    import openai
+    # Building a client imports the SDK's resources and loads the CA bundle; this one is
+    # closed again at once, so no connection crosses the fork
+    client = openai.OpenAI(api_key=settings.OPENAI_API_KEY or "warmup", http_client=openai.DefaultHttpxClient())
+    client.chat.completions
+    client.close()
+
+
+def _load_tokenizer():
+    import prompt_compaction
+    prompt_compaction.count_tokens("")
+
+
+def _load_foods():
+    import nutrition
+    if settings.NUTRITION_ENABLED:
+        nutrition.load()
+
+
+def preload(app):
+    """Load what the workers share, in the process that imports the app (before fork)."""
+    _report["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 4)
+    _step("fonts", _load_fonts)
+    if settings.WARMUP_ENABLED:
+        _step("template", lambda: app.jinja_env.get_template("index.html"))
+        _step("openai", _load_openai)
+        _step("tokenizer", _load_tokenizer)
+        _step("foods", _load_foods)
+        gc.freeze()
+    logger.info(f"App imported in {_report['import_seconds']:.2f}s; preloaded "
+                + ", ".join(f"{name} in {seconds:.3f}s" for name, seconds in _report["preload"].items()))
+
+
+def worker_init():
+    """Start this worker's background threads and build its clients (gunicorn post_fork)."""
+    import jobs
+    import outbox
+    # Queued jobs and pending or retried emails left by a restart or a recycled
+    # worker are picked up now rather than on the next request that enqueues one
+    jobs.start_workers()
+    outbox.start_senders()
+    if not settings.WARMUP_ENABLED:
+        return
+    import clients
+    started = time.perf_counter()
+    try:
+        clients.openai_client().chat.completions
+        clients.http_session()
+    except Exception as e:
+        logger.warning(f"Worker warmup failed: {type(e).__name__}: {e}")
+    seconds = time.perf_counter() - started
+    _report["worker_init_seconds"] = round(seconds, 4)
+    metrics.observe("worker_init_seconds", seconds)
+    logger.info(f"Worker {os.getpid()} warmed up in {seconds:.3f}s")
+
+
+def request_finished(route, seconds):
+    """Record the first request to each route in this process."""
+    global _seen_pid
+    if _seen_pid == os.getpid() and route in _seen_routes:
+        return
+    with _seen_lock:
+        if _seen_pid != os.getpid():
+            _seen_routes.clear()
+            _seen_pid = os.getpid()
+        if route in _seen_routes:
+            return
+        _seen_routes.add(route)
+    metrics.observe("first_request_seconds", seconds, route=route)
+    logger.info(f"First {route} request in process {os.getpid()} took {seconds:.3f}s")
+
+
+def report():
+    """Startup timings of this process, for /health."""
+    return dict(_report, pid=os.getpid(), warmup_enabled=settings.WARMUP_ENABLED)
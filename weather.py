@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import clients
+import metrics
+import resilience
+import settings
+import storage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather (
+    cell TEXT PRIMARY KEY,
+    location_name TEXT,
+    weather_desc TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    cell TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+NOT_AVAILABLE = "Not available"
+
+_cell_locks = {}  # cell -> [lock, threads using it]
+_cell_locks_guard = threading.Lock()
+
+
+def _lock_cell(cell):
+    """Per-cell lock, counted so it can be dropped when no thread needs it (cells are unbounded)."""
+    with _cell_locks_guard:
+        entry = _cell_locks.setdefault(cell, [threading.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+
+def _unlock_cell(cell):
+    with _cell_locks_guard:
+        entry = _cell_locks[cell]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _cell_locks[cell]
+
+
+def _db():
+    return storage.connect(settings.WEATHER_CACHE_PATH, _SCHEMA)
+
+
+def snap(latitude, longitude, grid=None):
+    """Snap coordinates to the centre of their grid cell. Returns None for bad input."""
+    grid = grid or settings.WEATHER_GRID_DEG
+    try:
+        lat = round(float(latitude) / grid) * grid
+        lon = round(float(longitude) / grid) * grid
+    except (TypeError, ValueError):
+        return None
+    decimals = max(0, len(f"{grid:.10f}".rstrip("0").split(".")[1]))
+    return round(lat, decimals), round(lon, decimals)
+
+
+def _cached(cell):
+    row = _db().execute(
+        "SELECT location_name, weather_desc, fetched_at FROM weather WHERE cell = ?", (cell,)
+    ).fetchone()
+    if row is None or time.time() - row["fetched_at"] > settings.WEATHER_CACHE_TTL:
+        return None
+    return row["location_name"], row["weather_desc"]
+
+
+def _acquire_lease(cell, owner):
+    now = time.time()
+    conn = _db()
+    with storage.transaction(conn):
+        row = conn.execute("SELECT owner, expires_at FROM leases WHERE cell = ?", (cell,)).fetchone()
+        if row is not None and row["expires_at"] > now and row["owner"] != owner:
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO leases (cell, owner, expires_at) VALUES (?, ?, ?)",
+            (cell, owner, now + settings.WEATHER_TIMEOUT + 1),
+        )
+    return True
+
+
+def _release_lease(cell, owner):
+    _db().execute("DELETE FROM leases WHERE cell = ? AND owner = ?", (cell, owner))
+
+
+def _wait_for_other_worker(cell):
+    """Another process is already fetching this cell; poll the cache until its lease expires."""
+    deadline = time.time() + settings.WEATHER_TIMEOUT + 1
+    while time.time() < deadline:
+        time.sleep(0.1)
+        cached = _cached(cell)
+        if cached is not None:
+            return cached
+    return None
+
+
+def _fetch(lat, lon):
+    # While the breaker is open this raises CircuitOpen at once instead of waiting out the timeout
+    with resilience.guarded("openweather", settings.WEATHER_TIMEOUT) as read_timeout:
+        resp = clients.http_session().get(
+            settings.OPENWEATHER_URL,
+            params={"lat": lat, "lon": lon, "appid": settings.OPENWEATHER_API_KEY, "units": "metric"},
+            timeout=(min(settings.WEATHER_CONNECT_TIMEOUT, read_timeout), read_timeout),
+        )
+        resp.raise_for_status()
+    w_data = resp.json()
+
+    location_name = None
+    city = w_data.get("name", "")
+    country = w_data.get("sys", {}).get("country", "")
+    if city and country:
+        location_name = f"{city}, {country}"
+
+    weather_main = w_data.get("weather", [{}])[0].get("description", "clear sky")
+    temp = w_data.get("main", {}).get("temp")
+    if temp is not None:
+        weather_desc = f"{weather_main.title()}, Temp: {temp}°C"
+    else:
+        weather_desc = weather_main.title()
+    return location_name, weather_desc
+
+
+def _resolve(cell, lat, lon):
+    cached = _cached(cell)
+    if cached is not None:
+        logger.info(f"Weather cache hit for cell {cell}")
+        metrics.inc("cache_requests_total", cache="weather", result="hit")
+        return cached
+
+    owner = f"{os.getpid()}-{threading.get_ident()}"
+    if not _acquire_lease(cell, owner):
+        # No point waiting for another worker's fetch from a dependency known to be down
+        resilience.breaker("openweather").check()
+        cached = _wait_for_other_worker(cell)
+        if cached is not None:
+            logger.info(f"Weather for cell {cell} fetched by another worker")
+            metrics.inc("cache_requests_total", cache="weather", result="shared")
+            return cached
+
+    metrics.inc("cache_requests_total", cache="weather", result="miss")
+    try:
+        with metrics.timer("openweather"):
+            location_name, weather_desc = _fetch(lat, lon)
+        _db().execute(
+            "INSERT OR REPLACE INTO weather (cell, location_name, weather_desc, fetched_at) VALUES (?, ?, ?, ?)",
+            (cell, location_name, weather_desc, time.time()),
+        )
+        logger.info(f"Weather API Success - Location: {location_name}, Weather: {weather_desc}")
+        return location_name, weather_desc
+    finally:
+        _release_lease(cell, owner)
+
+
+def lookup(latitude, longitude, fallback_location="Unknown"):
+    """Resolve (location_name, weather_desc) for a coordinate.
+
+    Falls back to ``fallback_location`` and "Not available" when there are no
+    coordinates, no API key, or the upstream call fails or is skipped by
+    its circuit breaker.
+    """
+    if not (latitude and longitude and settings.OPENWEATHER_API_KEY):
+        return fallback_location, NOT_AVAILABLE
+
+    snapped = snap(latitude, longitude)
+    if snapped is None:
+        logger.warning(f"Invalid coordinates: {latitude}, {longitude}")
+        return fallback_location, NOT_AVAILABLE
+
+    lat, lon = snapped
+    cell = f"{lat}:{lon}"
+    # Threads in this process wait on the lock; other processes coordinate through the lease table
+    lock = _lock_cell(cell)
+    try:
+        with lock:
+            location_name, weather_desc = _resolve(cell, lat, lon)
+    except (requests.exceptions.RequestException, resilience.CircuitOpen, resilience.DeadlineExceeded) as ex:
+        logger.warning(f"Weather API failed: {ex}")
+        return fallback_location, NOT_AVAILABLE
+    finally:
+        _unlock_cell(cell)
+
+    return location_name or fallback_location, weather_desc